@@ -1,6 +1,25 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
+
+
+def invalidate_cached_user(sender, instance, **kwargs):
+    from .auth import user_cache
+    user_cache.invalidate(instance.pk)
+
+
+def invalidate_refreshed_user(sender, request, user, **kwargs):
+    from .auth import user_cache
+    user_cache.invalidate(user.pk)
 
 
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        # JWT requests resolve their user from accounts.auth.user_cache
+        from graphql_jwt.signals import token_refreshed
+        from .models import User
+        post_save.connect(invalidate_cached_user, sender=User)
+        post_delete.connect(invalidate_cached_user, sender=User)
+        token_refreshed.connect(invalidate_refreshed_user)
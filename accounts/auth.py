@@ -0,0 +1,133 @@
+"""JWT authentication with a per-process cache of tokens and users.
+
+Clients poll with the same token, so each process keeps the decoded claims of
+recent tokens and the users they resolve to for AUTH_USER_CACHE_TIMEOUT
+seconds (never past the token's own expiry), evicting the least recently used
+beyond AUTH_USER_CACHE_SIZE. A user is dropped when they are saved, deleted or
+refresh their token, and when notifications change their unread count. Other
+processes only see those changes once their entry times out.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from graphql_jwt.backends import JSONWebTokenBackend
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.utils import get_credentials, get_payload, get_user_by_payload
+
+
+class _LRU:
+    def __init__(self):
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, timeout):
+        """Stores `value` and returns the values evicted to make room."""
+        self._entries[key] = (time.monotonic() + timeout, value)
+        self._entries.move_to_end(key)
+        evicted = []
+        while len(self._entries) > settings.AUTH_USER_CACHE_SIZE:
+            evicted.append(self._entries.popitem(last=False)[1][1])
+        return evicted
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._entries),
+        }
+
+
+class UserCache:
+    def __init__(self):
+        self._payloads = _LRU()
+        self._users = _LRU()
+        # user id -> username of the users in _users, so a user can be
+        # dropped by id
+        self._usernames = {}
+        self._lock = threading.Lock()
+
+    def payload(self, token, context=None):
+        with self._lock:
+            payload = self._payloads.get(token)
+        if payload is None:
+            # raises for invalid and expired tokens, which are never cached
+            payload = get_payload(token, context)
+            timeout = settings.AUTH_USER_CACHE_TIMEOUT
+            if 'exp' in payload:
+                timeout = min(timeout, payload['exp'] - time.time())
+            if timeout > 0:
+                with self._lock:
+                    self._payloads.set(token, payload, timeout)
+        return payload
+
+    def user(self, payload):
+        username = jwt_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER(payload)
+        with self._lock:
+            user = self._users.get(username)
+        if user is None:
+            user = get_user_by_payload(payload)
+            if user is None:
+                return None
+            with self._lock:
+                for evicted in self._users.set(username, user, settings.AUTH_USER_CACHE_TIMEOUT):
+                    self._usernames.pop(evicted.pk, None)
+                self._usernames[user.pk] = username
+        # every request gets its own copy to change
+        return copy.copy(user)
+
+    def get_user(self, token, context=None):
+        return self.user(self.payload(token, context))
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                username = self._usernames.pop(user_id, None)
+                if username is not None:
+                    self._users.pop(username)
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+            self._users.clear()
+            self._usernames.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'tokens': self._payloads.stats(), 'users': self._users.stats()}
+
+
+user_cache = UserCache()
+
+
+class CachedJSONWebTokenBackend(JSONWebTokenBackend):
+    """JSONWebTokenBackend that resolves tokens through `user_cache`."""
+
+    def authenticate(self, request=None, **kwargs):
+        if request is None or getattr(request, '_jwt_token_auth', False):
+            return None
+
+        token = get_credentials(request, **kwargs)
+        if token is not None:
+            return user_cache.get_user(token, request)
+        return None
@@ -0,0 +1,166 @@
+"""In-memory follow graph.
+
+Every process keeps both directions of the Following table as sorted arrays of
+user ids, so counts, relationship checks and intersections never touch the
+database. The graph is loaded on first use (the WSGI and ASGI entry points do
+this at startup), patched by the follow mutations once their transaction
+commits, and reloaded every FOLLOW_GRAPH_MAX_AGE seconds to pick up follows
+made by other processes. One thread reloads while the others go on with the
+graph they have, and the patches that land while it reads are applied again
+to what it read before it is swapped in.
+"""
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from django.conf import settings
+from django.db import DatabaseError
+
+EMPTY = array('q')
+
+
+def _contains(ids, user_id):
+    index = bisect_left(ids, user_id)
+    return index < len(ids) and ids[index] == user_id
+
+
+def _intersection(left, right):
+    if len(left) > len(right):
+        left, right = right, left
+    return [user_id for user_id in left if _contains(right, user_id)]
+
+
+class FollowGraph:
+    def __init__(self):
+        self._followers = {}
+        self._following = {}
+        self._loaded_at = None
+        # (follow, follower id, following id) patched while a reload reads
+        # the rows, None when no reload is running
+        self._patches = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def load(self):
+        with self._reload_lock:
+            self._load()
+
+    def _load(self):
+        from .models import Following
+        with self._lock:
+            self._patches = []
+        try:
+            followers, following = {}, {}
+            rows = Following.objects.order_by('follower_id', 'following_id').values_list('follower_id', 'following_id')
+            # rows arrive sorted by (follower, following), so both adjacency lists
+            # are built already in order
+            for follower_id, following_id in rows.iterator(chunk_size=10000):
+                following.setdefault(follower_id, array('q')).append(following_id)
+                followers.setdefault(following_id, array('q')).append(follower_id)
+            with self._lock:
+                # the rows may have been read before or after these committed,
+                # applying them again settles it either way
+                for follow, follower_id, following_id in self._patches:
+                    self._apply(followers, following, follow, follower_id, following_id)
+                self._followers, self._following = followers, following
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._patches = None
+
+    def warm(self):
+        try:
+            self._ensure_loaded()
+        except DatabaseError:
+            # the tables may not exist yet, e.g. before the first migrate
+            pass
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None:
+            # there is nothing to go on with yet
+            with self._reload_lock:
+                if self._loaded_at is None:
+                    self._load()
+        elif time.monotonic() - loaded_at > settings.FOLLOW_GRAPH_MAX_AGE:
+            # one thread reloads, the others go on with the current graph
+            if not self._reload_lock.acquire(blocking=False):
+                return
+            try:
+                if self._loaded_at == loaded_at:
+                    self._load()
+            finally:
+                self._reload_lock.release()
+
+    def _insert(self, adjacency, user_id, other_id):
+        ids = adjacency.setdefault(user_id, array('q'))
+        index = bisect_left(ids, other_id)
+        if index == len(ids) or ids[index] != other_id:
+            ids.insert(index, other_id)
+
+    def _remove(self, adjacency, user_id, other_id):
+        ids = adjacency.get(user_id, EMPTY)
+        index = bisect_left(ids, other_id)
+        if index < len(ids) and ids[index] == other_id:
+            del ids[index]
+
+    def _apply(self, followers, following, follow, follower_id, following_id):
+        if follow:
+            self._insert(following, follower_id, following_id)
+            self._insert(followers, following_id, follower_id)
+        else:
+            self._remove(following, follower_id, following_id)
+            self._remove(followers, following_id, follower_id)
+
+    def _patch(self, follow, follower_id, following_id):
+        with self._lock:
+            self._apply(self._followers, self._following, follow, follower_id, following_id)
+            if self._patches is not None:
+                self._patches.append((follow, follower_id, following_id))
+
+    def follow(self, follower_id, following_id):
+        self._patch(True, follower_id, following_id)
+
+    def unfollow(self, follower_id, following_id):
+        self._patch(False, follower_id, following_id)
+
+    def followers(self, user_id):
+        self._ensure_loaded()
+        return self._followers.get(user_id, EMPTY)
+
+    def following(self, user_id):
+        self._ensure_loaded()
+        return self._following.get(user_id, EMPTY)
+
+    def follower_count(self, user_id):
+        return len(self.followers(user_id))
+
+    def following_count(self, user_id):
+        return len(self.following(user_id))
+
+    def is_following(self, follower_id, following_id):
+        return _contains(self.following(follower_id), following_id)
+
+    def followed_by_followings(self, viewer_id, user_id):
+        """Accounts `viewer_id` follows that also follow `user_id`."""
+        return _intersection(self.following(viewer_id), self.followers(user_id))
+
+    def suggestions(self, user_id, limit):
+        """Friends-of-friends: accounts followed by the most of the accounts
+        `user_id` follows, excluding ones they already follow."""
+        following = self.following(user_id)
+        scores = Counter()
+        for followed_id in following[:settings.FOLLOW_SUGGESTION_FANOUT]:
+            scores.update(self.following(followed_id))
+        candidates = (
+            (score, candidate_id) for candidate_id, score in scores.items()
+            if candidate_id != user_id and not _contains(following, candidate_id)
+        )
+        # highest score first, older accounts first among equals
+        best = heapq.nsmallest(limit, candidates, key=lambda item: (-item[0], item[1]))
+        return [candidate_id for _, candidate_id in best]
+
+
+follow_graph = FollowGraph()
@@ -9,9 +9,16 @@ class User(DefaultUser):
     last_name = models.CharField(max_length=100)
     bio = models.TextField()
     location = models.CharField(max_length=20)
+    # kept by posts/notifications.py so the unread badge never counts rows
+    unread_notification_count = models.PositiveIntegerField(default=0)
+    notifications_read_at = models.DateTimeField(null=True)
 
     USERNAME_FIELD = 'username'
 
+    class Meta:
+        # users are listed newest first, see accounts/schema.py USER_KEYS
+        indexes = [models.Index(fields=['date_joined', 'id'])]
+
     def follower_count(self):
         return Following.objects.filter(following=self).count()
     
@@ -24,5 +31,10 @@ class Following(models.Model):
     created_at = models.DateTimeField(auto_now=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['follower', 'following'], name='unique_following')]
+        # the constraint covers lookups by follower, this one lookups of followers
+        indexes = [models.Index(fields=['following', 'follower'])]
+
     def unfollow(self):
         self.delete()
\ No newline at end of file
@@ -1,18 +1,27 @@
 import graphene
 import graphql_jwt
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from graphql import GraphQLError
-from .schema import UserType, FollowingType
+from app.pagination import connection_field, paginate, page_size
+from app.response_cache import invalidate
+from .auth import user_cache
+from .schema import UserType, FollowingType, UserConnection, USER_KEYS
+from .graph import follow_graph
 from .models import Following, User
 from posts.models import Post, Comment, Repost, Notifications, Like
-from posts.schema import PostType, CommentType, RepostType, NotificationType, LikeType
+from posts import timeline
+from posts.notifications import NOTIFICATION_KEYS, notify, notify_many
+from posts.schema import PostConnection, CommentConnection, RepostConnection, NotificationConnection, LikeConnection
 
 class Query(graphene.ObjectType):
     # users
-    users = graphene.List(UserType)
+    users = connection_field(UserConnection)
     me = graphene.Field(UserType)
 
-    def resolve_users(self, info, **kwargs):
-        return User.objects.all()
+    def resolve_users(self, info, first=None, after=None):
+        return paginate(info, User.objects.all(), UserConnection, first, after, keys=USER_KEYS)
     
     def resolve_me(self, info):
         if info.context.user.is_anonymous:
@@ -20,53 +29,72 @@ class Query(graphene.ObjectType):
         return info.context.user
     
     # following and following
-    followers = graphene.List(UserType)
-    following = graphene.List(UserType)
+    followers = connection_field(UserConnection)
+    following = connection_field(UserConnection)
 
-    def resolve_followers(self, info):
+    def resolve_followers(self, info, first=None, after=None):
         if info.context.user.is_anonymous:
             raise GraphQLError('You are not authenticated')
-        followers = Following.objects.filter(following=info.context.user)
-        return User.objects.filter(username__in=[follower.follower for follower in followers])
+        followers = User.objects.filter(following__following=info.context.user)
+        return paginate(info, followers, UserConnection, first, after, keys=USER_KEYS)
     
-    def resolve_following(self, info):
+    def resolve_following(self, info, first=None, after=None):
         if info.context.user.is_anonymous:
             raise GraphQLError('You are not authenticated')
-        following_users = Following.objects.filter(follower=info.context.user)
-        return User.objects.filter(username__in=[follow.following for follow in following_users])
+        following_users = User.objects.filter(account_followed__follower=info.context.user)
+        return paginate(info, following_users, UserConnection, first, after, keys=USER_KEYS)
+    
+    # accounts followed by the accounts the user follows
+    who_to_follow = graphene.List(UserType, first=graphene.Int())
+
+    def resolve_who_to_follow(self, info, first=None):
+        if info.context.user.is_anonymous:
+            raise GraphQLError('You are not authenticated')
+        suggested = follow_graph.suggestions(info.context.user.id, page_size(first))
+        users = User.objects.in_bulk(suggested)
+        return [users[user_id] for user_id in suggested if user_id in users]
     
     # posts, reposts, likes and comments the user has made
-    user_posts = graphene.List(PostType)
-    user_comments = graphene.List(CommentType)
-    user_reposts = graphene.List(RepostType)
-    user_likes = graphene.List(LikeType)
+    user_posts = connection_field(PostConnection)
+    user_comments = connection_field(CommentConnection)
+    user_reposts = connection_field(RepostConnection)
+    user_likes = connection_field(LikeConnection)
 
-    def resolve_user_posts(self, info):
+    def resolve_user_posts(self, info, first=None, after=None):
         if info.context.user.is_anonymous:
             raise GraphQLError('You are not authenticated')
-        return Post.objects.filter(created_by=info.context.user)
+        return paginate(info, Post.objects.filter(created_by=info.context.user), PostConnection, first, after)
     
-    def resolve_user_comments(self, info):
+    def resolve_user_comments(self, info, first=None, after=None):
         if info.context.user.is_anonymous:
             raise GraphQLError('You are not authenticated')
-        return Comment.objects.filter(comment_by=info.context.user)
+        return paginate(info, Comment.objects.filter(comment_by=info.context.user), CommentConnection, first, after)
     
-    def resolve_user_reposts(self, info):
+    def resolve_user_reposts(self, info, first=None, after=None):
         if info.context.user.is_anonymous:
             raise GraphQLError('You are not authenticated')
-        return Repost.objects.filter(repost_by=info.context.user)
+        return paginate(info, Repost.objects.filter(repost_by=info.context.user), RepostConnection, first, after)
     
-    def resolve_user_likes(self, info):
+    def resolve_user_likes(self, info, first=None, after=None):
         if info.context.user.is_anonymous:
             raise GraphQLError('You are not authenticated')
-        return Like.objects.filter(liked_by=info.context.user)
+        return paginate(info, Like.objects.filter(liked_by=info.context.user), LikeConnection, first, after)
     
     # notifications
-    notifications = graphene.List(NotificationType)
-    def resolve_notifications(self, info):
+    notifications = connection_field(NotificationConnection)
+    def resolve_notifications(self, info, first=None, after=None):
         if info.context.user.is_anonymous:
             raise GraphQLError('You are not authenticated')
-        return Notifications.objects.filter(message_for=info.context.user)
+        return paginate(
+            info, Notifications.objects.filter(message_for=info.context.user), NotificationConnection, first, after,
+            keys=NOTIFICATION_KEYS,
+        )
+    
+    unread_notification_count = graphene.Int()
+    def resolve_unread_notification_count(self, info):
+        if info.context.user.is_anonymous:
+            raise GraphQLError('You are not authenticated')
+        return info.context.user.unread_notification_count
     
 class RegisterUser(graphene.Mutation):
     class Arguments:
@@ -109,23 +137,28 @@ class FollowUser(graphene.Mutation):
         if info.context.user.is_anonymous:
             raise GraphQLError('You are not authenticated')
         try:
-            user = User.objects.filter(id=user_followed).first()
+            user = User.objects.get(id=user_followed)
         except User.DoesNotExist:
             raise GraphQLError('User does not exist')
         
-        if Following.objects.filter(follower=info.context.user, following=user).exists():
+        if follow_graph.is_following(info.context.user.id, user.id):
             raise GraphQLError('You are already following')
         
-        following_relationship  = Following(
-            follower = info.context.user,
-            following = user
-        )
-        following_relationship.save()
-        notification = Notifications(
-                    message = f'{info.context.user.username} followed you!',
-                    message_for = user
+        try:
+            with transaction.atomic():
+                following_relationship  = Following(
+                    follower = info.context.user,
+                    following = user
                 )
-        notification.save()
+                following_relationship.save()
+                timeline.backfill(info.context.user, user)
+                notify(user, 'follow', info.context.user)
+        except IntegrityError:
+            # followed from another process that this one's graph has not seen yet
+            raise GraphQLError('You are already following')
+        transaction.on_commit(lambda: follow_graph.follow(info.context.user.id, user.id))
+        # follower counts in cached responses
+        invalidate(info.context.user, user)
         return FollowUser(ok=True, following=following_relationship, message='You have followed this user')
     
 class UnFollowUser(graphene.Mutation):
@@ -144,13 +177,106 @@ class UnFollowUser(graphene.Mutation):
             raise GraphQLError('User does not exist')
         try:
             following = Following.objects.get(following=user, follower=info.context.user)
-            print('here')
-            following.unfollow()
         except Following.DoesNotExist:
             raise GraphQLError('You are not following such user')
+        with transaction.atomic():
+            following.unfollow()
+            timeline.prune(info.context.user, user)
+        transaction.on_commit(lambda: follow_graph.unfollow(info.context.user.id, user.id))
+        invalidate(info.context.user, user)
         return UnFollowUser(ok=True, message='You have unfollowed this user')
         
 
+class BulkFollowResult(graphene.ObjectType):
+    user_followed = graphene.Int()
+    ok = graphene.Boolean()
+    following = graphene.Field(FollowingType)
+    message = graphene.String()
+
+
+class BulkFollowUsers(graphene.Mutation):
+    """followUser for a list of users, e.g. an imported contact list. Users
+    that cannot be followed get a result with ok false and do not stop the
+    others."""
+
+    class Arguments:
+        user_ids = graphene.List(graphene.NonNull(graphene.Int), required=True)
+
+    ok = graphene.Boolean()
+    results = graphene.List(BulkFollowResult)
+
+    def mutate(self, info, user_ids):
+        viewer = info.context.user
+        if viewer.is_anonymous:
+            raise GraphQLError('You are not authenticated')
+        user_ids = list(dict.fromkeys(user_ids))
+        if len(user_ids) > settings.BULK_MUTATION_MAX_ITEMS:
+            raise GraphQLError(f'At most {settings.BULK_MUTATION_MAX_ITEMS} users can be followed at once')
+
+        users = User.objects.in_bulk(user_ids)
+        already_following = set(
+            Following.objects.filter(follower=viewer, following_id__in=users).values_list('following_id', flat=True)
+        )
+        results = {}
+        followed = []
+        for user_id in user_ids:
+            if user_id not in users:
+                results[user_id] = BulkFollowResult(user_followed=user_id, ok=False, message='User does not exist')
+            elif user_id == viewer.id:
+                results[user_id] = BulkFollowResult(user_followed=user_id, ok=False, message='You cannot follow yourself')
+            elif user_id in already_following:
+                results[user_id] = BulkFollowResult(user_followed=user_id, ok=False, message='You are already following')
+            else:
+                followed.append(users[user_id])
+
+        if followed:
+            with transaction.atomic():
+                sent = Following.objects.bulk_create(
+                    [Following(follower=viewer, following=user) for user in followed], ignore_conflicts=True,
+                )
+                # rows followed from another process in the meantime were
+                # skipped; ours are the ones carrying the timestamps we sent
+                created_at = {relationship.following_id: relationship.created_at for relationship in sent}
+                relationships = [
+                    relationship
+                    for relationship in Following.objects.filter(follower=viewer, following_id__in=created_at)
+                    if relationship.created_at == created_at[relationship.following_id]
+                ]
+                for relationship in relationships:
+                    relationship.follower, relationship.following = viewer, users[relationship.following_id]
+                created = {relationship.following_id for relationship in relationships}
+                followed = [user for user in followed if user.id in created]
+                timeline.backfill_many(viewer, followed)
+                notify_many((user, 'follow', viewer, None, None) for user in followed)
+            for user_id in created_at.keys() - created:
+                results[user_id] = BulkFollowResult(user_followed=user_id, ok=False, message='You are already following')
+            for relationship in relationships:
+                results[relationship.following_id] = BulkFollowResult(
+                    user_followed=relationship.following_id, ok=True, following=relationship,
+                    message='You have followed this user',
+                )
+
+            def patch_graph():
+                for user in followed:
+                    follow_graph.follow(viewer.id, user.id)
+
+            transaction.on_commit(patch_graph)
+            invalidate(viewer, *followed)
+        return BulkFollowUsers(ok=True, results=[results[user_id] for user_id in user_ids])
+
+
+class MarkNotificationsRead(graphene.Mutation):
+    ok = graphene.Boolean()
+
+    def mutate(self, info):
+        if info.context.user.is_anonymous:
+            raise GraphQLError('You are not authenticated')
+        # everything delivered up to now counts as read
+        User.objects.filter(pk=info.context.user.pk).update(unread_notification_count=0, notifications_read_at=timezone.now())
+        user_cache.invalidate(info.context.user.pk)
+        return MarkNotificationsRead(ok=True)
+        
+
 class Mutation(graphene.ObjectType):
     register_user = RegisterUser.Field()
     login_user = graphql_jwt.ObtainJSONWebToken.Field()
@@ -158,5 +284,5 @@ class Mutation(graphene.ObjectType):
     refresh_token = graphql_jwt.Refresh.Field()
     follow_user = FollowUser.Field()
     unfollow_user = UnFollowUser.Field()
-
-schema = graphene.Schema(query=Query, mutation=Mutation)
+    bulk_follow_users = BulkFollowUsers.Field()
+    mark_notifications_read = MarkNotificationsRead.Field()
@@ -2,23 +2,64 @@ import graphene
 from graphene_django import DjangoObjectType
 from .models import User
 from .models import Following
+from .graph import follow_graph
 
 class UserType(DjangoObjectType):
     follower_count = graphene.Int()
     following_count = graphene.Int()
+    # relationship to the logged in user, null when nobody is logged in
+    is_following = graphene.Boolean()
+    follows_you = graphene.Boolean()
+    mutual_follow_count = graphene.Int()
+
+    # depend on who is asking, see app/response_cache.py
+    viewer_fields = ('is_following', 'follows_you', 'mutual_follow_count')
+
+    # answered from the follow graph, the mutual count intersects two follow lists
+    field_costs = {
+        'follower_count': 1,
+        'following_count': 1,
+        'mutual_follow_count': 2,
+    }
 
     def resolve_follower_count(self, info):
-        return self.follower_count()
+        return follow_graph.follower_count(self.id)
     
     def resolve_following_count(self, info):
-        return self.following_count()
+        return follow_graph.following_count(self.id)
+
+    def resolve_is_following(self, info):
+        if info.context.user.is_anonymous:
+            return None
+        return follow_graph.is_following(info.context.user.id, self.id)
+
+    def resolve_follows_you(self, info):
+        if info.context.user.is_anonymous:
+            return None
+        return follow_graph.is_following(self.id, info.context.user.id)
+
+    def resolve_mutual_follow_count(self, info):
+        # accounts the logged in user follows that also follow this user
+        if info.context.user.is_anonymous:
+            return None
+        return len(follow_graph.followed_by_followings(info.context.user.id, self.id))
 
     class Meta:
         model = User
-        fields = '__all__'
+        # private to the user, served by the unreadNotificationCount query
+        exclude = ('unread_notification_count', 'notifications_read_at')
 
     
 
+# users have no created_at, so they page by join date
+USER_KEYS = ('-date_joined', '-id')
+
+
+class UserConnection(graphene.relay.Connection):
+    class Meta:
+        node = UserType
+
+
 class FollowingType(DjangoObjectType):
     class Meta:
         model = Following
@@ -0,0 +1,201 @@
+from unittest import mock
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from graphql_jwt.shortcuts import get_token
+from app.query_budgets import QueryBudgetTestMixin
+from app.graphql_testing import GraphQLTestMixin, seed
+from app.query_plans import QueryPlanTestMixin
+from posts.models import Notifications, TimelineEntry
+from .auth import UserCache, user_cache
+from .graph import FollowGraph
+from .models import Following, User
+from .query import Mutation, Query
+
+USER_FIELDS = 'id username followerCount followingCount isFollowing followsYou mutualFollowCount'
+
+
+class QueryPlanTests(QueryPlanTestMixin, TestCase):
+    operations = {
+        'users': f'{{ users(first: 5) {{ edges {{ node {{ {USER_FIELDS} }} }} pageInfo {{ hasNextPage }} }} }}',
+        'me': f'{{ me {{ {USER_FIELDS} }} }}',
+        'followers': f'{{ followers {{ edges {{ node {{ {USER_FIELDS} }} }} }} }}',
+        'following': f'{{ following {{ edges {{ node {{ {USER_FIELDS} }} }} }} }}',
+        'whoToFollow': f'{{ whoToFollow(first: 5) {{ {USER_FIELDS} }} }}',
+        'userPosts': '{ userPosts { edges { node { id post likeCount commentCount repostCount comments { id } reposts { id } } } } }',
+        'userComments': '{ userComments { edges { node { id comment post { id createdBy { id } } } } } }',
+        'userReposts': '{ userReposts { edges { node { id comment post { id } } } } }',
+        'userLikes': '{ userLikes { edges { node { id post { id createdBy { username } } } } } }',
+        'notifications': '{ notifications { edges { node { id message verb isRead post { id } actor { id } } } } }',
+        'unreadNotificationCount': '{ unreadNotificationCount }',
+        'registerUser': '''mutation {
+            registerUser(username: "new", email: "new@example.com", password: "password", password2: "password",
+                         firstName: "New", lastName: "User") { ok user { id } }
+        }''',
+        'loginUser': 'mutation { loginUser(username: "user1", password: "password") { token } }',
+        'verifyToken': ('mutation ($token: String!) { verifyToken(token: $token) { payload } }', lambda test: {'token': test.token()}),
+        'refreshToken': ('mutation ($token: String!) { refreshToken(token: $token) { token } }', lambda test: {'token': test.token()}),
+        'followUser': ('mutation ($id: Int!) { followUser(userFollowed: $id) { ok following { id } } }', lambda test: {'id': test.users[-1].id}),
+        'unfollowUser': ('mutation ($id: Int!) { unfollowUser(userFollowed: $id) { ok } }', lambda test: {'id': test.users[1].id}),
+        'bulkFollowUsers': (
+            'mutation ($ids: [Int!]!) { bulkFollowUsers(userIds: $ids) { ok results { userFollowed ok message following { id } } } }',
+            lambda test: {'ids': [user.id for user in test.users]},
+        ),
+        'markNotificationsRead': 'mutation { markNotificationsRead { ok } }',
+    }
+
+    def token(self):
+        return get_token(self.users[0])
+
+    def test_covers_every_field(self):
+        self.assertCoversFields(Query, Mutation)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    operations = {
+        'Users': f'query Users {{ users(first: 20) {{ edges {{ node {{ {USER_FIELDS} }} }} }} }}',
+        'Profile': f'''query Profile {{
+            me {{ {USER_FIELDS} }}
+            unreadNotificationCount
+        }}''',
+        'Followers': f'query Followers {{ followers(first: 20) {{ edges {{ node {{ {USER_FIELDS} }} }} }} }}',
+        'Following': f'query Following {{ following(first: 20) {{ edges {{ node {{ {USER_FIELDS} }} }} }} }}',
+        'WhoToFollow': f'query WhoToFollow {{ whoToFollow(first: 20) {{ {USER_FIELDS} }} }}',
+        'Activity': '''query Activity {
+            userPosts(first: 20) { edges { node { id likeCount comments { id commentBy { username } } reposts { id repostBy { username } } } } }
+            userComments(first: 20) { edges { node { id post { id createdBy { username } } } } }
+            userReposts(first: 20) { edges { node { id post { id createdBy { username } } } } }
+            userLikes(first: 20) { edges { node { id likedBy { username } post { id createdBy { username } } } } }
+        }''',
+        'Notifications': '''query Notifications {
+            notifications(first: 20) { edges { node { id message isRead actor { username } post { id likeCount } } } }
+        }''',
+        'FollowUser': (
+            'mutation FollowUser($id: Int!) { followUser(userFollowed: $id) { ok following { following { username } } } }',
+            lambda test: {'id': test.users[-1].id},
+        ),
+        'UnfollowUser': (
+            'mutation UnfollowUser($id: Int!) { unfollowUser(userFollowed: $id) { ok } }',
+            lambda test: {'id': test.users[1].id},
+        ),
+        'MarkNotificationsRead': 'mutation MarkNotificationsRead { markNotificationsRead { ok } }',
+        # the last user follows no one but the first, so they follow every
+        # other user here: the count must not grow with the list
+        'BulkFollowUsers': (
+            '''mutation BulkFollowUsers($ids: [Int!]!) {
+                bulkFollowUsers(userIds: $ids) { ok results { userFollowed ok message following { following { username } } } }
+            }''',
+            lambda test: {'ids': [user.id for user in test.users] + [0]},
+        ),
+    }
+    viewers = {'BulkFollowUsers': -1}
+
+
+class FollowGraphTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed(4)
+
+    def test_patches_during_a_reload_are_kept(self):
+        graph = FollowGraph()
+        graph.load()
+        followed = Following.objects.first()
+        new_follower, new_following = self.users[-1].id, self.users[1].id
+        self.assertFalse(graph.is_following(new_follower, new_following))
+        iterator = QuerySet.iterator
+
+        def committed_meanwhile(queryset, *args, **kwargs):
+            # the rows are read before the follow and after the unfollow commits
+            graph.follow(new_follower, new_following)
+            graph.unfollow(followed.follower_id, followed.following_id)
+            return iterator(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'iterator', autospec=True, side_effect=committed_meanwhile):
+            graph.load()
+        self.assertTrue(graph.is_following(new_follower, new_following))
+        self.assertIn(new_follower, graph.followers(new_following))
+        self.assertFalse(graph.is_following(followed.follower_id, followed.following_id))
+
+    @override_settings(FOLLOW_GRAPH_MAX_AGE=0)
+    def test_one_thread_reloads_a_stale_graph(self):
+        graph = FollowGraph()
+        graph.load()
+        with mock.patch.object(graph, '_load') as load:
+            # another thread is reloading
+            with graph._reload_lock:
+                graph.following(self.users[0].id)
+            load.assert_not_called()
+            graph.following(self.users[0].id)
+            load.assert_called_once()
+
+
+class BulkFollowTests(GraphQLTestMixin, TestCase):
+    query = '''mutation ($ids: [Int!]!) {
+        bulkFollowUsers(userIds: $ids) { ok results { userFollowed ok message following { following { id } } } }
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed(4)
+
+    def test_results_follow_the_input_order(self):
+        # the last user follows only the first one
+        viewer, followed, raced = self.users[-1], self.users[2], self.users[1]
+        bulk_create = QuerySet.bulk_create
+
+        def followed_meanwhile(queryset, objs, *args, **kwargs):
+            # another process follows one of them once this one has checked
+            if queryset.model is Following:
+                Following.objects.create(follower=viewer, following=raced)
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        ids = [followed.id, viewer.id, 0, self.users[0].id, raced.id, followed.id]
+        with mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=followed_meanwhile):
+            result = self.commit_operation(self.query, {'ids': ids}, viewer)
+        results = result['data']['bulkFollowUsers']['results']
+        self.assertEqual([(item['userFollowed'], item['ok'], item['message']) for item in results], [
+            (followed.id, True, 'You have followed this user'),
+            (viewer.id, False, 'You cannot follow yourself'),
+            (0, False, 'User does not exist'),
+            (self.users[0].id, False, 'You are already following'),
+            (raced.id, False, 'You are already following'),
+        ])
+        self.assertEqual(results[0]['following']['following']['id'], str(followed.id))
+        self.assertEqual(
+            list(Notifications.objects.filter(verb='follow', actor=viewer).values_list('message_for', flat=True)),
+            [followed.id],
+        )
+        self.assertTrue(TimelineEntry.objects.filter(owner=viewer, author=followed).exists())
+        self.assertFalse(TimelineEntry.objects.filter(owner=viewer, author=raced).exists())
+
+    @override_settings(BULK_MUTATION_MAX_ITEMS=2)
+    def test_at_most_the_cap_is_accepted(self):
+        result = self.commit_operation(self.query, {'ids': [user.id for user in self.users[:3]]}, self.users[-1])
+        self.assertEqual(result['errors'][0]['message'], 'At most 2 users can be followed at once')
+        self.assertFalse(Following.objects.filter(follower=self.users[-1], following=self.users[1]).exists())
+
+
+class UserCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed(4)
+
+    def setUp(self):
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+
+    def test_saving_or_deleting_a_user_drops_them(self):
+        token = get_token(self.users[1])
+        self.assertEqual(user_cache.get_user(token).first_name, 'User')
+        self.users[1].first_name = 'Renamed'
+        self.users[1].save()
+        self.assertEqual(user_cache.get_user(token).first_name, 'Renamed')
+        self.users[1].delete()
+        self.assertIsNone(user_cache.get_user(token))
+
+    @override_settings(AUTH_USER_CACHE_SIZE=2)
+    def test_evicted_users_are_forgotten(self):
+        cache = UserCache()
+        for user in self.users:
+            cache.get_user(get_token(user))
+        self.assertEqual(set(cache._usernames), {user.pk for user in self.users[-2:]})
+        self.assertEqual(cache.stats()['users']['size'], 2)
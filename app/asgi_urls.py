@@ -0,0 +1,21 @@
+# URLs of requests served by the ASGI application, see app/middleware.py
+from django.conf import settings
+from django.conf.urls.static import static
+from django.contrib import admin
+from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
+from posts.views import media_variant_view
+from .metrics import metrics_view
+from .schema import schema
+from .urls import graphql_urls
+from .views import AsyncTwttrGraphQLView
+
+async_graphql_view = csrf_exempt(AsyncTwttrGraphQLView.as_view(graphiql=True, schema=schema))
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('metrics', metrics_view),
+    *graphql_urls(async_graphql_view),
+    path('variants/<str:digest>/<slug:variant>.<slug:extension>', media_variant_view, name='media-variant'),
+    *static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT),
+]
@@ -0,0 +1,160 @@
+"""Static cost analysis of GraphQL operations.
+
+Every operation is measured on its validated AST before it runs and rejected
+when it nests deeper than GRAPHQL_MAX_DEPTH, uses more than GRAPHQL_MAX_ALIASES
+aliases or costs more than GRAPHQL_MAX_COST.
+
+A field that resolves to an object costs 1 and a scalar costs nothing, unless
+its graphene type says otherwise in a `field_costs` mapping of field name to
+cost or FieldCost. The fields selected below a list are multiplied by its
+size: the `first` argument (or the default page size) for paginated fields,
+FieldCost.list_size or GRAPHQL_COST_LIST_SIZE for plain lists. The edges and
+nodes of a connection are free, they are sized and paid for by the field that
+returned the connection.
+"""
+from collections import namedtuple
+from django.conf import settings
+from graphene.relay import Connection
+from graphene.utils.str_converters import to_camel_case
+from graphql import (
+    FieldNode, FragmentSpreadNode, FragmentDefinitionNode, GraphQLError, InlineFragmentNode, Undefined,
+    get_named_type, is_leaf_type, is_list_type, value_from_ast,
+)
+
+FieldCost = namedtuple('FieldCost', 'cost list_size', defaults=(None,))
+
+Cost = namedtuple('Cost', 'cost depth aliases')
+
+
+def _field_costs(object_type):
+    graphene_type = getattr(object_type, 'graphene_type', None)
+    costs = getattr(graphene_type, 'field_costs', None) or {}
+    return {
+        to_camel_case(name): value if isinstance(value, FieldCost) else FieldCost(value)
+        for name, value in costs.items()
+    }
+
+
+def _is_connection(object_type):
+    if issubclass(getattr(object_type, 'graphene_type', object), Connection):
+        return True
+    # edge types are generated for each connection without a public base class
+    return 'node' in object_type.fields and 'cursor' in object_type.fields
+
+
+def _unwrap(field_type):
+    # NonNull wraps lists as often as lists wrap NonNull
+    while hasattr(field_type, 'of_type') and not is_list_type(field_type):
+        field_type = field_type.of_type
+    return field_type
+
+
+class CostAnalysis:
+    def __init__(self, schema, document, variables=None):
+        self.schema = schema
+        self.variables = variables or {}
+        self.fragments = {
+            definition.name.value: definition for definition in document.definitions
+            if isinstance(definition, FragmentDefinitionNode)
+        }
+        self._field_costs = {}
+
+    def field_costs(self, object_type):
+        if object_type.name not in self._field_costs:
+            self._field_costs[object_type.name] = _field_costs(object_type)
+        return self._field_costs[object_type.name]
+
+    def measure(self, operation):
+        root = self.schema.get_root_type(operation.operation)
+        cost, depth = self._selections(operation.selection_set, root, 0)
+        return Cost(cost, depth, self._aliases(operation.selection_set))
+
+    def _selections(self, selection_set, parent_type, depth):
+        """Returns the cost and the deepest nesting below `selection_set`."""
+        cost = 0
+        deepest = depth
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                field_cost, field_depth = self._field(selection, parent_type, depth + 1)
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = self._condition_type(selection, parent_type)
+                field_cost, field_depth = self._selections(selection.selection_set, fragment_type, depth)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = self.fragments[selection.name.value]
+                fragment_type = self._condition_type(fragment, parent_type)
+                field_cost, field_depth = self._selections(fragment.selection_set, fragment_type, depth)
+            cost += field_cost
+            deepest = max(deepest, field_depth)
+        return cost, deepest
+
+    def _condition_type(self, fragment, parent_type):
+        if fragment.type_condition is None:
+            return parent_type
+        return self.schema.get_type(fragment.type_condition.name.value)
+
+    def _field(self, node, parent_type, depth):
+        name = node.name.value
+        if name.startswith('__'):
+            # introspection is answered from the schema without touching the database
+            return 0, depth
+        definition = parent_type.fields[name]
+        field_type = _unwrap(definition.type)
+        named_type = get_named_type(field_type)
+        annotation = self.field_costs(parent_type).get(name)
+        if annotation is not None:
+            cost = annotation.cost
+        elif is_leaf_type(named_type) or _is_connection(parent_type):
+            # edges and nodes come with the page their connection already paid for
+            cost = 0
+        else:
+            cost = 1
+        if node.selection_set is None:
+            return cost, depth
+
+        multiplier = 1
+        if 'first' in definition.args:
+            multiplier = self._page_size(node, definition)
+        elif is_list_type(field_type) and not _is_connection(parent_type):
+            multiplier = (annotation and annotation.list_size) or settings.GRAPHQL_COST_LIST_SIZE
+        children, deepest = self._selections(node.selection_set, named_type, depth)
+        return cost + multiplier * children, deepest
+
+    def _page_size(self, node, definition):
+        first = None
+        for argument in node.arguments:
+            if argument.name.value == 'first':
+                first = value_from_ast(argument.value, definition.args['first'].type, self.variables)
+        # a variable that was declared but not sent is Undefined, the resolver gets no `first`
+        if first is None or first is Undefined or first < 1:
+            return settings.PAGINATION_DEFAULT_PAGE_SIZE
+        return min(first, settings.PAGINATION_MAX_PAGE_SIZE)
+
+    def _aliases(self, selection_set):
+        count = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode) and selection.alias is not None:
+                count += 1
+            if isinstance(selection, FragmentSpreadNode):
+                # a fragment spread twice still aliases its fields once per spread
+                count += self._aliases(self.fragments[selection.name.value].selection_set)
+            elif selection.selection_set is not None:
+                count += self._aliases(selection.selection_set)
+        return count
+
+
+def analyze(schema, document, operation, variables=None):
+    """Measures `operation` and raises a GraphQLError when it is over a limit.
+    Returns the Cost, which the view reports in the response extensions."""
+    measured = CostAnalysis(schema.graphql_schema, document, variables).measure(operation)
+    limits = (
+        ('depth', measured.depth, settings.GRAPHQL_MAX_DEPTH, 'QUERY_TOO_DEEP'),
+        ('aliases', measured.aliases, settings.GRAPHQL_MAX_ALIASES, 'TOO_MANY_ALIASES'),
+        ('cost', measured.cost, settings.GRAPHQL_MAX_COST, 'QUERY_TOO_COSTLY'),
+    )
+    for name, value, limit, code in limits:
+        if limit is not None and value > limit:
+            raise GraphQLError(
+                f'Query {name} {value} exceeds the limit of {limit}',
+                extensions={'code': code, 'cost': measured._asdict()},
+            )
+    return measured
@@ -0,0 +1,143 @@
+import threading
+from collections import defaultdict
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models.query import QuerySet
+from graphene.utils.str_converters import to_snake_case
+
+
+class LoaderRegistry:
+    """Per-request cache of loader results and of every model instance the
+    request has resolved so far, grouped by model. The async view resolves root
+    fields on several threads at once, so both are guarded by `lock`."""
+
+    def __init__(self):
+        self.seen = defaultdict(set)
+        self.results = {}
+        self.lock = threading.RLock()
+
+    def register(self, instances):
+        with self.lock:
+            self._register(instances)
+
+    def _register(self, instances):
+        for instance in instances:
+            if not isinstance(instance, models.Model) or instance.pk is None:
+                continue
+            self.seen[type(instance)].add(instance.pk)
+            # foreign keys are registered as well so that `post { created_by { follower_count } }`
+            # batches the authors without fetching them first
+            for field in instance._meta.concrete_fields:
+                if field.is_relation and field.many_to_one:
+                    value = getattr(instance, field.attname)
+                    if value is not None:
+                        self.seen[field.related_model].add(value)
+                    # and so are the foreign keys of what select_related fetched
+                    if field.is_cached(instance):
+                        self._register([field.get_cached_value(instance)])
+
+
+class BatchLoader:
+    """A batch function keyed by the primary key of `model`.
+
+    `batch_load_fn` receives a set of keys and returns a dict of key -> value; keys
+    missing from that dict resolve to `default()`. The first `load` that misses the
+    cache fetches the requested key together with every pending key the request has
+    seen for `model`, so a list of N objects costs one query per loader instead of N.
+    """
+
+    def __init__(self, batch_load_fn, model, default):
+        self.batch_load_fn = batch_load_fn
+        self.model = model
+        self.default = default
+
+    def load(self, info, key):
+        registry = get_registry(info.context)
+        with registry.lock:
+            cache = registry.results.setdefault(self, {})
+            if key in cache:
+                return cache[key]
+            keys = {key} | (registry.seen[self.model] - cache.keys())
+        # queried outside the lock so other threads of the request are not held up
+        values = self.batch_load_fn(keys)
+        with registry.lock:
+            # what the batch loaded is seen too, so the loaders of its
+            # instances batch across every key rather than per key
+            for value in values.values():
+                registry._register(value if isinstance(value, (list, tuple)) else [value])
+            for pending in keys:
+                cache.setdefault(pending, values.get(pending, self.default()))
+            return cache[key]
+
+
+def batch_loader(model, default=lambda: None):
+    def decorator(batch_load_fn):
+        return BatchLoader(batch_load_fn, model, default)
+    return decorator
+
+
+_instance_loaders = {}
+
+
+def instance_loader(model):
+    """The loader of `model` instances by primary key, shared by every
+    foreign key to it."""
+    loader = _instance_loaders.get(model)
+    if loader is None:
+        loader = _instance_loaders.setdefault(
+            model, BatchLoader(lambda keys: model._default_manager.in_bulk(keys), model, lambda: None)
+        )
+    return loader
+
+
+_foreign_keys = {}
+
+
+def _foreign_key(model, field_name):
+    """The forward foreign key of `model` behind a GraphQL field, or None."""
+    key = (model, field_name)
+    if key not in _foreign_keys:
+        try:
+            field = model._meta.get_field(to_snake_case(field_name))
+        except FieldDoesNotExist:
+            field = None
+        _foreign_keys[key] = field if field is not None and field.many_to_one and field.concrete else None
+    return _foreign_keys[key]
+
+
+_registry_lock = threading.Lock()
+
+
+def get_registry(context):
+    registry = getattr(context, '_loader_registry', None)
+    if registry is None:
+        with _registry_lock:
+            registry = getattr(context, '_loader_registry', None)
+            if registry is None:
+                registry = LoaderRegistry()
+                context._loader_registry = registry
+    return registry
+
+
+class DataLoaderMiddleware:
+    """Registers every list of model instances a resolver returns so that the
+    field loaders of its items can be resolved in a single batch. Single
+    instances are registered too, the response cache tags responses with them.
+
+    Forward foreign keys that were not fetched with select_related are loaded
+    through `instance_loader` before the default resolver follows them, so
+    `comments { commentBy { username } }` costs one query for every author."""
+
+    def resolve(self, next, root, info, **kwargs):
+        if isinstance(root, models.Model):
+            field = _foreign_key(type(root), info.field_name)
+            if field is not None and not field.is_cached(root):
+                value = getattr(root, field.attname)
+                if value is not None:
+                    field.set_cached_value(root, instance_loader(field.related_model).load(info, value))
+        result = next(root, info, **kwargs)
+        if isinstance(result, (QuerySet, list)):
+            get_registry(info.context).register(result)
+        elif isinstance(result, models.Model):
+            get_registry(info.context).register([result])
+        return result
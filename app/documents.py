@@ -0,0 +1,138 @@
+"""Parsed-and-validated GraphQL documents and persisted queries.
+
+Clients send the same few documents over and over, so each one is parsed and
+validated once per process and kept in an LRU cache keyed by the hash of the
+query text and of the schema it was validated against.
+
+Clients may also send only the SHA-256 of a query in
+`extensions.persistedQuery.sha256Hash`. Hashes come from
+GRAPHQL_PERSISTED_QUERIES_FILE (a JSON object of hash -> query) or are
+registered the first time a client sends the query along with its hash.
+Registered queries are kept in an LRU cache of
+GRAPHQL_PERSISTED_QUERIES_CACHE_SIZE entries, so clients cannot grow it
+without bound; a hash that was dropped is reported as not found and the
+client sends the query again. With
+GRAPHQL_PERSISTED_QUERIES_ONLY the server runs nothing but the queries in
+that file.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from graphql import GraphQLError, parse, print_schema, validate
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class DocumentCache:
+    def __init__(self):
+        self._documents = OrderedDict()
+        self._schema_hashes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _schema_hash(self, schema):
+        key = id(schema)
+        if key not in self._schema_hashes:
+            self._schema_hashes[key] = query_hash(print_schema(schema.graphql_schema))
+        return self._schema_hashes[key]
+
+    def get(self, schema, query):
+        """Returns the parsed document and its validation errors."""
+        key = (self._schema_hash(schema), query_hash(query))
+        with self._lock:
+            cached = self._documents.get(key)
+            if cached is not None:
+                self._documents.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        try:
+            document = parse(query)
+            cached = (document, validate(schema.graphql_schema, document))
+        except GraphQLError as error:
+            cached = (None, [error])
+
+        max_size = settings.GRAPHQL_DOCUMENT_CACHE_SIZE
+        if max_size:
+            with self._lock:
+                self._documents[key] = cached
+                while len(self._documents) > max_size:
+                    self._documents.popitem(last=False)
+        return cached
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._documents)}
+
+
+class PersistedQueries:
+    def __init__(self):
+        self._allowed = None
+        # sha256 -> query text registered by clients, least recently used first
+        self._registered = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def allowed(self):
+        if self._allowed is None:
+            path = settings.GRAPHQL_PERSISTED_QUERIES_FILE
+            allowed = {}
+            if path:
+                with open(path) as persisted:
+                    allowed = json.load(persisted)
+            self._allowed = allowed
+        return self._allowed
+
+    def resolve(self, query, extensions):
+        """Returns the query text to run for a request's `query` and
+        `extensions`, or raises a GraphQLError the client can act on."""
+        persisted = (extensions or {}).get('persistedQuery') or {}
+        sha256 = persisted.get('sha256Hash')
+        allow_list_only = settings.GRAPHQL_PERSISTED_QUERIES_ONLY
+
+        if query:
+            digest = query_hash(query)
+            if sha256 and sha256 != digest:
+                raise GraphQLError('Provided sha does not match query', extensions={'code': 'INVALID_HASH'})
+            if allow_list_only and digest not in self.allowed:
+                raise GraphQLError('Only persisted queries are allowed', extensions={'code': 'PERSISTED_QUERY_NOT_ALLOWED'})
+            if sha256 and not allow_list_only:
+                self._register(sha256, query)
+            return query
+
+        if sha256:
+            query = self.allowed.get(sha256) or (None if allow_list_only else self._lookup(sha256))
+            if query is None:
+                # the client retries with the full query, which registers it
+                raise GraphQLError('PersistedQueryNotFound', extensions={'code': 'PERSISTED_QUERY_NOT_FOUND'})
+        return query
+
+    def _register(self, sha256, query):
+        max_size = settings.GRAPHQL_PERSISTED_QUERIES_CACHE_SIZE
+        if not max_size:
+            return
+        with self._lock:
+            self._registered[sha256] = query
+            self._registered.move_to_end(sha256)
+            while len(self._registered) > max_size:
+                self._registered.popitem(last=False)
+
+    def _lookup(self, sha256):
+        with self._lock:
+            query = self._registered.get(sha256)
+            if query is not None:
+                self._registered.move_to_end(sha256)
+            return query
+
+document_cache = DocumentCache()
+persisted_queries = PersistedQueries()
@@ -0,0 +1,138 @@
+"""Shared pieces of the GraphQL test suites: seeded data and a way to run an
+operation through /graphql/ and see every statement it issued."""
+import json
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from graphql_jwt.shortcuts import get_token
+from accounts.auth import user_cache
+from accounts.graph import follow_graph
+from accounts.models import Following
+from group.models import Group, GroupMembership
+from posts import hashtags, timeline
+from posts.models import Comment, Like, Notifications, Post, Repost
+
+User = get_user_model()
+
+
+def seed(size=6):
+    """A social graph whose lists grow with `size`. The first user is the
+    viewer: they follow every other user but the last, are followed by all of
+    them, and like, comment on and repost the first and second post of every
+    other user, who do the same to the viewer's first post. Every post is
+    tagged #django. Everyone but the first two users belongs to the groups of
+    the first two. Returns the users in creation order."""
+    users = [
+        User.objects.create_user(
+            username=f'user{index}', email=f'user{index}@example.com', password='password',
+            first_name='User', last_name=str(index), bio='', location='',
+        )
+        for index in range(max(size, 4))
+    ]
+    viewer, others = users[0], users[1:]
+    for other in others[:-1]:
+        Following.objects.create(follower=viewer, following=other)
+    for index, other in enumerate(others):
+        Following.objects.create(follower=other, following=viewer)
+        if index + 1 < len(others):
+            Following.objects.create(follower=other, following=others[index + 1])
+    posts = {}
+    for user in users:
+        posts[user] = [Post.objects.create(post=f'post {number} about #django by {user.username}', created_by=user) for number in range(2)]
+        hashtags.tag(posts[user])
+        for post in posts[user]:
+            timeline.fan_out(post)
+
+    def interact(user, liked, reposted):
+        Like.objects.create(liked_by=user, post=liked)
+        liked.adjust_count('likes_count', 1)
+        Comment.objects.create(comment=f'comment by {user.username}', comment_by=user, post=liked)
+        liked.adjust_count('comments_count', 1)
+        Notifications.objects.create(
+            message=f'{user.username} liked your post', message_for=liked.created_by, verb='like', post=liked, actor=user,
+        )
+        repost = Repost.objects.create(repost_by=user, post=reposted, comment='worth a read')
+        reposted.adjust_count('reposts_count', 1)
+        timeline.fan_out(reposted, repost)
+
+    for other in others:
+        interact(other, posts[viewer][0], posts[viewer][0])
+        interact(viewer, posts[other][0], posts[other][1])
+    for index, owner in enumerate(users[:2]):
+        group = Group.objects.create(name=f'group{index}', description='a group', created_by=owner)
+        for number, member in enumerate(users[2:]):
+            status = 'Accepted' if number % 2 == 0 else 'Pending'
+            GroupMembership.objects.create(group=group, user=member, status=status)
+            if status == 'Accepted':
+                group.adjust_count('members_count', 1)
+    # the follows were written behind the graph's back
+    follow_graph.load()
+    return users
+
+
+class GraphQLTestMixin:
+    """Mixin for TestCase. Subclasses define `operations`, a mapping of names
+    to operations as a query string or a (query, variables) pair, where the
+    variables may be a function of the test case for ids of the seeded data.
+    Operations run as the first seeded user unless `viewers` maps their name
+    to the index of another one."""
+
+    operations = {}
+    viewers = {}
+
+    def setUp(self):
+        # the caches would answer some operations without any SQL, and
+        # notifications are written when the operation commits
+        settings = override_settings(
+            GRAPHQL_RESPONSE_CACHE_BACKEND=None, NOTIFICATION_DELIVERY='commit',
+            # seeding hashes a password per user; the default hasher still
+            # checks the passwords of users seeded before
+            PASSWORD_HASHERS=[
+                'django.contrib.auth.hashers.MD5PasswordHasher', 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+            ],
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def operation(self, name):
+        """The query, variables and user of the named operation."""
+        operation = self.operations[name]
+        query, variables = operation if isinstance(operation, tuple) else (operation, None)
+        if callable(variables):
+            variables = variables(self)
+        return query, variables, self.users[self.viewers.get(name, 0)]
+
+    def commit_operation(self, query, variables=None, user=None):
+        """Runs the operation and its on_commit callbacks, keeping what they
+        write for the rest of the test, and returns its response."""
+        user_cache.clear()
+        headers = {}
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = f'JWT {get_token(user)}'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = Client().post(
+                '/graphql/', json.dumps({'query': query, 'variables': variables or {}}),
+                content_type='application/json', **headers,
+            )
+        return response.json()
+
+    def run_operation(self, query, variables=None, user=None):
+        """Runs the operation in a savepoint that is rolled back afterwards and
+        returns its response and the statements it ran, including those of
+        the on_commit callbacks it registered."""
+        user_cache.clear()
+        headers = {}
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = f'JWT {get_token(user)}'
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+                response = Client().post(
+                    '/graphql/', json.dumps({'query': query, 'variables': variables or {}}),
+                    content_type='application/json', **headers,
+                )
+            statements = [query['sql'] for query in queries.captured_queries]
+            transaction.set_rollback(True)
+        # the follow mutations patched the graph when they "committed"
+        follow_graph.load()
+        return response.json(), statements
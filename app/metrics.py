@@ -0,0 +1,232 @@
+"""Resolver timing and SQL instrumentation.
+
+A sampled share of GraphQL operations (GRAPHQL_METRICS_SAMPLE_RATE) is traced:
+MetricsMiddleware times every resolver and counts the SQL statements it runs,
+keyed by the field's path with list indices dropped (posts.edges.node.createdBy).
+Paths are made of field names, never of the aliases a client chose, so there
+are only as many as the schema allows. Scalar fields that run no SQL are left
+out, they would only add noise. When the operation finishes, the trace is
+folded into this process's histograms, which /metrics serves in the
+Prometheus text format, tagged with the operation name. Operation names come
+from clients, so only the first GRAPHQL_METRICS_MAX_OPERATIONS names get
+series of their own and later ones are counted as 'other'.
+
+A client can also ask for a trace of its own request with
+`"extensions": {"tracing": true}`. Such requests are always traced, and when
+GRAPHQL_TRACING is on the trace is returned in the response extensions.
+
+Untraced operations only pay for a single attribute lookup per field.
+"""
+import random
+import threading
+import time
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from graphql import get_named_type, is_leaf_type
+
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket, +Inf count, sum]
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series.setdefault(label_values, [[0] * len(self.buckets), 0, 0.0])
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+                break
+        series[1] += 1
+        series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total, value_sum) in sorted(self._series.items()):
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = f'{labels},' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {total}')
+            lines.append(f'{self.name}_sum{{{labels}}} {value_sum}')
+            lines.append(f'{self.name}_count{{{labels}}} {total}')
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # operation names that have series
+        self._operations = set()
+        self.operation_duration = Histogram(
+            'graphql_operation_duration_seconds', 'Wall time of traced GraphQL operations.',
+            ('operation',), TIME_BUCKETS,
+        )
+        self.operation_sql_queries = Histogram(
+            'graphql_operation_sql_queries', 'SQL statements run by the resolvers of traced operations.',
+            ('operation',), COUNT_BUCKETS,
+        )
+        self.operation_sql_duration = Histogram(
+            'graphql_operation_sql_duration_seconds', 'Time spent in SQL by the resolvers of traced operations.',
+            ('operation',), TIME_BUCKETS,
+        )
+        self.field_duration = Histogram(
+            'graphql_field_duration_seconds', 'Wall time of traced resolvers, by field path.',
+            ('operation', 'path'), TIME_BUCKETS,
+        )
+        self.field_sql_queries = Histogram(
+            'graphql_field_sql_queries', 'SQL statements run by traced resolvers, by field path.',
+            ('operation', 'path'), COUNT_BUCKETS,
+        )
+        self.field_sql_duration = Histogram(
+            'graphql_field_sql_duration_seconds', 'Time spent in SQL by traced resolvers, by field path.',
+            ('operation', 'path'), TIME_BUCKETS,
+        )
+
+    def _operation_label(self, name):
+        if name in self._operations:
+            return name
+        if len(self._operations) >= settings.GRAPHQL_METRICS_MAX_OPERATIONS:
+            return 'other'
+        self._operations.add(name)
+        return name
+
+    def record(self, trace):
+        with self._lock:
+            operation = self._operation_label(trace.operation or 'anonymous')
+            self.operation_duration.observe(trace.duration, operation)
+            self.operation_sql_queries.observe(trace.sql_count, operation)
+            self.operation_sql_duration.observe(trace.sql_duration, operation)
+            for field in trace.fields:
+                self.field_duration.observe(field.duration, operation, field.key)
+                self.field_sql_queries.observe(field.sql_count, operation, field.key)
+                self.field_sql_duration.observe(field.sql_duration, operation, field.key)
+
+    def render(self):
+        with self._lock:
+            histograms = (
+                self.operation_duration, self.operation_sql_queries, self.operation_sql_duration,
+                self.field_duration, self.field_sql_queries, self.field_sql_duration,
+            )
+            return '\n'.join(histogram.render() for histogram in histograms) + '\n'
+
+
+metrics = Metrics()
+
+
+class FieldTrace:
+    __slots__ = ('path', 'key', 'start', 'duration', 'sql_count', 'sql_duration')
+
+    def __init__(self, path, key, start):
+        self.path = path
+        self.key = key
+        self.start = start
+        self.duration = 0.0
+        self.sql_count = 0
+        self.sql_duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # installed with connection.execute_wrapper while the resolver runs
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.sql_duration += time.perf_counter() - start
+
+
+class Trace:
+    def __init__(self, operation):
+        self.operation = operation
+        self.fields = []
+        # response keys of a field's path, list indices dropped -> its key
+        self._keys = {}
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        # the root fields of a query may resolve on several threads
+        self._lock = threading.Lock()
+
+    def key(self, path, field_name):
+        """The key of a field: its parent's key and its field name."""
+        response_keys = tuple(part for part in path if not isinstance(part, int))
+        parent = self._keys.get(response_keys[:-1])
+        key = self._keys[response_keys] = f'{parent}.{field_name}' if parent else field_name
+        return key
+
+    def add(self, field):
+        with self._lock:
+            self.fields.append(field)
+
+    @property
+    def sql_count(self):
+        return sum(field.sql_count for field in self.fields)
+
+    @property
+    def sql_duration(self):
+        return sum(field.sql_duration for field in self.fields)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+        metrics.record(self)
+
+    def as_extension(self):
+        return {
+            'duration_ms': self.duration * 1000,
+            'sql': {'count': self.sql_count, 'duration_ms': self.sql_duration * 1000},
+            'resolvers': [
+                {
+                    'path': field.path,
+                    'start_offset_ms': (field.start - self.start) * 1000,
+                    'duration_ms': field.duration * 1000,
+                    'sql_count': field.sql_count,
+                    'sql_duration_ms': field.sql_duration * 1000,
+                }
+                for field in sorted(self.fields, key=lambda field: field.start)
+            ],
+        }
+
+
+def start_trace(operation_name, requested=False):
+    """A Trace for the next operation, or None when it is not sampled."""
+    if requested or random.random() < settings.GRAPHQL_METRICS_SAMPLE_RATE:
+        return Trace(operation_name)
+    return None
+
+
+class MetricsMiddleware:
+    """Times the resolvers of traced operations, see the module docstring. It
+    goes last in GRAPHENE['MIDDLEWARE'] so that it wraps the other middleware,
+    which authenticates and evaluates the querysets resolvers return."""
+
+    def resolve(self, next, root, info, **kwargs):
+        trace = getattr(info.context, 'graphql_trace', None)
+        if trace is None:
+            return next(root, info, **kwargs)
+        path = info.path.as_list()
+        field = FieldTrace(path, trace.key(path, info.field_name), time.perf_counter())
+        try:
+            with connection.execute_wrapper(field):
+                return next(root, info, **kwargs)
+        finally:
+            field.duration = time.perf_counter() - field.start
+            if field.sql_count or not is_leaf_type(get_named_type(info.return_type)):
+                trace.add(field)
+
+
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,89 @@
+import base64
+import binascii
+import json
+import graphene
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from graphql import GraphQLError
+from .dataloader import get_registry
+
+# newest first, with the primary key breaking ties between rows saved in the same instant
+DEFAULT_KEYS = ('-created_at', '-id')
+
+
+def connection_field(connection, **kwargs):
+    return graphene.Field(connection, first=graphene.Int(), after=graphene.String(), **kwargs)
+
+
+def page_size(first):
+    if first is None:
+        return settings.PAGINATION_DEFAULT_PAGE_SIZE
+    if first < 1:
+        raise GraphQLError('first must be a positive number')
+    return min(first, settings.PAGINATION_MAX_PAGE_SIZE)
+
+
+def encode_cursor(instance, keys):
+    values = []
+    for key in keys:
+        value = getattr(instance, key.lstrip('-'))
+        values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, model, keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError(cursor)
+        return [_to_python(model, key.lstrip('-'), value) for key, value in zip(keys, values)]
+    except (ValueError, TypeError, binascii.Error, json.JSONDecodeError):
+        raise GraphQLError('Invalid cursor')
+
+
+def _to_python(model, name, value):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        # annotations such as a search rank are stored as plain JSON values
+        return value
+    return field.to_python(value)
+
+
+def after_filter(keys, values):
+    # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y), which the database
+    # answers as a range scan on an index over the key columns
+    condition = Q()
+    for position, key in enumerate(keys):
+        name = key.lstrip('-')
+        lookup = 'lt' if key.startswith('-') else 'gt'
+        equal = {keys[prior].lstrip('-'): values[prior] for prior in range(position)}
+        condition |= Q(**equal, **{f'{name}__{lookup}': values[position]})
+    return condition
+
+
+def make_connection(info, connection, rows, has_next_page, after, cursor):
+    get_registry(info.context).register(rows)
+    edges = [connection.Edge(node=row, cursor=cursor(row)) for row in rows]
+    page_info = graphene.relay.PageInfo(
+        has_next_page=has_next_page,
+        has_previous_page=bool(after),
+        start_cursor=edges[0].cursor if edges else None,
+        end_cursor=edges[-1].cursor if edges else None,
+    )
+    return connection(edges=edges, page_info=page_info)
+
+
+def page(queryset, first=None, after=None, keys=DEFAULT_KEYS):
+    """The rows of the page after the cursor `after` and whether more remain."""
+    size = page_size(first)
+    if after:
+        queryset = queryset.filter(after_filter(keys, decode_cursor(after, queryset.model, keys)))
+    rows = list(queryset.order_by(*keys)[:size + 1])
+    return rows[:size], len(rows) > size
+
+
+def paginate(info, queryset, connection, first=None, after=None, keys=DEFAULT_KEYS):
+    rows, has_next_page = page(queryset, first, after, keys)
+    return make_connection(info, connection, rows, has_next_page, after, lambda row: encode_cursor(row, keys))
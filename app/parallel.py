@@ -0,0 +1,119 @@
+"""Concurrent execution of the root fields of a query.
+
+The resolvers and loaders are synchronous (Django 4.2's ORM has async query
+methods, but they run the same queries on a thread of their own), so the
+async view handles each request on a pool of GRAPHQL_REQUEST_THREADS threads, and `me`, `notifications` and
+`userPosts` in one query would still resolve one after the other on that
+thread. A query with several root fields is therefore split into one document
+per response key (the fields selected under the same alias or name are merged
+by the executor, so they stay together) and each is executed on a second pool of GRAPHQL_FIELD_THREADS
+threads; the pools are separate so that requests waiting for their fields can
+never take up every thread their fields need. The executions share the
+request, so the user is authenticated once and the loader registry batches
+across all of them.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.db import close_old_connections
+from graphql import (
+    DocumentNode, ExecutionResult, FieldNode, FragmentDefinitionNode, OperationDefinitionNode, OperationType,
+    SelectionSetNode, execute_sync,
+)
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.utils import get_http_authorization
+from .dataloader import get_registry
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool(name, size):
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f'graphql-{name}')
+    return _pools[name]
+
+
+def request_pool():
+    return _pool('request', settings.GRAPHQL_REQUEST_THREADS)
+
+
+def field_pool():
+    return _pool('field', settings.GRAPHQL_FIELD_THREADS)
+
+
+def root_fields(operation_ast):
+    """The root fields of a query that can run concurrently, grouped by
+    response key in the order the keys first appear, or an empty list when
+    the operation must run as a whole."""
+    if operation_ast is None or operation_ast.operation != OperationType.QUERY:
+        return []
+    selections = operation_ast.selection_set.selections
+    # fragments spread on the root type are rare and are not worth splitting
+    if not all(isinstance(selection, FieldNode) for selection in selections):
+        return []
+    groups = {}
+    for field in selections:
+        key = (field.alias or field.name).value
+        groups.setdefault(key, []).append(field)
+    return [tuple(fields) for fields in groups.values()]
+
+
+def field_document(document, operation_ast, fields):
+    operation = OperationDefinitionNode(
+        operation=operation_ast.operation,
+        name=operation_ast.name,
+        variable_definitions=operation_ast.variable_definitions,
+        directives=operation_ast.directives,
+        selection_set=SelectionSetNode(selections=fields),
+    )
+    fragments = [definition for definition in document.definitions if isinstance(definition, FragmentDefinitionNode)]
+    # the whole document was validated, so the pieces are not validated again
+    return DocumentNode(definitions=(operation, *fragments))
+
+
+def authenticate_once(request):
+    # done before the fields start so JSONWebTokenMiddleware finds the user
+    # instead of decoding the token on every thread
+    if not request.user.is_anonymous or get_http_authorization(request) is None:
+        return
+    try:
+        user = authenticate(request=request)
+    except JSONWebTokenError:
+        # the middleware reports the error on each field
+        return
+    if user is not None:
+        request.user = user
+
+
+def _execute_field(options):
+    try:
+        return execute_sync(**options)
+    finally:
+        close_old_connections()
+
+
+def execute_concurrently(options, operation_ast, groups):
+    context = options['context_value']
+    authenticate_once(context)
+    # created up front so that every thread shares it
+    get_registry(context)
+    futures = [
+        field_pool().submit(
+            _execute_field, {**options, 'document': field_document(options['document'], operation_ast, fields)}
+        )
+        for fields in groups
+    ]
+    data = {}
+    errors = []
+    for future in futures:
+        result = future.result()
+        errors.extend(result.errors or ())
+        if data is not None and result.data is not None:
+            data.update(result.data)
+        else:
+            # a non-null root field failed, which nulls the whole response
+            data = None
+    return ExecutionResult(data=data, errors=errors or None)
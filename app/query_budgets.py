@@ -0,0 +1,84 @@
+"""Query-count budgets for the GraphQL API.
+
+`QueryBudgetTestMixin` runs each named operation of a suite twice, against
+data seeded at the two SIZES, and fails when the number of SQL statements
+differs between them (it grows with the number of rows returned, an N+1) or
+exceeds the operation's budget in query_budgets.json. Failures list the
+statements of the larger run.
+
+The budgets are checked in next to this module. After a change that is meant
+to alter them, rewrite the file with
+
+    QUERY_BUDGETS_UPDATE=1 python manage.py test
+
+and review its diff like any other.
+"""
+import json
+import os
+from pathlib import Path
+from django.db import transaction
+from accounts.graph import follow_graph
+from posts.hashtags import trends
+from .graphql_testing import GraphQLTestMixin, seed
+
+BUDGETS_FILE = Path(__file__).with_name('query_budgets.json')
+
+# rows seeded per list for the two runs of every operation
+SIZES = (4, 12)
+
+
+def load_budgets():
+    if not BUDGETS_FILE.exists():
+        return {}
+    return json.loads(BUDGETS_FILE.read_text())
+
+
+def save_budgets(updates):
+    budgets = {**load_budgets(), **updates}
+    BUDGETS_FILE.write_text(json.dumps(dict(sorted(budgets.items())), indent=2) + '\n')
+
+
+def _listing(statements):
+    return '\n'.join(f'{number}. {sql}' for number, sql in enumerate(statements, 1))
+
+
+class QueryBudgetTestMixin(GraphQLTestMixin):
+    """Mixin for TestCase. `operations` maps operation names to operations,
+    see GraphQLTestMixin; their budgets are stored as `<app>.<name>`."""
+
+    def budget_key(self, name):
+        return f"{type(self).__module__.split('.')[0]}.{name}"
+
+    def measure(self, name, size):
+        """The statements the named operation runs against data of `size`."""
+        with transaction.atomic():
+            self.users = seed(size)
+            # counts recorded by earlier runs would be checkpointed into this one
+            trends.reset()
+            result, statements = self.run_operation(*self.operation(name))
+            transaction.set_rollback(True)
+        follow_graph.load()
+        self.assertNotIn('errors', result, result)
+        return statements
+
+    def test_query_budgets(self):
+        budgets = load_budgets()
+        updates = {}
+        for name in self.operations:
+            key = self.budget_key(name)
+            with self.subTest(key):
+                small, large = (self.measure(name, size) for size in SIZES)
+                if len(large) != len(small):
+                    self.fail(
+                        f'{key} runs {len(small)} queries for {SIZES[0]} rows and {len(large)} for {SIZES[1]}:\n'
+                        + _listing(large)
+                    )
+                if os.environ.get('QUERY_BUDGETS_UPDATE'):
+                    updates[key] = len(large)
+                    continue
+                if key not in budgets:
+                    self.fail(f'{key} has no budget in {BUDGETS_FILE.name}, it runs {len(large)} queries')
+                if len(large) > budgets[key]:
+                    self.fail(f'{key} runs {len(large)} queries, over its budget of {budgets[key]}:\n' + _listing(large))
+        if updates:
+            save_budgets(updates)
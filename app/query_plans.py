@@ -0,0 +1,73 @@
+"""Query-plan checks for the GraphQL API.
+
+`QueryPlanTestMixin` runs an operation through /graphql/, captures every
+statement it issues (including the notifications written once it commits),
+asks SQLite for each one's `EXPLAIN QUERY PLAN` and fails when a table is
+scanned without an index. The per-app suites in accounts/tests.py,
+posts/tests.py and group/tests.py list an operation for every field of their
+app's Query and Mutation; a scan that is expected goes in the suite's
+`allowed_scans`, mapping the table to the reason it is acceptable.
+
+Each operation runs in a savepoint that is rolled back afterwards, so
+mutations never change the data the next operation sees, see
+app/graphql_testing.py.
+"""
+import re
+from django.db import connection
+from graphene.utils.str_converters import to_snake_case
+from .graphql_testing import GraphQLTestMixin, seed
+
+# "SCAN posts_post" reads the whole table, "SCAN posts_post USING INDEX ..."
+# walks an index in order and stops at the page size
+_SCAN = re.compile(r'^SCAN (?P<table>\S+)(?: AS \S+)?$')
+
+_EXPLAINED = ('SELECT', 'UPDATE', 'DELETE')
+
+
+def table_scans(sql):
+    """The tables `sql` scans without an index."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        details = [row[-1] for row in cursor.fetchall()]
+    # subqueries are scanned too once they are materialised, e.g. the one
+    # Django wraps around a filter on a window function
+    tables = set(connection.introspection.table_names())
+    scans = []
+    for detail in details:
+        match = _SCAN.match(detail)
+        if match is not None and match['table'] in tables:
+            scans.append(match['table'])
+    return scans
+
+
+class QueryPlanTestMixin(GraphQLTestMixin):
+    """Mixin for TestCase. `operations` maps each root field to the operation
+    that exercises it, see GraphQLTestMixin."""
+
+    # table -> why scanning it is fine
+    allowed_scans = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed()
+
+    def assertNoTableScans(self, query, variables=None, user=None):
+        result, statements = self.run_operation(query, variables, user)
+        self.assertNotIn('errors', result, result)
+        for sql in statements:
+            if not sql.lstrip().upper().startswith(_EXPLAINED):
+                continue
+            for table in table_scans(sql):
+                if table not in self.allowed_scans:
+                    self.fail(f'{table} is scanned without an index by:\n{sql}')
+
+    def assertCoversFields(self, *object_types):
+        """Every field of the given Query and Mutation classes has an operation."""
+        fields = {name for object_type in object_types for name in object_type._meta.fields}
+        covered = {to_snake_case(name) for name in self.operations}
+        self.assertEqual(fields - covered, set(), 'fields without a query-plan check')
+
+    def test_query_plans(self):
+        for name in self.operations:
+            with self.subTest(name):
+                self.assertNoTableScans(*self.operation(name))
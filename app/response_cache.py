@@ -0,0 +1,256 @@
+"""Shared cache of query responses.
+
+Queries whose root fields are all listed in a Query class's `cacheable_fields`
+are answered from the cache, keyed by the printed document, the operation name,
+the variables and the viewer class. A response is only cached for logged in
+viewers when it selects none of the `viewer_fields` of its types, which
+depend on who is asking.
+
+Every response is tagged with the collections its root fields list and with
+each model instance it returned. Mutations call `invalidate` with the models
+and instances they changed; once their transaction commits the tags get a new
+version and every response stored under an older version is a miss.
+GRAPHQL_RESPONSE_CACHE_TIMEOUT bounds how long a response computed while a
+write was in flight can be served.
+
+Concurrent misses for the same key in one process wait for the first one
+instead of all running the query.
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from graphene.utils.str_converters import to_camel_case
+from graphql import ExecutionResult, TypeInfo, TypeInfoVisitor, Visitor, print_ast, visit
+from graphql_jwt.utils import get_http_authorization
+from .dataloader import get_registry
+
+
+class LRUBackend:
+    """Keeps responses in this process. Invalidations made by other processes
+    are not seen, so entries live for at most GRAPHQL_RESPONSE_CACHE_TIMEOUT."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return found
+
+    def set_many(self, values, timeout=None):
+        # the timeout is checked by ResponseCache, which stores it in the entry
+        with self._lock:
+            self._entries.update(values)
+            for key in values:
+                self._entries.move_to_end(key)
+            while len(self._entries) > settings.GRAPHQL_RESPONSE_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheBackend:
+    """Stores responses in the GRAPHQL_RESPONSE_CACHE_ALIAS cache, which
+    several processes can share."""
+
+    @property
+    def cache(self):
+        return caches[settings.GRAPHQL_RESPONSE_CACHE_ALIAS]
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def set_many(self, values, timeout=None):
+        self.cache.set_many(values, timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+def tag(target):
+    """The tag of a model (its collection) or of a model instance."""
+    if isinstance(target, type):
+        return target._meta.label
+    return f'{target._meta.label}:{target.pk}'
+
+
+def _tag_key(name):
+    return f'graphql:tag:{name}'
+
+
+def _class_attribute(graphene_type, name):
+    # the merged Query inherits one mapping per app
+    merged = {}
+    for base in reversed(getattr(graphene_type, '__mro__', ())):
+        merged.update(vars(base).get(name) or {})
+    return merged
+
+
+class _Fields(Visitor):
+    def __init__(self, type_info):
+        super().__init__()
+        self.type_info = type_info
+        self.fields = set()
+
+    def enter_field(self, node, *args):
+        parent_type = self.type_info.get_parent_type()
+        if parent_type is not None:
+            self.fields.add((parent_type, node.name.value))
+
+
+class ResponseCache:
+    def __init__(self):
+        self._backend = None
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None and settings.GRAPHQL_RESPONSE_CACHE_BACKEND:
+            self._backend = import_string(settings.GRAPHQL_RESPONSE_CACHE_BACKEND)()
+        return self._backend
+
+    def collections(self, schema, document):
+        """The models listed by the root fields of a query and the viewer
+        dependent fields it selects, or None when a root field is not cacheable."""
+        type_info = TypeInfo(schema.graphql_schema)
+        selected = _Fields(type_info)
+        visit(document, TypeInfoVisitor(type_info, selected))
+
+        query_type = schema.graphql_schema.query_type
+        cacheable = {
+            to_camel_case(name): model
+            for name, model in _class_attribute(query_type.graphene_type, 'cacheable_fields').items()
+        }
+        collections = set()
+        viewer_fields = set()
+        for parent_type, name in selected.fields:
+            if name.startswith('__'):
+                continue
+            if parent_type is query_type:
+                if name not in cacheable:
+                    return None
+                collections.add(cacheable[name])
+            elif name in {to_camel_case(field) for field in getattr(getattr(parent_type, 'graphene_type', None), 'viewer_fields', ())}:
+                viewer_fields.add(name)
+        return collections, viewer_fields
+
+    def key(self, request, schema, document, operation, variables):
+        """The cache key of a query operation and the tags of the collections
+        it lists, or None when it is not cacheable."""
+        if self.backend is None or operation.operation.value != 'query':
+            return None
+        found = self.collections(schema, document)
+        if found is None:
+            return None
+        collections, viewer_fields = found
+        viewer = 'anonymous' if get_http_authorization(request) is None else 'user'
+        if viewer != 'anonymous' and viewer_fields:
+            return None
+        name = operation.name.value if operation.name else None
+        payload = json.dumps([print_ast(document), name, variables or {}, viewer], sort_keys=True, default=str)
+        return f'graphql:response:{hashlib.sha256(payload.encode()).hexdigest()}', [tag(model) for model in collections]
+
+    def get(self, key):
+        entry = self.backend.get_many([key]).get(key)
+        if entry is None:
+            return None
+        versions, expires_at, data = entry
+        if expires_at < time.time():
+            return None
+        current = self.backend.get_many([_tag_key(name) for name in versions])
+        if any(current.get(_tag_key(name)) != version for name, version in versions.items()):
+            return None
+        return data
+
+    def set(self, key, data, tags):
+        keys = {_tag_key(name): name for name in tags}
+        current = self.backend.get_many(list(keys))
+        # every tag gets a version, so a tag evicted later never matches an entry
+        missing = {tag_key: uuid.uuid4().hex for tag_key in keys if tag_key not in current}
+        if missing:
+            self.backend.set_many(missing, None)
+            current.update(missing)
+        versions = {name: current[tag_key] for tag_key, name in keys.items()}
+        timeout = settings.GRAPHQL_RESPONSE_CACHE_TIMEOUT
+        self.backend.set_many({key: (versions, time.time() + timeout, data)}, timeout)
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached result for `key` and True, or runs `compute` and
+        returns its result and False. `compute` returns an ExecutionResult and
+        the tags to store its data under, or None for tags when it must not be
+        cached."""
+        data = self.get(key)
+        if data is not None:
+            return ExecutionResult(data=data), True
+
+        with self._lock:
+            leader = self._inflight.get(key)
+            if leader is None:
+                self._inflight[key] = threading.Event()
+        if leader is not None:
+            leader.wait(settings.GRAPHQL_RESPONSE_CACHE_WAIT)
+            data = self.get(key)
+            if data is not None:
+                return ExecutionResult(data=data), True
+            # the first request failed or was not cacheable, run it ourselves
+            result, _ = compute()
+            return result, False
+
+        try:
+            result, tags = compute()
+            if tags is not None:
+                self.set(key, result.data, tags)
+            return result, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key).set()
+
+    def tags(self, context, collections):
+        """The tags of everything a request has resolved so far."""
+        tags = set(collections)
+        for model, pks in get_registry(context).seen.items():
+            label = model._meta.label
+            tags.update(f'{label}:{pk}' for pk in pks)
+        return tags
+
+    def invalidate(self, *targets):
+        """Invalidates the responses tagged with the given models and instances
+        once the current transaction commits. Tags are computed straight away,
+        so instances may be deleted afterwards."""
+        if self.backend is None:
+            return
+        names = [tag(target) for target in targets]
+        transaction.on_commit(
+            lambda: self.backend.set_many({_tag_key(name): uuid.uuid4().hex for name in names}, None)
+        )
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+response_cache = ResponseCache()
+invalidate = response_cache.invalidate
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    if setting.startswith('GRAPHQL_RESPONSE_CACHE'):
+        response_cache._backend = None
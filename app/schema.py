@@ -0,0 +1,16 @@
+import graphene
+from accounts.query import Query as AccountsQuery, Mutation as AccountsMutation
+from posts.query import Query as PostsQuery, Mutation as PostsMutation
+from group.query import Query as GroupQuery, Mutation as GroupMutation
+
+
+# one schema for the whole API, so a screen can fetch users, posts and groups in a single request
+class Query(AccountsQuery, PostsQuery, GroupQuery, graphene.ObjectType):
+    pass
+
+
+class Mutation(AccountsMutation, PostsMutation, GroupMutation, graphene.ObjectType):
+    pass
+
+
+schema = graphene.Schema(query=Query, mutation=Mutation)
@@ -0,0 +1,200 @@
+"""Synthetic data at configurable scale, for load tests and benchmarks.
+
+Everything is drawn from one random.Random(seed), so the same arguments always
+produce the same data. Popularity follows a Zipf distribution: a few accounts
+collect most of the follows, a few posts most of the likes, comments and
+reposts, and a few groups most of the members. Rows are written with bulk_create in batches of
+`batch_size`, and the denormalised post and group counters and home timelines are
+written along with them, so the data needs no rebuild afterwards.
+"""
+import random
+from dataclasses import dataclass
+from itertools import accumulate
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from accounts.graph import follow_graph
+from accounts.models import Following
+from group.models import Group, GroupMembership
+from posts import hashtags
+from posts.models import Comment, Like, Post, Repost, TimelineEntry
+
+User = get_user_model()
+
+WORDS = (
+    'django graphql python sqlite index query cache latency timeline follow post like comment repost group '
+    'weekend coffee music football release deploy bug feature review morning news travel photo launch'
+).split()
+
+# share of posts that carry a hashtag, drawn from WORDS by Zipf popularity
+HASHTAG_SHARE = 0.3
+
+# every seeded account logs in with this password
+PASSWORD = 'password'
+
+
+@dataclass
+class Scale:
+    users: int = 1000
+    follows: int = 30
+    posts: int = 10000
+    likes: int = 30000
+    comments: int = 5000
+    reposts: int = 2000
+    groups: int = 50
+    memberships: int = 2000
+    # Zipf exponent of account and post popularity
+    alpha: float = 1.1
+    seed: int = 1
+    batch_size: int = 1000
+
+
+def zipf(count, alpha):
+    """Cumulative Zipf weights of `count` ranks, for random.choices."""
+    return list(accumulate(1 / (rank + 1) ** alpha for rank in range(count)))
+
+
+def _draw(rng, popularity, k):
+    return rng.choices(range(len(popularity)), cum_weights=popularity, k=k)
+
+
+def _pairs(rng, rows, popularity, count):
+    """Up to `count` distinct (row, column) pairs; rows are drawn uniformly
+    and columns by popularity."""
+    pairs = set()
+    # duplicates are dropped, so draw twice as many as needed
+    for column in _draw(rng, popularity, count * 2):
+        if len(pairs) >= count:
+            break
+        pairs.add((rng.randrange(rows), column))
+    return pairs
+
+
+def _text(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def generate(scale, log=print):
+    """Writes the data described by `scale` and returns the number of rows
+    written per model."""
+    rng = random.Random(scale.seed)
+    batch = scale.batch_size
+    counts = {}
+
+    with transaction.atomic():
+        # hashing is deliberately slow, so every account shares one hash
+        password = make_password(PASSWORD)
+        offset = User.objects.count()
+        users = User.objects.bulk_create([
+            User(
+                username=f'seed{offset + index}', email=f'seed{offset + index}@example.com', password=password,
+                first_name='Seed', last_name=str(offset + index), bio=_text(rng, 8), location='Accra',
+            )
+            for index in range(scale.users)
+        ], batch_size=batch)
+        counts['users'] = len(users)
+        log(f'users: {len(users)}')
+
+        popularity = zipf(scale.users, scale.alpha)
+        followers = {}
+        edges = set()
+        for follower in range(scale.users):
+            for following in _draw(rng, popularity, scale.follows):
+                if following != follower:
+                    edges.add((follower, following))
+        Following.objects.bulk_create(
+            [Following(follower=users[a], following=users[b]) for a, b in edges], batch_size=batch
+        )
+        for follower, following in edges:
+            followers.setdefault(following, []).append(follower)
+        counts['follows'] = len(edges)
+        log(f'follows: {len(edges)}')
+
+        # authors are drawn uniformly: popular accounts posting the most as
+        # well would multiply the timeline fan-out far beyond real traffic
+        authors = [rng.randrange(scale.users) for _ in range(scale.posts)]
+        post_popularity = zipf(scale.posts, scale.alpha)
+        likes = _pairs(rng, scale.users, post_popularity, scale.likes)
+        comments = [(rng.randrange(scale.users), post) for post in _draw(rng, post_popularity, scale.comments)]
+        reposts = _pairs(rng, scale.users, post_popularity, scale.reposts)
+        posts = [Post(post=_text(rng), created_by=users[author]) for author in authors]
+        # drawn apart so the rest of the data is the same as before posts had hashtags
+        tag_rng = random.Random(scale.seed)
+        tag_popularity = zipf(len(WORDS), scale.alpha)
+        for post in posts:
+            if tag_rng.random() < HASHTAG_SHARE:
+                post.post += f' #{WORDS[_draw(tag_rng, tag_popularity, 1)[0]]}'
+        for counter, rows in (('likes_count', likes), ('comments_count', comments), ('reposts_count', reposts)):
+            for _, post in rows:
+                setattr(posts[post], counter, getattr(posts[post], counter) + 1)
+        posts = Post.objects.bulk_create(posts, batch_size=batch)
+        counts['posts'] = len(posts)
+        log(f'posts: {len(posts)}')
+        counts['post_hashtags'] = hashtags.tag(posts)
+        log(f"post hashtags: {counts['post_hashtags']}")
+
+        Like.objects.bulk_create([Like(liked_by=users[u], post=posts[p]) for u, p in likes], batch_size=batch)
+        Comment.objects.bulk_create(
+            [Comment(comment_by=users[u], post=posts[p], comment=_text(rng, 6)) for u, p in comments], batch_size=batch
+        )
+        reposts = Repost.objects.bulk_create(
+            [Repost(repost_by=users[u], post=posts[p], comment=_text(rng, 4)) for u, p in reposts], batch_size=batch
+        )
+        counts.update(likes=len(likes), comments=len(comments), reposts=len(reposts))
+        log(f'likes: {len(likes)}, comments: {len(comments)}, reposts: {len(reposts)}')
+
+        # the timelines posts/timeline.py would have written, skipping the
+        # authors it pulls at read time
+        index_of = {user.id: index for index, user in enumerate(users)}
+        entries = 0
+
+        def timeline_entries(post, author, repost=None):
+            created_at = repost.created_at if repost else post.created_at
+            owners = [author]
+            if len(followers.get(author, ())) <= settings.TIMELINE_PUSH_THRESHOLD:
+                owners += followers.get(author, ())
+            for owner in owners:
+                yield TimelineEntry(
+                    owner=users[owner], post=post, repost=repost, author=users[author], created_at=created_at,
+                )
+
+        pending = []
+        for post in posts:
+            pending.extend(timeline_entries(post, index_of[post.created_by_id]))
+            if len(pending) >= batch:
+                entries += len(TimelineEntry.objects.bulk_create(pending, batch_size=batch))
+                pending = []
+        for repost in reposts:
+            pending.extend(timeline_entries(repost.post, index_of[repost.repost_by_id], repost))
+            if len(pending) >= batch:
+                entries += len(TimelineEntry.objects.bulk_create(pending, batch_size=batch))
+                pending = []
+        entries += len(TimelineEntry.objects.bulk_create(pending, batch_size=batch))
+        counts['timeline_entries'] = entries
+        log(f'timeline entries: {entries}')
+
+        offset = Group.objects.count()
+        groups = [
+            Group(name=f'seed group {offset + index}', description=_text(rng, 8), created_by=users[rng.randrange(scale.users)])
+            for index in range(scale.groups)
+        ]
+        memberships = [
+            (u, g, rng.choice(('Accepted', 'Accepted', 'Accepted', 'Pending')))
+            for u, g in (_pairs(rng, scale.users, zipf(scale.groups, scale.alpha), scale.memberships) if groups else ())
+        ]
+        for _, g, status in memberships:
+            if status == 'Accepted':
+                groups[g].members_count += 1
+        groups = Group.objects.bulk_create(groups, batch_size=batch)
+        GroupMembership.objects.bulk_create(
+            [GroupMembership(group=groups[g], user=users[u], status=status) for u, g, status in memberships], batch_size=batch
+        )
+        counts.update(groups=len(groups), memberships=len(memberships))
+        log(f'groups: {len(groups)}, memberships: {len(memberships)}')
+
+    # the follows were written behind the graph's back
+    follow_graph.load()
+    # scripts have no checkpoint worker
+    hashtags.trends.checkpoint()
+    return counts
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.ASGIURLConfMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -117,8 +118,13 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
 STATIC_URL = 'static/'
-# MEDIA_URL = '/media/'
+# post media is kept on the local filesystem, which stands in for Cloudinary
+# in development
+MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_URL = '/media/'
 # DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+# uploads larger than this are streamed to a temporary file instead of memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -126,14 +132,126 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 GRAPHENE = {
-    'SCHEMA': 'accounts.schema.schema',
+    'SCHEMA': 'app.schema.schema',
     'MIDDLEWARE': [
         'graphql_jwt.middleware.JSONWebTokenMiddleware',
+        'app.dataloader.DataLoaderMiddleware',
+        # last, so it wraps the middleware above; see app/metrics.py
+        'app.metrics.MetricsMiddleware',
     ],
 }
 
+# keyset pagination for every list field, see app/pagination.py
+PAGINATION_DEFAULT_PAGE_SIZE = 20
+PAGINATION_MAX_PAGE_SIZE = 100
+
+# in-memory follow graph, see accounts/graph.py
+FOLLOW_GRAPH_MAX_AGE = 60
+FOLLOW_SUGGESTION_FANOUT = 200
+
+# home timeline fan-out, see posts/timeline.py
+TIMELINE_FANOUT_BATCH_SIZE = 1000
+TIMELINE_BACKFILL_SIZE = 200
+# authors with more followers than this are pulled at read time instead of pushed
+TIMELINE_PUSH_THRESHOLD = 10000
+
+# newest comments and reposts returned with a post, see posts/loaders.py
+POST_PREVIEW_SIZE = 50
+
+# write-behind notifications, see posts/notifications.py
+# 'background' batches them on a worker thread, 'commit' writes them as soon as
+# the mutation commits
+NOTIFICATION_DELIVERY = 'background'
+NOTIFICATION_BATCH_SIZE = 100
+NOTIFICATION_FLUSH_INTERVAL = 0.5
+# actions on the same target within this many seconds share one notification
+NOTIFICATION_COALESCE_WINDOW = 24 * 60 * 60
+
+# parsed-document cache and persisted queries, see app/documents.py
+GRAPHQL_DOCUMENT_CACHE_SIZE = 1000
+# JSON object of sha256 -> query text
+GRAPHQL_PERSISTED_QUERIES_FILE = None
+# run nothing but the queries in GRAPHQL_PERSISTED_QUERIES_FILE
+GRAPHQL_PERSISTED_QUERIES_ONLY = False
+# most queries registered by clients that are kept, least recently used
+# dropped first; a client whose hash was dropped sends the query again
+GRAPHQL_PERSISTED_QUERIES_CACHE_SIZE = 1000
+
+# most operations accepted in one batched request (a JSON array of operations)
+GRAPHQL_MAX_BATCH_SIZE = 10
+
+# most items one bulk mutation (bulkFollowUsers, bulkCreatePosts,
+# bulkSetMembershipStatus) accepts
+BULK_MUTATION_MAX_ITEMS = 500
+
+# threads of the async view under ASGI, see app/parallel.py: one pool handles
+# requests, the other resolves the root fields of a query concurrently
+GRAPHQL_REQUEST_THREADS = 16
+GRAPHQL_FIELD_THREADS = 8
+
+# static cost analysis, see app/cost.py; None turns a limit off
+GRAPHQL_MAX_DEPTH = 10
+GRAPHQL_MAX_ALIASES = 20
+GRAPHQL_MAX_COST = 5000
+# assumed length of list fields that are not paginated
+GRAPHQL_COST_LIST_SIZE = 20
+
+# shared response cache for public queries, see app/response_cache.py
+# LRUBackend keeps responses in this process, DjangoCacheBackend stores them in
+# the GRAPHQL_RESPONSE_CACHE_ALIAS cache so several processes can share them.
+# None turns the cache off.
+GRAPHQL_RESPONSE_CACHE_BACKEND = 'app.response_cache.LRUBackend'
+GRAPHQL_RESPONSE_CACHE_ALIAS = 'default'
+# entries kept by LRUBackend
+GRAPHQL_RESPONSE_CACHE_SIZE = 10000
+GRAPHQL_RESPONSE_CACHE_TIMEOUT = 60
+# seconds a miss waits for a concurrent miss of the same query to fill the cache
+GRAPHQL_RESPONSE_CACHE_WAIT = 5
+
+# resolver timing and SQL metrics served on /metrics, see app/metrics.py
+# share of operations traced; requests with "extensions": {"tracing": true}
+# are always traced
+GRAPHQL_METRICS_SAMPLE_RATE = 0.01
+# operation names with series of their own; later names are counted as 'other'
+GRAPHQL_METRICS_MAX_OPERATIONS = 100
+# return the trace of requests that ask for it in the response extensions
+GRAPHQL_TRACING = True
+
+# post media uploads and their resized variants, see posts/media.py
+MEDIA_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+MEDIA_MAX_PIXELS = 40_000_000
+# variant name -> longest side in pixels
+MEDIA_VARIANTS = {'thumbnail': 320, 'medium': 1080}
+MEDIA_VARIANT_FORMATS = ('webp', 'jpeg')
+MEDIA_VARIANT_QUALITY = 80
+# 'pool' renders variants in MEDIA_WORKERS processes, 'inline' on the
+# requesting thread
+MEDIA_PROCESSING = 'pool'
+MEDIA_WORKERS = 2
+MEDIA_MAX_PENDING = 64
+# rendered variants, least recently used evicted past this many bytes
+MEDIA_VARIANT_CACHE_DIR = BASE_DIR / 'variant-cache'
+MEDIA_VARIANT_CACHE_SIZE = 512 * 1024 * 1024
+
+# hashtag trends, see posts/hashtags.py
+# window name -> seconds it spans
+HASHTAG_TREND_WINDOWS = {'hour': 60 * 60, 'day': 24 * 60 * 60}
+# time buckets per window: hashtags leave a window one bucket at a time
+HASHTAG_TREND_BUCKETS = 12
+# hashtags each bucket's Space-Saving sketch tracks
+HASHTAG_TREND_CAPACITY = 1000
+# hashtags a trend lists at most
+HASHTAG_TREND_SIZE = 20
+# seconds between checkpoints of the sketches to the database by a worker
+# thread, which is also how long hashtags take to trend
+HASHTAG_TREND_CHECKPOINT_INTERVAL = 10
+
+# authenticated users of JWT requests, see accounts/auth.py
+AUTH_USER_CACHE_SIZE = 10000
+AUTH_USER_CACHE_TIMEOUT = 60
+
 AUTHENTICATION_BACKENDS = [
-    'graphql_jwt.backends.JSONWebTokenBackend',
+    'accounts.auth.CachedJSONWebTokenBackend',
     'django.contrib.auth.backends.ModelBackend',
 ]
 
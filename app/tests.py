@@ -0,0 +1,270 @@
+import json
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from graphql import ExecutionResult, GraphQLError
+from graphql_jwt.shortcuts import get_token
+from posts.models import Comment, Post
+from .documents import PersistedQueries, query_hash
+from .graphql_testing import GraphQLTestMixin, seed
+from .metrics import Metrics, Trace, metrics
+from .response_cache import ResponseCache, invalidate
+from .schema import schema
+
+
+class AsyncViewTests(TransactionTestCase):
+    # the root fields run on threads with connections of their own, which
+    # only see committed rows
+
+    def setUp(self):
+        seed(4)
+
+    async def post(self, query):
+        response = await AsyncClient().post('/graphql/', json.dumps({'query': query}), content_type='application/json')
+        return response.json()
+
+    def execute(self, query):
+        """The data of `query` executed as one document, as the sync view does."""
+        request = RequestFactory().post('/graphql/')
+        request.user = AnonymousUser()
+        result = schema.execute(query, context_value=request)
+        self.assertIsNone(result.errors)
+        return result.data
+
+    async def test_split_fields_match_sequential_execution(self):
+        # the two `posts` selections share a response key and must be merged
+        query = '''{
+            posts(first: 2) { edges { node { id } } }
+            comments(first: 1) { edges { node { id } } }
+            posts(first: 2) { edges { node { post } } }
+            latest: posts(first: 1) { edges { node { id } } }
+        }'''
+        result = await self.post(query)
+        expected = await sync_to_async(self.execute)(query)
+        self.assertNotIn('errors', result, result)
+        self.assertEqual(result['data'], expected)
+        self.assertEqual(list(result['data']), ['posts', 'comments', 'latest'])
+        self.assertEqual(set(result['data']['posts']['edges'][0]['node']), {'id', 'post'})
+
+
+
+@override_settings(GRAPHQL_PERSISTED_QUERIES_CACHE_SIZE=2)
+class PersistedQueryTests(SimpleTestCase):
+    def register(self, queries, query):
+        return queries.resolve(query, {'persistedQuery': {'sha256Hash': query_hash(query)}})
+
+    def lookup(self, queries, query):
+        try:
+            return queries.resolve(None, {'persistedQuery': {'sha256Hash': query_hash(query)}})
+        except GraphQLError as error:
+            return error.extensions['code']
+
+    def test_registered_queries_are_bounded_least_recently_used_first(self):
+        queries = PersistedQueries()
+        first, second, third = '{ posts { edges { cursor } } }', '{ users { id } }', '{ groups { id } }'
+        self.register(queries, first)
+        self.register(queries, second)
+        # looking the first one up keeps it over the second
+        self.assertEqual(self.lookup(queries, first), first)
+        self.register(queries, third)
+        self.assertEqual(self.lookup(queries, first), first)
+        self.assertEqual(self.lookup(queries, third), third)
+        self.assertEqual(self.lookup(queries, second), 'PERSISTED_QUERY_NOT_FOUND')
+        # which the client answers by sending the query again
+        self.register(queries, second)
+        self.assertEqual(self.lookup(queries, second), second)
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed(4)
+
+    def test_fields_are_keyed_by_field_name_not_alias(self):
+        query = 'query AliasedPosts { chosenByTheClient: posts(first: 2) { edges { node { author: createdBy { username } } } } }'
+        response = self.client.post(
+            '/graphql/', {'query': query, 'extensions': {'tracing': True}}, content_type='application/json',
+        )
+        self.assertNotIn('errors', response.json())
+        rendered = metrics.render()
+        self.assertIn('graphql_field_duration_seconds_count{operation="AliasedPosts",path="posts.edges.node.createdBy"}', rendered)
+        self.assertNotIn('chosenByTheClient', rendered)
+
+    @override_settings(GRAPHQL_METRICS_MAX_OPERATIONS=2)
+    def test_operation_names_past_the_cap_are_counted_as_other(self):
+        recorded = Metrics()
+        for name in ('First', 'Second', 'Third', 'First', 'Fourth'):
+            recorded.record(Trace(name))
+        rendered = recorded.render()
+        self.assertIn('graphql_operation_duration_seconds_count{operation="First"} 2', rendered)
+        self.assertIn('graphql_operation_duration_seconds_count{operation="Second"} 1', rendered)
+        self.assertIn('graphql_operation_duration_seconds_count{operation="other"} 2', rendered)
+        self.assertNotIn('Third', rendered)
+
+
+class ResponseCacheTests(GraphQLTestMixin, TestCase):
+    query = '{ posts(first: 3) { edges { node { id post createdBy { username } } } } }'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed(4)
+
+    def setUp(self):
+        super().setUp()
+        settings = override_settings(GRAPHQL_RESPONSE_CACHE_BACKEND='app.response_cache.LRUBackend')
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_a_repeated_query_is_a_hit(self):
+        first, statements = self.run_operation(self.query)
+        self.assertTrue(statements)
+        second, statements = self.run_operation(self.query)
+        self.assertEqual((second['data'], statements), (first['data'], []))
+        # other variables are another response
+        _, statements = self.run_operation('query ($first: Int) { posts(first: $first) { edges { node { id } } } }', {'first': 2})
+        self.assertTrue(statements)
+
+    def test_a_committed_mutation_invalidates(self):
+        self.run_operation(self.query)
+        self.commit_operation('mutation { createPost(tweet: "fresh") { ok } }', user=self.users[1])
+        result, statements = self.run_operation(self.query)
+        self.assertTrue(statements)
+        self.assertEqual(result['data']['posts']['edges'][0]['node']['post'], 'fresh')
+
+    def test_a_rolled_back_write_does_not_invalidate(self):
+        self.run_operation(self.query)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                invalidate(Post)
+                transaction.set_rollback(True)
+        self.assertEqual(callbacks, [])
+        _, statements = self.run_operation(self.query)
+        self.assertEqual(statements, [])
+
+    def test_viewer_dependent_fields_bypass_the_cache(self):
+        query = '{ posts(first: 3) { edges { node { id createdBy { username isFollowing } } } } }'
+        self.run_operation(query, user=self.users[1])
+        _, statements = self.run_operation(query, user=self.users[1])
+        self.assertTrue(statements)
+        # anonymous viewers follow no one, so theirs is cached
+        self.run_operation(query)
+        _, statements = self.run_operation(query)
+        self.assertEqual(statements, [])
+
+    def test_concurrent_misses_compute_once(self):
+        cache = ResponseCache()
+        computing, release = threading.Event(), threading.Event()
+        computed = []
+
+        def compute():
+            computed.append(threading.current_thread())
+            computing.set()
+            release.wait(5)
+            return ExecutionResult(data={'posts': []}), ['posts.Post']
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(cache.get_or_compute('key', compute)))
+        leader.start()
+        self.assertTrue(computing.wait(5))
+        follower = threading.Thread(target=lambda: results.append(cache.get_or_compute('key', compute)))
+        follower.start()
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual(len(computed), 1)
+        self.assertEqual(sorted(hit for _, hit in results), [False, True])
+        self.assertTrue(all(result.data == {'posts': []} for result, _ in results))
+
+
+class CostLimitTests(GraphQLTestMixin, TestCase):
+    query = '''{
+        first: posts(first: 3) { edges { node { createdBy { username } comments { commentBy { username } } } } }
+        second: posts(first: 2) { edges { node { id } } }
+    }'''
+    limits = [
+        ('depth', 'GRAPHQL_MAX_DEPTH', 'QUERY_TOO_DEEP'),
+        ('aliases', 'GRAPHQL_MAX_ALIASES', 'TOO_MANY_ALIASES'),
+        ('cost', 'GRAPHQL_MAX_COST', 'QUERY_TOO_COSTLY'),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed(4)
+
+    def test_operations_over_a_limit_are_rejected(self):
+        result, _ = self.run_operation(self.query)
+        measured = result['extensions']['cost']
+        self.assertEqual((measured['depth'], measured['aliases']), (6, 2))
+        for name, setting, code in self.limits:
+            with self.subTest(name), override_settings(**{setting: measured[name]}):
+                result, _ = self.run_operation(self.query)
+                self.assertNotIn('errors', result)
+            with self.subTest(name), override_settings(**{setting: measured[name] - 1}):
+                result, statements = self.run_operation(self.query)
+                self.assertEqual(result['errors'][0]['extensions']['code'], code)
+                self.assertEqual(
+                    result['errors'][0]['message'], f'Query {name} {measured[name]} exceeds the limit of {measured[name] - 1}',
+                )
+                # rejected before anything runs
+                self.assertNotIn('data', result)
+                self.assertEqual(statements, [])
+
+    def test_a_page_size_variable_that_was_not_sent_costs_the_default_page(self):
+        query = 'query ($n: Int) { posts(first: $n) { edges { node { createdBy { username } } } } }'
+        result, _ = self.run_operation(query)
+        self.assertNotIn('errors', result)
+        sent, _ = self.run_operation(query, {'n': settings.PAGINATION_DEFAULT_PAGE_SIZE})
+        self.assertEqual(result['extensions']['cost'], sent['extensions']['cost'])
+
+
+class BatchTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed(4)
+
+    def send(self, operations, user=None):
+        headers = {'HTTP_AUTHORIZATION': f'JWT {get_token(user)}'} if user else {}
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/graphql/', json.dumps(operations), content_type='application/json', **headers)
+
+    def test_results_come_back_in_order(self):
+        response = self.send([
+            {'query': '{ posts(first: 1) { edges { node { id } } } }', 'id': 'first'},
+            {'query': 'query Named { comments(first: 2) { edges { node { id } } } }', 'id': 'second'},
+        ])
+        results = response.json()
+        self.assertEqual([(result['id'], result['status']) for result in results], [('first', 200), ('second', 200)])
+        self.assertEqual(len(results[0]['data']['posts']['edges']), 1)
+        self.assertEqual(len(results[1]['data']['comments']['edges']), 2)
+
+    def test_errors_belong_to_their_operation(self):
+        results = self.send([
+            {'query': '{ posts { nothing } }'},
+            {'query': '{ posts(first: 1) { edges { node { id } } } }'},
+        ]).json()
+        self.assertEqual(results[0]['status'], 400)
+        self.assertIn("Cannot query field 'nothing'", results[0]['errors'][0]['message'])
+        self.assertNotIn('errors', results[1])
+        self.assertEqual(results[1]['status'], 200)
+
+    @override_settings(GRAPHQL_MAX_BATCH_SIZE=2)
+    def test_batches_are_capped(self):
+        response = self.send([{'query': '{ posts { edges { cursor } } }'}] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('at most 2 operations', response.content.decode())
+        self.assertEqual(self.send([{'query': '{ posts { edges { cursor } } }'}] * 2).status_code, 200)
+
+    def test_operations_after_a_mutation_see_its_writes(self):
+        viewer = self.users[-1]
+        comment = Comment.objects.exclude(post__like__liked_by=viewer).first()
+        # the comment's post is resolved by a loader, which keeps what it loaded
+        query = {'query': 'query ($id: Int) { comment(id: $id) { post { likeCount } } }', 'variables': {'id': comment.id}}
+        mutation = {'query': 'mutation ($id: Int!) { likePost(post: $id) { ok } }', 'variables': {'id': comment.post_id}}
+        before, liked, after = self.send([query, mutation, query], viewer).json()
+        self.assertTrue(liked['data']['likePost']['ok'])
+        self.assertEqual(
+            after['data']['comment']['post']['likeCount'], before['data']['comment']['post']['likeCount'] + 1,
+        )
@@ -1,9 +1,31 @@
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
+from posts.views import media_variant_view
+from .metrics import metrics_view
+from .schema import schema
+from .views import TwttrGraphQLView
+
+graphql_view = csrf_exempt(TwttrGraphQLView.as_view(graphiql=True, schema=schema))
+
+
+def graphql_urls(view):
+    return [
+        path('graphql/', view),
+        # the per-app endpoints of earlier clients serve the same schema
+        path('users/', view),
+        path('post/', view),
+        path('group/', view),
+    ]
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('users/', include('accounts.urls')),
-    path('post/', include('posts.urls')),
-    path('group/', include('group.urls')),
+    path('metrics', metrics_view),
+    *graphql_urls(graphql_view),
+    path('variants/<str:digest>/<slug:variant>.<slug:extension>', media_variant_view, name='media-variant'),
+    # post media on the local filesystem backend, served in development only
+    *static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT),
 ]
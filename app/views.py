@@ -0,0 +1,219 @@
+import json
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection, transaction
+from django.http import HttpResponseNotAllowed
+from django.http.response import HttpResponseBadRequest
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import HttpError
+from graphene_file_upload.django import FileUploadGraphQLView
+from graphql import GraphQLError, OperationType, execute_sync, get_operation_ast
+from graphql.execution import ExecutionResult
+from .cost import analyze
+from .dataloader import get_registry
+from .documents import document_cache, persisted_queries
+from .metrics import start_trace
+from .parallel import execute_concurrently, request_pool, root_fields
+from .response_cache import response_cache
+
+
+class TwttrGraphQLView(FileUploadGraphQLView):
+    """GraphQLView that runs documents from the parsed-document cache,
+    accepts persisted queries, rejects operations over the cost limits,
+    answers public queries from the response cache and traces a sample of
+    operations for app/metrics.py. Multipart requests carry file uploads, see
+    posts/media.py.
+
+    A JSON array of operations is run as a batch: every operation shares the
+    request, so the user is authenticated once and the loaders of one operation
+    serve the next, and the response is an array of results in the same order.
+    """
+
+    def parse_body(self, request):
+        if self.get_content_type(request) != 'application/json':
+            return super().parse_body(request)
+        try:
+            request_json = json.loads(request.body.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            raise HttpError(HttpResponseBadRequest('POST body sent invalid JSON.'))
+
+        if isinstance(request_json, dict):
+            return request_json
+        if not isinstance(request_json, list) or not all(isinstance(entry, dict) for entry in request_json):
+            raise HttpError(HttpResponseBadRequest('The received data is not a valid JSON query.'))
+        if not request_json:
+            raise HttpError(HttpResponseBadRequest('Received an empty list in the batch request.'))
+        if len(request_json) > settings.GRAPHQL_MAX_BATCH_SIZE:
+            raise HttpError(HttpResponseBadRequest(
+                f'Batch requests may hold at most {settings.GRAPHQL_MAX_BATCH_SIZE} operations.'
+            ))
+        # as_view creates a view per request, so this only affects the current one
+        self.batch = True
+        return request_json
+
+    @staticmethod
+    def get_extensions(request, data):
+        extensions = request.GET.get('extensions') or data.get('extensions')
+        if extensions and isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest('Extensions are invalid JSON.'))
+        return extensions
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        extensions = self.get_extensions(request, data)
+        try:
+            query = persisted_queries.resolve(query, extensions)
+        except GraphQLError as error:
+            return ExecutionResult(errors=[error])
+
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest('Must provide query string.'))
+
+        document, errors = document_cache.get(self.schema, query)
+        if errors:
+            return ExecutionResult(errors=errors)
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if request.method.lower() == 'get' and operation_ast and operation_ast.operation != OperationType.QUERY:
+            if show_graphiql:
+                return None
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ['POST'],
+                    'Can only perform a {} operation from a POST request.'.format(operation_ast.operation.value),
+                )
+            )
+
+        cost = None
+        if operation_ast is not None:
+            try:
+                cost = analyze(self.schema, document, operation_ast, variables)
+            except GraphQLError as error:
+                return ExecutionResult(errors=[error])
+
+        context = self.get_context(request)
+        tracing = isinstance(extensions, dict) and extensions.get('tracing') is True
+        name = operation_ast.name.value if operation_ast and operation_ast.name else operation_name
+        # read by MetricsMiddleware; a batch replaces it for each operation
+        context.graphql_trace = trace = start_trace(name, tracing)
+        is_mutation = operation_ast is not None and operation_ast.operation == OperationType.MUTATION
+        try:
+            options = {
+                'schema': self.schema.graphql_schema,
+                'document': document,
+                'root_value': self.get_root_value(request),
+                'variable_values': variables,
+                'operation_name': operation_name,
+                'context_value': context,
+                'middleware': self.get_middleware(request),
+            }
+            if self.execution_context_class:
+                options['execution_context_class'] = self.execution_context_class
+
+            if is_mutation and (
+                graphene_settings.ATOMIC_MUTATIONS is True
+                or connection.settings_dict.get('ATOMIC_MUTATIONS', False) is True
+            ):
+                with transaction.atomic():
+                    result = self.execute(options, operation_ast)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+            else:
+                cached = response_cache.key(request, self.schema, document, operation_ast, variables) if operation_ast else None
+                if cached is None:
+                    result = self.execute(options, operation_ast)
+                else:
+                    key, collections = cached
+
+                    def compute():
+                        computed = self.execute(options, operation_ast)
+                        return computed, None if computed.errors else response_cache.tags(context, collections)
+
+                    result, hit = response_cache.get_or_compute(key, compute)
+                    result.extensions = {'cache': 'hit' if hit else 'miss'}
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+        finally:
+            if is_mutation:
+                # later operations of a batch must not see what the loaders cached before the writes
+                get_registry(context).results.clear()
+            if trace is not None:
+                trace.finish()
+                context.graphql_trace = None
+
+        if cost is not None:
+            result.extensions = {**(result.extensions or {}), 'cost': cost._asdict()}
+        if trace is not None and tracing and settings.GRAPHQL_TRACING:
+            result.extensions = {**(result.extensions or {}), 'tracing': trace.as_extension()}
+        return result
+
+    def execute(self, options, operation_ast):
+        return execute_sync(**options)
+
+    def get_response(self, request, data, show_graphiql=False):
+        # GraphQLView.get_response drops the extensions of the result
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if execution_result:
+            response = {}
+
+            if execution_result.errors:
+                set_rollback()
+                response['errors'] = [self.format_error(e) for e in execution_result.errors]
+
+            if execution_result.errors and any(not getattr(e, 'path', None) for e in execution_result.errors):
+                status_code = 400
+            else:
+                response['data'] = execution_result.data
+
+            if execution_result.extensions:
+                response['extensions'] = execution_result.extensions
+
+            if self.batch:
+                response['id'] = id
+                response['status'] = status_code
+
+            result = self.json_encode(request, response, pretty=show_graphiql)
+        else:
+            result = None
+
+        return result, status_code
+
+
+class AsyncTwttrGraphQLView(TwttrGraphQLView):
+    """TwttrGraphQLView for the ASGI application. Requests are handled on a
+    worker thread, so a slow query never blocks the event loop, and the root
+    fields of a query run concurrently, see app/parallel.py."""
+
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        handle = sync_to_async(self.dispatch_sync, thread_sensitive=False, executor=request_pool())
+        return await handle(request, *args, **kwargs)
+
+    def dispatch_sync(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            # request_finished only closes the connections of Django's own thread
+            close_old_connections()
+
+    def execute(self, options, operation_ast):
+        groups = root_fields(operation_ast)
+        if len(groups) < 2:
+            return super().execute(options, operation_ast)
+        return execute_concurrently(options, operation_ast, groups)
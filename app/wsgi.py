@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_wsgi_application()
+
+from accounts.graph import follow_graph  # noqa: E402
+from posts.hashtags import trends  # noqa: E402
+
+follow_graph.warm()
+trends.start()
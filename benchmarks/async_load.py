@@ -0,0 +1,144 @@
+"""Load test of the WSGI and ASGI GraphQL paths on concurrent mixed queries.
+
+    python -m benchmarks.async_load --requests 400 --concurrency 16 --latency 2
+
+--latency adds a delay to every SQL query to stand in for a database on the
+network, which is where a blocked worker thread costs the most.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .utils import setup_django, percentile, timer
+
+QUERIES = {
+    # independent root fields that the async view resolves concurrently
+    'profile': '''{
+        me { username followerCount followingCount }
+        notifications(first: 10) { edges { node { message } } }
+        userPosts(first: 10) { edges { node { post likeCount comments { comment } } } }
+    }''',
+    'feed': '{ posts(first: 20) { edges { node { post likeCount createdBy { username } } } } }',
+    'timeline': '{ homeTimeline(first: 20) { edges { node { post { post } author { username } } } } }',
+}
+
+
+def seed():
+    from accounts.models import User, Following
+    from posts.models import Comment, Post, TimelineEntry
+
+    users = User.objects.bulk_create([User(username=f'user{i}', email=f'user{i}@example.com') for i in range(50)])
+    Following.objects.bulk_create([
+        Following(follower=follower, following=followed)
+        for follower in users for followed in users[:10] if follower != followed
+    ])
+    posts = Post.objects.bulk_create([Post(post=f'post {i}', created_by=users[i % 50]) for i in range(500)])
+    Comment.objects.bulk_create([Comment(post=post, comment_by=users[0], comment='nice') for post in posts[::5]])
+    TimelineEntry.objects.bulk_create([
+        TimelineEntry(owner=user, post=post, author=post.created_by, created_at=post.created_at)
+        for user in users for post in posts if post.created_by_id in {u.id for u in users[:10]}
+    ])
+    return users
+
+
+def add_latency(latency):
+    from django.db.backends.signals import connection_created
+
+    def slow(execute, sql, params, many, context):
+        time.sleep(latency / 1000)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.append(slow)
+
+    connection_created.connect(install, weak=False)
+
+
+def body(name):
+    return json.dumps({'query': QUERIES[name]})
+
+
+def run_wsgi(workload, concurrency):
+    from django.db import close_old_connections
+    from django.test import Client
+
+    def send(item):
+        name, token = item
+        samples = []
+        with timer(samples):
+            Client().post('/graphql/', body(name), content_type='application/json', HTTP_AUTHORIZATION=f'JWT {token}')
+        close_old_connections()
+        return name, samples[0]
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(send, workload))
+
+
+async def run_asgi(workload, concurrency):
+    from django.test import AsyncClient
+
+    limit = asyncio.Semaphore(concurrency)
+    client = AsyncClient()
+
+    async def send(item):
+        name, token = item
+        samples = []
+        async with limit:
+            with timer(samples):
+                await client.post('/graphql/', body(name), content_type='application/json', headers={'Authorization': f'JWT {token}'})
+        return name, samples[0]
+
+    return await asyncio.gather(*(send(item) for item in workload))
+
+
+def run(args):
+    setup_django()
+    from django.conf import settings
+    from graphql_jwt.shortcuts import get_token
+
+    # every request should reach the database
+    settings.GRAPHQL_RESPONSE_CACHE_BACKEND = None
+    users = seed()
+    tokens = [get_token(user) for user in users]
+    if args.latency:
+        add_latency(args.latency)
+
+    rng = random.Random(1)
+    workload = [(rng.choice(list(QUERIES)), rng.choice(tokens)) for _ in range(args.requests)]
+
+    results = {}
+    for name in ('wsgi', 'asgi'):
+        start = time.perf_counter()
+        if name == 'wsgi':
+            samples = run_wsgi(workload, args.concurrency)
+        else:
+            samples = asyncio.run(run_asgi(workload, args.concurrency))
+        elapsed = time.perf_counter() - start
+        results[name] = {'requests_per_second': len(samples) / elapsed}
+        for query in ('all', *QUERIES):
+            latencies = [latency for sent, latency in samples if query in ('all', sent)]
+            results[name][query] = {'p50_ms': percentile(latencies, 50), 'p99_ms': percentile(latencies, 99)}
+
+    print(f"{'path':<6}{'req/s':>8}" + ''.join(f'{query + " p50/p99 ms":>26}' for query in ('all', *QUERIES)))
+    for name, row in results.items():
+        print(f"{name:<6}{row['requests_per_second']:>8.1f}" + ''.join(
+            f"{row[query]['p50_ms']:>17.1f} /{row[query]['p99_ms']:>7.1f}" for query in ('all', *QUERIES)
+        ))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=2, help='milliseconds added to every SQL query')
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
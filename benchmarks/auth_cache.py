@@ -0,0 +1,68 @@
+"""Per-request JWT authentication overhead with and without the user cache.
+
+    python -m benchmarks.auth_cache --users 1000 --requests 20000
+"""
+import argparse
+import json
+import random
+from .utils import setup_django, percentile, timer
+
+
+def measure(backend, requests):
+    samples = []
+    for request in requests:
+        with timer(samples):
+            backend.authenticate(request)
+    return samples
+
+
+def run(args):
+    setup_django()
+    from django.test import RequestFactory
+    from graphql_jwt.backends import JSONWebTokenBackend
+    from graphql_jwt.shortcuts import get_token
+    from accounts.auth import CachedJSONWebTokenBackend, user_cache
+    from accounts.models import User
+
+    users = User.objects.bulk_create([User(username=f'user{i}', email=f'user{i}@example.com') for i in range(args.users)])
+    tokens = [get_token(user) for user in users]
+    factory = RequestFactory()
+    rng = random.Random(1)
+    # polling clients: a small share of the users sends most of the requests
+    weights = [1 / (rank + 1) for rank in range(len(tokens))]
+    requests = [
+        factory.post('/graphql/', HTTP_AUTHORIZATION=f'JWT {token}')
+        for token in rng.choices(tokens, weights, k=args.requests)
+    ]
+
+    results = {}
+    for name, backend in (('uncached', JSONWebTokenBackend()), ('cached', CachedJSONWebTokenBackend())):
+        user_cache.clear()
+        samples = measure(backend, requests)
+        results[name] = {
+            'mean_ms': sum(samples) / len(samples),
+            'p50_ms': percentile(samples, 50),
+            'p99_ms': percentile(samples, 99),
+        }
+    results['cache'] = user_cache.stats()
+
+    for name in ('uncached', 'cached'):
+        row = results[name]
+        print(f"{name:<10} mean {row['mean_ms']:.3f} ms  p50 {row['p50_ms']:.3f} ms  p99 {row['p99_ms']:.3f} ms")
+    for name, stats in results['cache'].items():
+        print(f"{name} cache: {stats['hit_rate']:.1%} hits ({stats['hits']} hits, {stats['misses']} misses)")
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""CPU time per request with and without the parsed-document cache.
+
+    python -m benchmarks.document_cache --requests 2000
+"""
+import argparse
+import json
+import time
+from .utils import setup_django, percentile
+
+FEED_QUERY = '''
+query Feed($after: String) {
+  posts(first: 20, after: $after) {
+    edges {
+      cursor
+      node {
+        id post createdAt likeCount commentCount repostCount
+        createdBy { id username followerCount followingCount }
+        comments { id comment commentBy { username } }
+      }
+    }
+    pageInfo { hasNextPage endCursor }
+  }
+}
+'''
+
+
+def measure(client, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.process_time()
+        client.post('/post/', json.dumps({'query': FEED_QUERY}), content_type='application/json')
+        samples.append((time.process_time() - start) * 1000)
+    return samples
+
+
+def run(args):
+    setup_django()
+    from django.test import Client
+    from django.test.utils import override_settings
+    from accounts.models import User
+    from posts.models import Post
+    from app.documents import document_cache
+
+    author = User.objects.create(username='author', email='author@example.com')
+    Post.objects.bulk_create([Post(post=f'post {i}', created_by=author) for i in range(20)])
+    client = Client()
+
+    results = {}
+    for name, size in (('uncached', 0), ('cached', 1000)):
+        document_cache.clear()
+        # the response cache would answer the repeated query without parsing it
+        with override_settings(GRAPHQL_DOCUMENT_CACHE_SIZE=size, GRAPHQL_RESPONSE_CACHE_BACKEND=None):
+            measure(client, 20)
+            samples = measure(client, args.requests)
+        results[name] = {
+            'cpu_mean_ms': sum(samples) / len(samples),
+            'cpu_p50_ms': percentile(samples, 50),
+            'cpu_p99_ms': percentile(samples, 99),
+        }
+    results['saved_per_request_ms'] = results['uncached']['cpu_mean_ms'] - results['cached']['cpu_mean_ms']
+
+    for name in ('uncached', 'cached'):
+        row = results[name]
+        print(f"{name:<10} mean {row['cpu_mean_ms']:.3f} ms  p50 {row['cpu_p50_ms']:.3f} ms  p99 {row['cpu_p99_ms']:.3f} ms")
+    print(f"CPU saved per request: {results['saved_per_request_ms']:.3f} ms")
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Load test of the GraphQL API on a weighted mix of its operations.
+
+    python -m benchmarks.load --users 2000 --posts 20000 --requests 2000 --output load.json
+    python -m benchmarks.load --baseline load.json
+
+Seeds synthetic data with app/seed.py, replays the mix from --concurrency
+threads through /graphql/ as randomly picked users and reports the p50, p95
+and p99 latency, SQL queries and errors of each operation and the overall
+throughput. --output writes the results and the commit they were measured on
+as JSON; --baseline compares the run with such a file.
+"""
+import argparse
+import json
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .utils import setup_django, percentile, timer
+
+# name -> (weight, query, variables drawn from the seeded ids)
+OPERATIONS = {
+    'feed': (20, '''query Feed {
+        posts(first: 20) { edges { node { id post likeCount commentCount createdBy { username } } } }
+    }''', None),
+    'home_timeline': (25, '''query HomeTimeline {
+        homeTimeline(first: 20) { edges { node { createdAt author { username } post { id post likeCount } repost { id } } } }
+    }''', None),
+    'post': (10, '''query Post($id: Int) {
+        post(id: $id) { id post likeCount createdBy { username followerCount } comments { comment commentBy { username } } }
+    }''', lambda rng, ids: {'id': rng.choice(ids['posts'])}),
+    'search': (5, '''query Search($search: String) {
+        searchPost(search: $search, first: 20) { edges { node { id post createdBy { username } } } }
+    }''', lambda rng, ids: {'search': rng.choice(('django', 'coffee release', 'python cache', 'music'))}),
+    'trending': (3, '''query Trending {
+        trendingHashtags(window: "hour", first: 10) { name count }
+    }''', None),
+    'hashtag': (3, '''query Hashtag($hashtag: String!) {
+        postsByHashtag(hashtag: $hashtag, first: 20) { edges { node { id post createdBy { username } } } }
+    }''', lambda rng, ids: {'hashtag': rng.choice(('django', 'coffee', 'music', 'deploy'))}),
+    'profile': (10, '''query Profile {
+        me { username followerCount followingCount }
+        userPosts(first: 10) { edges { node { id post likeCount } } }
+    }''', None),
+    'notifications': (5, '''query Notifications {
+        notifications(first: 20) { edges { node { message isRead actor { username } } } }
+        unreadNotificationCount
+    }''', None),
+    'who_to_follow': (3, '''query WhoToFollow {
+        whoToFollow(first: 10) { username followerCount isFollowing }
+    }''', None),
+    'groups': (2, '''query Groups {
+        groups(first: 20) { edges { node { id name membershipCount } } }
+    }''', None),
+    'like': (10, '''mutation Like($id: Int!) {
+        likePost(post: $id) { ok }
+    }''', lambda rng, ids: {'id': rng.choice(ids['posts'])}),
+    'comment': (4, '''mutation Comment($id: Int!) {
+        createComment(postId: $id, comment: "load test") { ok }
+    }''', lambda rng, ids: {'id': rng.choice(ids['posts'])}),
+    'create_post': (4, '''mutation CreatePost {
+        createPost(tweet: "load test post about #django") { ok }
+    }''', None),
+    'follow': (2, '''mutation Follow($id: Int!) {
+        followUser(userFollowed: $id) { ok }
+    }''', lambda rng, ids: {'id': rng.choice(ids['users'])}),
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def workload(args, ids):
+    rng = random.Random(args.seed)
+    names = list(OPERATIONS)
+    weights = [OPERATIONS[name][0] for name in names]
+    items = []
+    for name in rng.choices(names, weights=weights, k=args.requests):
+        variables = OPERATIONS[name][2]
+        items.append((name, rng.choice(ids['tokens']), variables(rng, ids) if variables else {}))
+    return items
+
+
+def run(args):
+    setup_django()
+    from django.conf import settings
+    from django.db import close_old_connections, connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from graphql_jwt.shortcuts import get_token
+    from accounts.models import User
+    from app.seed import Scale, generate
+    from posts.models import Post
+
+    if args.no_response_cache:
+        settings.GRAPHQL_RESPONSE_CACHE_BACKEND = None
+    # every write is delivered when it commits, so its cost is measured
+    settings.NOTIFICATION_DELIVERY = 'commit'
+    generate(Scale(
+        users=args.users, follows=args.follows, posts=args.posts, likes=args.likes,
+        comments=args.posts // 4, reposts=args.posts // 10, seed=args.seed,
+    ))
+    users = list(User.objects.order_by('id')[:args.viewers])
+    ids = {
+        'users': list(User.objects.values_list('id', flat=True)),
+        'posts': list(Post.objects.values_list('id', flat=True)),
+        'tokens': [get_token(user) for user in users],
+    }
+    items = workload(args, ids)
+
+    def send(item):
+        name, token, variables = item
+        samples = []
+        with CaptureQueriesContext(connection) as queries, timer(samples):
+            response = Client().post(
+                '/graphql/', json.dumps({'query': OPERATIONS[name][1], 'variables': variables}),
+                content_type='application/json', HTTP_AUTHORIZATION=f'JWT {token}',
+            )
+        close_old_connections()
+        return name, samples[0], len(queries.captured_queries), 'errors' in response.json()
+
+    # warm up the document cache and the follow graph
+    for name in OPERATIONS:
+        send((name, ids['tokens'][0], OPERATIONS[name][2](random.Random(0), ids) if OPERATIONS[name][2] else {}))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        measured = list(pool.map(send, items))
+    elapsed = time.perf_counter() - start
+
+    operations = {}
+    for name in OPERATIONS:
+        rows = [row for row in measured if row[0] == name]
+        if not rows:
+            continue
+        latencies = [latency for _, latency, _, _ in rows]
+        queries = [count for _, _, count, _ in rows]
+        operations[name] = {
+            'requests': len(rows),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'queries_mean': sum(queries) / len(queries),
+            'queries_max': max(queries),
+            'errors': sum(1 for row in rows if row[3]),
+        }
+    latencies = [latency for _, latency, _, _ in measured]
+    results = {
+        'commit': git_commit(),
+        'arguments': vars(args),
+        'throughput_rps': len(measured) / elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'operations': operations,
+    }
+    report(results, load_baseline(args.baseline))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+def load_baseline(path):
+    if not path:
+        return None
+    with open(path) as baseline:
+        return json.load(baseline)
+
+
+def _change(value, before):
+    if not before:
+        return ''
+    return f' ({(value - before) / before:+.0%})'
+
+
+def report(results, baseline=None):
+    previous = (baseline or {}).get('operations', {})
+    print(f"{'operation':<16}{'requests':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'errors':>8}")
+    for name, row in results['operations'].items():
+        line = (
+            f"{name:<16}{row['requests']:>9}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+            f"{row['queries_mean']:>9.1f}{row['errors']:>8}"
+        )
+        if name in previous:
+            line += f"  p95{_change(row['p95_ms'], previous[name]['p95_ms'])} queries{_change(row['queries_mean'], previous[name]['queries_mean'])}"
+        print(line)
+    summary = (
+        f"throughput {results['throughput_rps']:.1f} req/s, p50 {results['p50_ms']:.2f} ms, "
+        f"p95 {results['p95_ms']:.2f} ms, p99 {results['p99_ms']:.2f} ms"
+    )
+    if baseline:
+        summary += (
+            f"\nagainst {baseline.get('commit') or 'baseline'}: throughput"
+            f"{_change(results['throughput_rps'], baseline['throughput_rps'])}, p95{_change(results['p95_ms'], baseline['p95_ms'])}"
+        )
+    print(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=30, help='follows drawn per user')
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--likes', type=int, default=30000)
+    parser.add_argument('--viewers', type=int, default=100, help='seeded users the requests are sent as')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--no-response-cache', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', help='compare with the JSON results of an earlier run')
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Latency of the FTS5 post search against the old icontains scan.
+
+    python -m benchmarks.search --posts 1000000
+"""
+import argparse
+import json
+import random
+from .utils import setup_django, percentile, timer
+
+QUERIES = {
+    'common word': 'lorem',
+    'rare word': 'zephyr',
+    'prefix': 'zep*',
+    'phrase': '"lorem ipsum"',
+}
+
+
+def run(args):
+    setup_django()
+    from django.db import connection
+    from accounts.models import User
+    from posts import search
+    from posts.models import Post
+
+    rng = random.Random(args.seed)
+    vocabulary = [f'word{i}' for i in range(args.vocabulary)] + ['lorem'] * 200 + ['ipsum'] * 50
+    author = User.objects.create(username='author', email='author@example.com')
+
+    # drop the sync triggers while loading and index everything in one pass afterwards
+    with connection.cursor() as cursor:
+        for trigger in ('insert', 'delete', 'update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {search.FTS_TABLE}_{trigger}')
+    batch = []
+    for index in range(args.posts):
+        words = rng.choices(vocabulary, k=rng.randint(5, 30))
+        if index % 10000 == 0:
+            words.append('zephyr')
+        batch.append(Post(post=' '.join(words), created_by=author))
+        if len(batch) == 10000:
+            Post.objects.bulk_create(batch)
+            batch = []
+    Post.objects.bulk_create(batch)
+    search.rebuild()
+
+    results = {}
+    for name, query in QUERIES.items():
+        fts, scan = [], []
+        term = query.strip('"').rstrip('*')
+        for _ in range(args.repeat):
+            with timer(fts):
+                search.search_posts(query, args.page_size)
+            with timer(scan):
+                list(Post.objects.filter(post__icontains=term).order_by('-created_at', '-id')[:args.page_size + 1])
+        results[name] = {
+            'fts_p50_ms': percentile(fts, 50),
+            'fts_p99_ms': percentile(fts, 99),
+            'icontains_p50_ms': percentile(scan, 50),
+            'icontains_p99_ms': percentile(scan, 99),
+        }
+
+    print(f"{'query':<14}{'fts p50':>12}{'fts p99':>12}{'scan p50':>12}{'scan p99':>12}")
+    for name, row in results.items():
+        print(
+            f"{name:<14}{row['fts_p50_ms']:>12.2f}{row['fts_p99_ms']:>12.2f}"
+            f"{row['icontains_p50_ms']:>12.2f}{row['icontains_p99_ms']:>12.2f}"
+        )
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
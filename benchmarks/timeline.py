@@ -0,0 +1,115 @@
+"""Write amplification and read latency of the timeline strategies on a
+power-law follow graph.
+
+    python -m benchmarks.timeline --users 5000 --threshold 200
+"""
+import argparse
+import json
+import random
+import shutil
+from .utils import setup_django, percentile, timer
+
+
+def build_graph(users, follows, alpha, rng):
+    # popularity follows a Zipf distribution, so a few accounts collect most follows
+    weights = [1 / (rank + 1) ** alpha for rank in range(users)]
+    edges = set()
+    for follower in range(users):
+        for following in rng.choices(range(users), weights=weights, k=follows):
+            if following != follower:
+                edges.add((follower, following))
+    return edges
+
+
+def database_size(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA page_count')
+        pages = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_size')
+        return pages * cursor.fetchone()[0]
+
+
+def run(args):
+    db_path = setup_django()
+    from django.db import connection
+    from django.test.utils import override_settings
+    from accounts.models import User, Following
+    from posts.models import Post, TimelineEntry
+    from accounts.graph import follow_graph
+    from posts import timeline
+
+    rng = random.Random(args.seed)
+    User.objects.bulk_create([User(username=f'user{i}', email=f'user{i}@example.com') for i in range(args.users)])
+    ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    edges = build_graph(args.users, args.follows, args.alpha, rng)
+    Following.objects.bulk_create(
+        [Following(follower_id=ids[a], following_id=ids[b]) for a, b in edges], batch_size=5000
+    )
+    authors = [rng.randrange(args.users) for _ in range(args.posts)]
+    viewers = [rng.randrange(args.users) for _ in range(args.reads)]
+
+    strategies = {
+        'push': args.users + 1,
+        'pull': -1,
+        'hybrid': args.threshold,
+    }
+    # every strategy starts from its own copy of the users and follows, so the
+    # posts and entries of one are not in the tables another reads
+    connection.close()
+    results = {}
+    for name, threshold in strategies.items():
+        connection.settings_dict['NAME'] = f'{db_path}.{name}'
+        shutil.copyfile(db_path, connection.settings_dict['NAME'])
+        follow_graph.load()
+        with override_settings(TIMELINE_PUSH_THRESHOLD=threshold):
+            writes, reads, written = [], [], 0
+            for author in authors:
+                post = Post.objects.create(post='benchmark', created_by_id=ids[author])
+                with timer(writes):
+                    written += timeline.fan_out(post)
+            for viewer in viewers:
+                owner = User(id=ids[viewer])
+                with timer(reads):
+                    timeline.read(owner, args.page_size)
+        results[name] = {
+            'threshold': threshold,
+            'entries_per_post': written / len(authors),
+            'write_p50_ms': percentile(writes, 50),
+            'write_p99_ms': percentile(writes, 99),
+            'read_p50_ms': percentile(reads, 50),
+            'read_p99_ms': percentile(reads, 99),
+            'posts': Post.objects.count(),
+            'timeline_entries': TimelineEntry.objects.count(),
+            'followings': len(edges),
+            'database_bytes': database_size(connection),
+        }
+        connection.close()
+
+    print(f"{'strategy':<10}{'entries/post':>14}{'write p50':>12}{'write p99':>12}{'read p50':>12}{'read p99':>12}{'entries':>10}{'db MB':>8}")
+    for name, row in results.items():
+        print(
+            f"{name:<10}{row['entries_per_post']:>14.1f}{row['write_p50_ms']:>12.2f}{row['write_p99_ms']:>12.2f}"
+            f"{row['read_p50_ms']:>12.2f}{row['read_p99_ms']:>12.2f}"
+            f"{row['timeline_entries']:>10}{row['database_bytes'] / 2 ** 20:>8.1f}"
+        )
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--follows', type=int, default=30, help='follows drawn per user')
+    parser.add_argument('--alpha', type=float, default=1.1, help='Zipf exponent of account popularity')
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--reads', type=int, default=300)
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--threshold', type=int, default=100, help='follower threshold of the hybrid strategy')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Latency of common screens fetched as one request per app versus one
+request to the unified endpoint.
+
+    python -m benchmarks.unified_endpoint --repeat 200
+"""
+import argparse
+import json
+from .utils import setup_django, percentile, timer
+
+# each screen as the root fields the old users/, post/ and group/ endpoints served
+SCREENS = {
+    'profile': {
+        'users/': 'me { id username followerCount followingCount } userPosts(first: 10) { edges { node { id post likeCount } } }',
+        'post/': 'homeTimeline(first: 10) { edges { node { post { id post } author { username } } } }',
+        'group/': 'groups(first: 10) { edges { node { id name membershipCount } } }',
+    },
+    'home': {
+        'users/': 'me { id username } notifications(first: 10) { edges { node { message } } }',
+        'post/': 'posts(first: 20) { edges { node { id post likeCount commentCount createdBy { username } } } }',
+        'group/': 'groups(first: 5) { edges { node { id name } } }',
+    },
+}
+
+
+def run(args):
+    setup_django()
+    from django.test import Client
+    from graphql_jwt.shortcuts import get_token
+    from accounts.models import User, Following
+    from group.models import Group
+    from posts.models import Post
+
+    users = User.objects.bulk_create([User(username=f'user{i}', email=f'user{i}@example.com') for i in range(50)])
+    viewer = User.objects.get(username='user0')
+    Following.objects.bulk_create([Following(follower=viewer, following=user) for user in users[1:]])
+    Post.objects.bulk_create([Post(post=f'post {i}', created_by=users[i % 50]) for i in range(200)])
+    Group.objects.bulk_create([Group(name=f'group {i}', created_by=viewer) for i in range(10)])
+    client = Client(HTTP_AUTHORIZATION=f'JWT {get_token(viewer)}')
+
+    def send(path, fields):
+        response = client.post(f'/{path}', json.dumps({'query': '{ %s }' % fields}), content_type='application/json')
+        assert 'errors' not in response.json(), response.content
+
+    results = {}
+    for screen, requests in SCREENS.items():
+        separate, unified = [], []
+        for _ in range(args.repeat):
+            with timer(separate):
+                for path, fields in requests.items():
+                    send(path, fields)
+            with timer(unified):
+                send('graphql/', ' '.join(requests.values()))
+        results[screen] = {
+            'three_requests_p50_ms': percentile(separate, 50),
+            'three_requests_p99_ms': percentile(separate, 99),
+            'one_request_p50_ms': percentile(unified, 50),
+            'one_request_p99_ms': percentile(unified, 99),
+        }
+
+    print(f"{'screen':<10}{'3 req p50':>12}{'3 req p99':>12}{'1 req p50':>12}{'1 req p99':>12}")
+    for screen, row in results.items():
+        print(
+            f"{screen:<10}{row['three_requests_p50_ms']:>12.2f}{row['three_requests_p99_ms']:>12.2f}"
+            f"{row['one_request_p50_ms']:>12.2f}{row['one_request_p99_ms']:>12.2f}"
+        )
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+def setup_django(db_path=None):
+    """Boots the project against a throwaway SQLite database so benchmarks
+    never touch the development data."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+    import django
+    from django.conf import settings
+
+    db_path = db_path or os.path.join(tempfile.mkdtemp(prefix='twttr-bench-'), 'bench.sqlite3')
+    settings.DATABASES['default']['NAME'] = db_path
+    settings.ALLOWED_HOSTS = ['*']
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    return db_path
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+@contextmanager
+def timer(samples):
+    start = time.perf_counter()
+    yield
+    samples.append((time.perf_counter() - start) * 1000)
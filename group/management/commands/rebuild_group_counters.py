@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from group.models import Group, GroupMembership
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the accepted-member counter on Group and reports any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+        last_id = 0
+        checked = drifted = 0
+
+        while True:
+            with transaction.atomic():
+                groups, stale = self.rebuild_chunk(last_id, chunk_size, dry_run)
+            if not groups:
+                break
+            last_id = groups[-1].id
+            checked += len(groups)
+            drifted += len(stale)
+
+        verb = 'found' if dry_run else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} groups, {verb} drift on {drifted}'))
+
+    def rebuild_chunk(self, last_id, chunk_size, dry_run):
+        # walk the table by primary key so each chunk is an index range scan
+        groups = list(Group.objects.filter(id__gt=last_id).order_by('id').only('id', 'members_count')[:chunk_size])
+        rows = (
+            GroupMembership.objects.filter(group_id__in=[group.id for group in groups], status='Accepted')
+            .values('group_id').annotate(total=Count('id')).order_by()
+        )
+        actual = {row['group_id']: row['total'] for row in rows}
+
+        stale = []
+        for group in groups:
+            expected = actual.get(group.id, 0)
+            if group.members_count != expected:
+                self.stdout.write(f'Group {group.id}: members_count {group.members_count} -> {expected}')
+                group.members_count = expected
+                stale.append(group)
+
+        if stale and not dry_run:
+            Group.objects.bulk_update(stale, ['members_count'])
+        return groups, stale
@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, When
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 User = get_user_model()
 
@@ -7,14 +9,31 @@ class Group(models.Model):
     name = models.CharField(max_length=100, null=False, unique=True)
     description = models.TextField(null=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    # accepted members, kept in step by the membership mutations and rebuilt
+    # by `manage.py rebuild_group_counters`
+    members_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['created_at', 'id'])]
+
     def __str__(self) -> str:
         return self.name
 
-    def membership_count(self):
-        return GroupMembership.objects.filter(group=self).filter(status='Accepted').count()
+    def adjust_count(self, counter, delta):
+        # F() keeps concurrent approvals from overwriting each other's increments
+        Group.objects.filter(pk=self.pk).update(**{counter: F(counter) + delta})
+
+
+def adjust_members_counts(deltas):
+    """Applies a mapping of group id -> change in accepted members in one statement."""
+    deltas = {group_id: delta for group_id, delta in deltas.items() if delta}
+    if deltas:
+        Group.objects.filter(id__in=deltas).update(members_count=F('members_count') + Case(
+            *[When(id=group_id, then=delta) for group_id, delta in deltas.items()], default=0,
+        ))
+
     
 class GroupMembership(models.Model):
     approval_status = [
@@ -28,4 +47,33 @@ class GroupMembership(models.Model):
     created_at = models.DateTimeField(auto_now=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
-    
\ No newline at end of file
+    class Meta:
+        indexes = [
+            # a group's roster by status, newest first, see groupRoster
+            models.Index(fields=['group', 'status', 'created_at', 'id']),
+            models.Index(fields=['created_at', 'id']),
+        ]
+
+    def accept(self):
+        """Accepts the membership unless it already was, and counts the member.
+        Returns whether this call accepted it."""
+        with transaction.atomic():
+            # the status filter keeps two concurrent approvals from counting twice
+            accepted = GroupMembership.objects.filter(pk=self.pk).exclude(status='Accepted').update(
+                status='Accepted', created_at=timezone.now()
+            )
+            if accepted:
+                self.group.adjust_count('members_count', 1)
+        self.status = 'Accepted'
+        return bool(accepted)
+
+    def remove(self):
+        """Deletes the membership, taking an accepted member off the count."""
+        with transaction.atomic():
+            # the status is matched by the delete rather than read from self,
+            # which a concurrent accept may have made stale
+            accepted, _ = GroupMembership.objects.filter(pk=self.pk, status='Accepted').delete()
+            if accepted:
+                self.group.adjust_count('members_count', -1)
+            else:
+                GroupMembership.objects.filter(pk=self.pk).delete()
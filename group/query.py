@@ -1,19 +1,28 @@
+from collections import Counter
 import graphene
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from graphql import GraphQLError
-from .schema import GroupType, GroupMembershipType
-from .models import GroupMembership, Group
-from posts.models import Notifications
+from app.pagination import DEFAULT_KEYS, connection_field, encode_cursor, make_connection, page, paginate
+from app.response_cache import invalidate
+from .schema import GroupType, GroupMembershipType, GroupConnection, GroupMembershipConnection
+from .models import GroupMembership, Group, adjust_members_counts
+from posts.notifications import notify, notify_many
 from django.contrib.auth import get_user_model
-from accounts.schema import UserType
+from accounts.schema import UserConnection, USER_KEYS
 
 User = get_user_model()
 class Query(graphene.ObjectType):
+    # public fields answered from the response cache, with the model each one lists
+    cacheable_fields = {'groups': Group}
+
     # groups
-    groups = graphene.List(GroupType)
+    groups = connection_field(GroupConnection)
     group = graphene.Field(GroupType, id= graphene.Int())
 
-    def resolve_groups(self, info, **kwargs):
-        return Group.objects.all()
+    def resolve_groups(self, info, first=None, after=None):
+        return paginate(info, Group.objects.all(), GroupConnection, first, after)
     
     def resolve_group(self, info, id):
         if info.context.user.is_anonymous:
@@ -24,28 +33,47 @@ class Query(graphene.ObjectType):
             raise GraphQLError('Group does not exist')
         
     # group membership
-    group_memberships = graphene.List(GroupMembershipType)
+    group_memberships = connection_field(GroupMembershipConnection)
     group_membership = graphene.Field(GroupMembershipType, id= graphene.Int())
 
-    def resolve_group_memberships(self, info, **kwargs):
-        return GroupMembership.objects.all()
+    def resolve_group_memberships(self, info, first=None, after=None):
+        return paginate(info, GroupMembership.objects.all(), GroupMembershipConnection, first, after)
     
-    # get members of a group
-    group_members = graphene.List(UserType, id= graphene.Int())
+    # a group's members, or its pending requests, newest first
+    group_roster = connection_field(GroupMembershipConnection, id=graphene.Int(required=True), status=graphene.String())
+    group_members = connection_field(UserConnection, id=graphene.Int(required=True), status=graphene.String())
 
-    def resolve_group_members(self, info, id):
-        if info.context.user.is_anonymous:
-            raise GraphQLError('You are not authenticated. Log in')
-        try:
-            group = Group.objects.get(id=id)
-        except Group.DoesNotExist:
-            raise GraphQLError('Group does not exist')
-        
-        group_members = GroupMembership.objects.filter(group=group)
-        # return the details of the users
-        return User.objects.filter(id__in=[member.id for member in group_members])
+    def resolve_group_roster(self, info, id, status='Accepted', first=None, after=None):
+        return paginate(info, roster(info, id, status), GroupMembershipConnection, first, after)
+
+    def resolve_group_members(self, info, id, status='Accepted', first=None, after=None):
+        memberships, has_next_page = page(roster(info, id, status), first, after)
+        # the users page in the order they joined, so their cursors are their memberships'
+        cursors = {membership.user_id: encode_cursor(membership, DEFAULT_KEYS) for membership in memberships}
+        return make_connection(
+            info, UserConnection, [membership.user for membership in memberships], has_next_page, after,
+            lambda user: cursors[user.id],
+        )
 
-        
+
+STATUSES = {value for value, _ in GroupMembership.approval_status}
+
+
+def roster(info, group_id, status):
+    """The memberships of a group with `status`, with their users. Pages are
+    a range of the (group, status, created_at, id) index joined to the users
+    by primary key, however large the group."""
+    if info.context.user.is_anonymous:
+        raise GraphQLError('You are not authenticated. Log in')
+    if status not in STATUSES:
+        raise GraphQLError('Status can only be Pending, Accepted or Rejected')
+    try:
+        group = Group.objects.get(id=group_id)
+    except Group.DoesNotExist:
+        raise GraphQLError('Group does not exist')
+    if status != 'Accepted' and group.created_by_id != info.context.user.id:
+        raise GraphQLError('Only the group admin can see membership requests')
+    return GroupMembership.objects.filter(group=group, status=status).select_related('user')
 
 
 class CreateGroup(graphene.Mutation):
@@ -70,6 +98,7 @@ class CreateGroup(graphene.Mutation):
             created_by=info.context.user
         )
         group.save()
+        invalidate(Group)
         return CreateGroup(ok=True, group=group, message='You have successfully created a group')
 
 class JoinGroup(graphene.Mutation):
@@ -96,15 +125,15 @@ class JoinGroup(graphene.Mutation):
                 user=info.context.user,
                 status='Pending'
             )
-            notification = Notifications(
-                    message =f'You have requested to join {group.name}. Wait for admin approval',
-                    message_for = info.context.user
-                )
-            notification.save()
-            membership.save()
+            with transaction.atomic():
+                membership.save()
+                invalidate(group)
+                # sent when the membership commits, so a failed request notifies no one
+                notify(info.context.user, 'join_request', message=f'You have requested to join {group.name}. Wait for admin approval')
             return JoinGroup(ok=True, group_membership=membership, message='You have joined this group. Wait for approval')
-        if check_membership and check_membership.status == 'Pending':
-            return JoinGroup(ok=True, membership=check_membership, message='Status is PendingWait for admin approval')
+        if check_membership.status == 'Pending':
+            return JoinGroup(ok=True, group_membership=check_membership, message='Status is Pending. Wait for admin approval')
+        return JoinGroup(ok=True, group_membership=check_membership, message='You are already a member of this group')
 
 
 # this route is used to set the status of the group to Accepted or rejected
@@ -135,21 +164,121 @@ class AssertGroupStatus(graphene.Mutation):
         if membership.group.created_by == info.context.user: # authorized??
         # if status is set to Rejected, that resource is deleted
             if status == 'Rejected': 
-                membership.delete()
+                invalidate(membership.group)
+                membership.remove()
                 return AssertGroupStatus(ok=True, membership=None, message='You have rejected this membership')
         else:
             raise GraphQLError('You are not authorized to accept or reject a group membership request')
         
         # if status is accepted
-        membership.status = status
-        membership.save()
-        notification = Notifications(
-                    message = f'{info.context.user.username} accepted your request to join {membership.group.name}',
-                    message_for = membership.user
-                )
-        notification.save()
+        with transaction.atomic():
+            membership.accept()
+            invalidate(membership.group)
+            notify(membership.user, 'membership_accepted', info.context.user, message=f'{info.context.user.username} accepted your request to join {membership.group.name}')
         return AssertGroupStatus(ok=True, membership=membership, message='You have accepted this membership')
         
+class BulkMembershipResult(graphene.ObjectType):
+    membership_id = graphene.Int()
+    ok = graphene.Boolean()
+    membership = graphene.Field(GroupMembershipType)
+    message = graphene.String()
+
+
+class BulkSetMembershipStatus(graphene.Mutation):
+    """assertGroupstatus for a list of memberships, for clearing a backlog of
+    join requests. Memberships that do not exist or belong to someone else's
+    group get a result with ok false and do not stop the others."""
+
+    class Arguments:
+        membership_ids = graphene.List(graphene.NonNull(graphene.Int), required=True)
+        status = graphene.String(required=True)
+
+    ok = graphene.Boolean()
+    results = graphene.List(BulkMembershipResult)
+
+    def mutate(self, info, membership_ids, status):
+        viewer = info.context.user
+        if viewer.is_anonymous:
+            raise GraphQLError('You are not authenticated. Log in')
+        if status != 'Accepted' and status != 'Rejected':
+            raise GraphQLError('Status can only be set to Accepted or Rejected')
+        membership_ids = list(dict.fromkeys(membership_ids))
+        if len(membership_ids) > settings.BULK_MUTATION_MAX_ITEMS:
+            raise GraphQLError(f'At most {settings.BULK_MUTATION_MAX_ITEMS} memberships can be set at once')
+
+        memberships = GroupMembership.objects.select_related('group', 'user').in_bulk(membership_ids)
+        results = {}
+        changed = []
+        for membership_id in membership_ids:
+            membership = memberships.get(membership_id)
+            if membership is None:
+                results[membership_id] = BulkMembershipResult(
+                    membership_id=membership_id, ok=False, message='This membership does not exist'
+                )
+            elif membership.group.created_by_id != viewer.id:
+                results[membership_id] = BulkMembershipResult(
+                    membership_id=membership_id, ok=False,
+                    message='You are not authorized to accept or reject a group membership request',
+                )
+            elif status == 'Accepted' and membership.status == 'Accepted':
+                results[membership_id] = BulkMembershipResult(
+                    membership_id=membership_id, ok=True, membership=membership, message='This membership is already accepted'
+                )
+            else:
+                changed.append(membership)
+
+        if changed:
+            deltas = Counter()
+            with transaction.atomic():
+                # read again under a lock: a concurrent accept or bulk call may
+                # have changed or deleted them since, and must not be counted twice
+                current = dict(
+                    GroupMembership.objects.select_for_update().filter(id__in=[membership.id for membership in changed])
+                    .values_list('id', 'status')
+                )
+                for membership in changed:
+                    if membership.id not in current:
+                        results[membership.id] = BulkMembershipResult(
+                            membership_id=membership.id, ok=False, message='This membership does not exist'
+                        )
+                    elif status == 'Accepted' and current[membership.id] == 'Accepted':
+                        membership.status = 'Accepted'
+                        results[membership.id] = BulkMembershipResult(
+                            membership_id=membership.id, ok=True, membership=membership,
+                            message='This membership is already accepted',
+                        )
+                changed = [membership for membership in changed if membership.id not in results]
+                ids = [membership.id for membership in changed]
+                if status == 'Rejected':
+                    # rejected memberships are deleted, as by assertGroupstatus
+                    GroupMembership.objects.filter(id__in=ids).delete()
+                    for membership in changed:
+                        if current[membership.id] == 'Accepted':
+                            deltas[membership.group_id] -= 1
+                else:
+                    now = timezone.now()
+                    GroupMembership.objects.filter(id__in=ids).exclude(status='Accepted').update(status=status, created_at=now)
+                    for membership in changed:
+                        membership.status = status
+                        # what save() would have set
+                        membership.created_at = now
+                        deltas[membership.group_id] += 1
+                adjust_members_counts(deltas)
+                invalidate(*{membership.group for membership in changed})
+                if status == 'Accepted':
+                    notify_many(
+                        (membership.user, 'membership_accepted', viewer, None,
+                         f'{viewer.username} accepted your request to join {membership.group.name}')
+                        for membership in changed
+                    )
+            for membership in changed:
+                results[membership.id] = BulkMembershipResult(
+                    membership_id=membership.id, ok=True, membership=membership if status == 'Accepted' else None,
+                    message='You have accepted this membership' if status == 'Accepted' else 'You have rejected this membership',
+                )
+        return BulkSetMembershipStatus(ok=True, results=[results[membership_id] for membership_id in membership_ids])
+
+
 class RemoveMemberFromGroup(graphene.Mutation):
     class Arguments:
         membership_id = graphene.Int(required=True)
@@ -168,8 +297,9 @@ class RemoveMemberFromGroup(graphene.Mutation):
             raise GraphQLError('This membership does not exist')
         
         if membership.group.created_by == info.context.user: # authorized??
-            membership.delete()
-            return AssertGroupStatus(ok=True, message='You have removed this membership from the group')
+            invalidate(membership.group)
+            membership.remove()
+            return RemoveMemberFromGroup(ok=True, message='You have removed this membership from the group')
         else:
             raise GraphQLError('You are not authorized to remove someone from the group')
         
@@ -191,10 +321,11 @@ class ExitFromGroup(graphene.Mutation):
             raise GraphQLError('This membership does not exist')
         
         if membership.user == info.context.user: # authorized??
-            membership.delete()
-            return AssertGroupStatus(ok=True, message='You have exited from the group')
+            invalidate(membership.group)
+            membership.remove()
+            return ExitFromGroup(ok=True, message='You have exited from the group')
         else:
-            return AssertGroupStatus(ok=False, message='Log in')
+            return ExitFromGroup(ok=False, message='You can only exit a group you are a member of')
             
 
 class DeleteGroup(graphene.Mutation):
@@ -214,6 +345,7 @@ class DeleteGroup(graphene.Mutation):
             raise GraphQLError('Such a group does not exist')
         
         if group.created_by == info.context.user:
+            invalidate(group)
             group.delete()
             return DeleteGroup(ok=True, message='You have deleted this group')
         raise GraphQLError('You are not authorised to this')
@@ -241,6 +373,7 @@ class UpdateGroupDetails(graphene.Mutation):
             group.name = name
             group.description = description
             group.save()
+            invalidate(group)
             return UpdateGroupDetails(ok=True, group=group, message='You have updated the details this group')
         raise GraphQLError('You are not authorised to this')
     
@@ -248,10 +381,8 @@ class Mutation(graphene.ObjectType):
     create_group = CreateGroup.Field()
     join_group = JoinGroup.Field()
     assert_groupstatus = AssertGroupStatus.Field()
+    bulk_set_membership_status = BulkSetMembershipStatus.Field()
     remove_from_group = RemoveMemberFromGroup.Field()
     exit_group = ExitFromGroup.Field()
     delete_group = DeleteGroup.Field()
     edit_group_details = UpdateGroupDetails.Field()
-
-
-schema = graphene.Schema(query=Query, mutation=Mutation)
@@ -6,14 +6,25 @@ class GroupType(DjangoObjectType):
     membership_count = graphene.Int()
 
     def resolve_membership_count(self, info):
-        return self.membership_count()
+        # stored on the group, see Group.members_count
+        return self.members_count
     
     class Meta:
         model = Group
         fields = ("id", "name", "created_at", "updated_at", "created_by")
 
 
+class GroupConnection(graphene.relay.Connection):
+    class Meta:
+        node = GroupType
+
+
 class GroupMembershipType(DjangoObjectType):
     class Meta:
         model = GroupMembership
-        fields = ("id", "group", "status", "created_at", "updated_at")
\ No newline at end of file
+        fields = ("id", "group", "user", "status", "created_at", "updated_at")
+
+
+class GroupMembershipConnection(graphene.relay.Connection):
+    class Meta:
+        node = GroupMembershipType
@@ -1,3 +1,252 @@
-from django.test import TestCase
+from unittest import mock
+from django.db import DatabaseError
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from graphql_jwt.shortcuts import get_token
+from app.query_budgets import QueryBudgetTestMixin
+from app.graphql_testing import GraphQLTestMixin, seed
+from app.query_plans import QueryPlanTestMixin
+from posts.models import Notifications
+from .models import Group, GroupMembership
+from .query import Mutation, Query
 
-# Create your tests here.
+GROUP_FIELDS = 'id name createdBy { id } membershipCount'
+
+
+def own_group(test):
+    return Group.objects.get(created_by=test.users[0]).id
+
+
+def own_group_membership(test):
+    return GroupMembership.objects.filter(group__created_by=test.users[0]).first().id
+
+
+class QueryPlanTests(QueryPlanTestMixin, TestCase):
+    operations = {
+        'groups': f'{{ groups(first: 5) {{ edges {{ node {{ {GROUP_FIELDS} }} }} }} }}',
+        'group': (f'query ($id: Int) {{ group(id: $id) {{ {GROUP_FIELDS} }} }}', lambda test: {'id': own_group(test)}),
+        'groupMemberships': '{ groupMemberships(first: 5) { edges { node { id status group { id name } } } } }',
+        'groupMembership': (
+            'query ($id: Int) { groupMembership(id: $id) { id status } }',
+            lambda test: {'id': own_group_membership(test)},
+        ),
+        'groupMembers': (
+            'query ($id: Int!) { groupMembers(id: $id) { edges { node { id username } } } }',
+            lambda test: {'id': own_group(test)},
+        ),
+        'groupRoster': (
+            'query ($id: Int!) { groupRoster(id: $id, status: "Pending", first: 5) { edges { node { id status user { id } } } } }',
+            lambda test: {'id': own_group(test)},
+        ),
+        'createGroup': 'mutation { createGroup(name: "new group", description: "new") { ok group { id } } }',
+        'joinGroup': (
+            'mutation ($id: Int!) { joinGroup(groupId: $id) { ok groupMembership { id } } }',
+            lambda test: {'id': Group.objects.get(created_by=test.users[1]).id},
+        ),
+        'assertGroupstatus': (
+            'mutation ($id: Int!) { assertGroupstatus(membershipId: $id, status: "Accepted") { ok membership { id status } } }',
+            lambda test: {'id': own_group_membership(test)},
+        ),
+        'removeFromGroup': (
+            'mutation ($id: Int!) { removeFromGroup(membershipId: $id) { ok } }',
+            lambda test: {'id': own_group_membership(test)},
+        ),
+        'exitGroup': (
+            'mutation ($id: Int!) { exitGroup(membershipId: $id) { ok } }',
+            lambda test: {'id': GroupMembership.objects.filter(user=test.users[2]).first().id},
+        ),
+        'bulkSetMembershipStatus': (
+            '''mutation ($ids: [Int!]!) {
+                bulkSetMembershipStatus(membershipIds: $ids, status: "Accepted") { ok results { membershipId ok message membership { id } } }
+            }''',
+            lambda test: {'ids': list(GroupMembership.objects.values_list('id', flat=True))},
+        ),
+        'deleteGroup': ('mutation ($id: Int!) { deleteGroup(groupId: $id) { ok } }', lambda test: {'id': own_group(test)}),
+        'editGroupDetails': (
+            'mutation ($id: Int!) { editGroupDetails(groupId: $id, name: "renamed", description: "new") { ok group { id } } }',
+            lambda test: {'id': own_group(test)},
+        ),
+    }
+    viewers = {'exitGroup': 2}
+
+    def test_covers_every_field(self):
+        self.assertCoversFields(Query, Mutation)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    operations = {
+        'Groups': f'query Groups {{ groups(first: 20) {{ edges {{ node {{ {GROUP_FIELDS} }} }} }} }}',
+        'Group': (f'query Group($id: Int) {{ group(id: $id) {{ {GROUP_FIELDS} }} }}', lambda test: {'id': own_group(test)}),
+        'GroupMemberships': '''query GroupMemberships {
+            groupMemberships(first: 20) { edges { node { id status group { id name membershipCount createdBy { username } } } } }
+        }''',
+        'GroupMembers': (
+            'query GroupMembers($id: Int!) { groupMembers(id: $id, first: 20) { edges { node { id username followerCount } } } }',
+            lambda test: {'id': own_group(test)},
+        ),
+        'GroupRoster': (
+            '''query GroupRoster($id: Int!) {
+                groupRoster(id: $id, status: "Pending", first: 20) { edges { node { id status user { username } } } pageInfo { endCursor } }
+            }''',
+            lambda test: {'id': own_group(test)},
+        ),
+        'JoinGroup': (
+            'mutation JoinGroup($id: Int!) { joinGroup(groupId: $id) { ok groupMembership { id status } } }',
+            lambda test: {'id': Group.objects.get(created_by=test.users[1]).id},
+        ),
+        'AcceptMember': (
+            'mutation AcceptMember($id: Int!) { assertGroupstatus(membershipId: $id, status: "Accepted") { ok membership { id status } } }',
+            lambda test: {'id': own_group_membership(test)},
+        ),
+        # every membership of both groups, half of them in someone else's group
+        'BulkAcceptMembers': (
+            '''mutation BulkAcceptMembers($ids: [Int!]!) {
+                bulkSetMembershipStatus(membershipIds: $ids, status: "Accepted") {
+                    ok results { membershipId ok message membership { id status group { name } } }
+                }
+            }''',
+            lambda test: {'ids': list(GroupMembership.objects.values_list('id', flat=True)) + [0]},
+        ),
+        'BulkRejectMembers': (
+            '''mutation BulkRejectMembers($ids: [Int!]!) {
+                bulkSetMembershipStatus(membershipIds: $ids, status: "Rejected") { ok results { membershipId ok message } }
+            }''',
+            lambda test: {'ids': list(GroupMembership.objects.values_list('id', flat=True))},
+        ),
+    }
+
+
+class RosterTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed()
+
+    def members(self, status='Accepted', user=0):
+        query = 'query ($id: Int!, $status: String) { groupMembers(id: $id, status: $status) { edges { node { username } } } }'
+        result, _ = self.run_operation(query, {'id': own_group(self), 'status': status}, self.users[user])
+        return result
+
+    def test_members_are_the_users_with_the_status(self):
+        group = Group.objects.get(id=own_group(self))
+        for status in ('Accepted', 'Pending'):
+            expected = {membership.user.username for membership in group.groupmembership_set.filter(status=status)}
+            usernames = {edge['node']['username'] for edge in self.members(status)['data']['groupMembers']['edges']}
+            self.assertEqual(usernames, expected)
+
+    def test_members_page_by_status_in_one_join(self):
+        group = Group.objects.get(id=own_group(self))
+        query = '''query ($id: Int!, $status: String, $after: String) {
+            groupMembers(id: $id, status: $status, first: 1, after: $after) {
+                edges { node { username } } pageInfo { hasNextPage endCursor }
+            }
+        }'''
+        for status in ('Accepted', 'Pending'):
+            expected = [
+                membership.user.username
+                for membership in group.groupmembership_set.filter(status=status).order_by('-created_at', '-id')
+            ]
+            usernames, after = [], None
+            while True:
+                result, statements = self.run_operation(query, {'id': group.id, 'status': status, 'after': after}, self.users[0])
+                connection = result['data']['groupMembers']
+                usernames += [edge['node']['username'] for edge in connection['edges']]
+                # the memberships and their users come from one statement
+                pages = [statement for statement in statements if 'FROM "group_groupmembership"' in statement]
+                self.assertEqual(len(pages), 1, statements)
+                self.assertIn('INNER JOIN "accounts_user"', pages[0])
+                self.assertNotIn('FROM "accounts_user" WHERE "accounts_user"."id"', ' '.join(statements))
+                if not connection['pageInfo']['hasNextPage']:
+                    break
+                after = connection['pageInfo']['endCursor']
+            self.assertEqual(usernames, expected)
+
+    def test_the_group_is_required(self):
+        result, _ = self.run_operation('{ groupMembers { edges { node { id } } } }', user=self.users[0])
+        self.assertIn("argument 'id' of type 'Int!' is required", result['errors'][0]['message'])
+
+    def test_only_the_admin_sees_pending_members(self):
+        self.assertIn('errors', self.members('Pending', user=1))
+
+    def test_members_count_follows_the_membership_mutations(self):
+        group = Group.objects.get(id=own_group(self))
+        memberships = group.groupmembership_set.order_by('id')
+        pending = [membership for membership in memberships if membership.status == 'Pending']
+        accepted = [membership for membership in memberships if membership.status == 'Accepted']
+        pending[0].accept()
+        # accepting twice counts once
+        GroupMembership.objects.get(id=pending[0].id).accept()
+        accepted[0].remove()
+        query = 'mutation ($ids: [Int!]!) { bulkSetMembershipStatus(membershipIds: $ids, status: "Rejected") { ok } }'
+        self.client.post(
+            '/graphql/', {'query': query, 'variables': {'ids': [accepted[1].id, pending[1].id]}},
+            content_type='application/json', HTTP_AUTHORIZATION=f'JWT {get_token(self.users[0])}',
+        )
+        group.refresh_from_db()
+        self.assertEqual(group.members_count, len(accepted) - 1)
+        self.assertEqual(group.members_count, group.groupmembership_set.filter(status='Accepted').count())
+
+    def test_bulk_status_changes_count_what_they_change(self):
+        group = Group.objects.get(id=own_group(self))
+        pending = list(group.groupmembership_set.filter(status='Pending').order_by('id'))
+        in_bulk = QuerySet.in_bulk
+
+        def accepted_meanwhile(queryset, *args, **kwargs):
+            # another request accepts the first membership once this one has read it
+            memberships = in_bulk(queryset, *args, **kwargs)
+            GroupMembership.objects.get(id=pending[0].id).accept()
+            return memberships
+
+        query = 'mutation ($ids: [Int!]!) { bulkSetMembershipStatus(membershipIds: $ids, status: "%s") { results { ok message } } }'
+        ids = [membership.id for membership in pending[:2]]
+        with mock.patch.object(QuerySet, 'in_bulk', autospec=True, side_effect=accepted_meanwhile):
+            result = self.commit_operation(query % 'Accepted', {'ids': ids}, self.users[0])
+        messages = [item['message'] for item in result['data']['bulkSetMembershipStatus']['results']]
+        self.assertEqual(messages, ['This membership is already accepted', 'You have accepted this membership'])
+        group.refresh_from_db()
+        self.assertEqual(group.members_count, group.groupmembership_set.filter(status='Accepted').count())
+        # rejecting a membership accepted since it was read takes it off the count
+        with mock.patch.object(QuerySet, 'in_bulk', autospec=True, side_effect=accepted_meanwhile):
+            self.commit_operation(query % 'Rejected', {'ids': [pending[0].id]}, self.users[0])
+        group.refresh_from_db()
+        self.assertEqual(group.members_count, group.groupmembership_set.filter(status='Accepted').count())
+
+    def test_bulk_results_follow_the_input_order(self):
+        group = Group.objects.get(id=own_group(self))
+        pending = list(group.groupmembership_set.filter(status='Pending').order_by('id'))
+        accepted = group.groupmembership_set.filter(status='Accepted').first()
+        others = GroupMembership.objects.exclude(group=group).first()
+        query = '''mutation ($ids: [Int!]!) {
+            bulkSetMembershipStatus(membershipIds: $ids, status: "Accepted") { ok results { membershipId ok message } }
+        }'''
+        ids = [pending[0].id, 0, others.id, accepted.id, pending[1].id, pending[0].id]
+        result = self.commit_operation(query, {'ids': ids}, self.users[0])
+        results = result['data']['bulkSetMembershipStatus']['results']
+        self.assertEqual([(item['membershipId'], item['ok'], item['message']) for item in results], [
+            (pending[0].id, True, 'You have accepted this membership'),
+            (0, False, 'This membership does not exist'),
+            (others.id, False, 'You are not authorized to accept or reject a group membership request'),
+            (accepted.id, True, 'This membership is already accepted'),
+            (pending[1].id, True, 'You have accepted this membership'),
+        ])
+        notified = Notifications.objects.filter(verb='membership_accepted').values_list('message_for', flat=True)
+        self.assertEqual(sorted(notified), sorted([pending[0].user_id, pending[1].user_id]))
+
+    @override_settings(BULK_MUTATION_MAX_ITEMS=1)
+    def test_bulk_status_changes_are_capped(self):
+        pending = GroupMembership.objects.filter(group_id=own_group(self), status='Pending').order_by('id')[:2]
+        query = 'mutation ($ids: [Int!]!) { bulkSetMembershipStatus(membershipIds: $ids, status: "Rejected") { ok } }'
+        result = self.commit_operation(query, {'ids': [membership.id for membership in pending]}, self.users[0])
+        self.assertEqual(result['errors'][0]['message'], 'At most 1 memberships can be set at once')
+        self.assertEqual(GroupMembership.objects.filter(id__in=[membership.id for membership in pending]).count(), 2)
+
+    def test_a_failed_join_request_notifies_no_one(self):
+        query = 'mutation ($id: Int!) { joinGroup(groupId: $id) { ok } }'
+        # the second user owns the other group and is not a member of this one
+        with mock.patch('group.query.invalidate', side_effect=DatabaseError('lost the connection')):
+            result = self.commit_operation(query, {'id': own_group(self)}, self.users[1])
+        self.assertIn('errors', result)
+        self.assertFalse(GroupMembership.objects.filter(group_id=own_group(self), user=self.users[1]).exists())
+        self.assertFalse(Notifications.objects.filter(message_for=self.users[1], verb='join_request').exists())
+        result = self.commit_operation(query, {'id': own_group(self)}, self.users[1])
+        self.assertTrue(result['data']['joinGroup']['ok'])
+        self.assertTrue(Notifications.objects.filter(message_for=self.users[1], verb='join_request').exists())
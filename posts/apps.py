@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def install_search(sender, using, **kwargs):
+    from django.db import connections
+    from .search import install
+    install(connections[using])
 
 
 class PostsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'posts'
+
+    def ready(self):
+        # the FTS5 table and its triggers live outside the models, so they are
+        # (re)created after every migrate
+        post_migrate.connect(install_search, sender=self)
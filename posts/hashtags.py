@@ -0,0 +1,287 @@
+"""Hashtags and trends.
+
+The #hashtags of a post are extracted when it is created or edited and stored
+in PostHashtag, whose (hashtag, post) index lists the posts of a hashtag
+newest first as one range scan.
+
+Trends are counted as hashtags are used, never by scanning posts. Each window
+of HASHTAG_TREND_WINDOWS is cut into HASHTAG_TREND_BUCKETS time buckets, each
+summarised by a Space-Saving sketch of HASHTAG_TREND_CAPACITY counters, so
+memory stays bounded however many hashtags are in use, and a hashtag leaves a
+window one bucket at a time. A process counts the hashtags of its posts in
+sketches of its own, and a worker thread (started by the WSGI and ASGI entry
+points) checkpoints them every HASHTAG_TREND_CHECKPOINT_INTERVAL seconds:
+they are merged into the buckets stored in TrendBucket, which are read back
+with the counts of every other process. The top HASHTAG_TREND_SIZE hashtags
+of each window are computed at the checkpoint, so `trends.top` returns a list
+it already has and requests never wait for one. Processes without the worker,
+such as scripts and tests, call `trends.checkpoint` themselves. Edits only
+count the hashtags they add, and deleting a post does not uncount its own.
+"""
+import atexit
+import heapq
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from app.pagination import encode_cursor, page
+from .models import Hashtag, PostHashtag, TrendBucket
+
+logger = logging.getLogger(__name__)
+
+# a '#' that does not continue a word or an HTML entity such as &#39;
+HASHTAG = re.compile(r'(?<![\w&#])#(\w+)')
+
+MAX_LENGTH = Hashtag._meta.get_field('name').max_length
+
+# a hashtag's posts, newest first
+POST_KEYS = ('-post_id',)
+
+
+def normalize(name):
+    return name.lstrip('#').lower()
+
+
+def extract(text):
+    """The distinct hashtags of `text` in order of appearance. A hashtag needs
+    a letter, so #1 is not one."""
+    names = {}
+    for match in HASHTAG.finditer(text):
+        name = normalize(match.group(1))
+        if len(name) <= MAX_LENGTH and any(char.isalpha() for char in name):
+            names.setdefault(name, None)
+    return list(names)
+
+
+def _hashtag_ids(names):
+    ids = dict(Hashtag.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        # a concurrent post may create the same hashtags
+        Hashtag.objects.bulk_create([Hashtag(name=name) for name in missing], ignore_conflicts=True)
+        ids.update(Hashtag.objects.filter(name__in=missing).values_list('name', 'id'))
+    return ids
+
+
+def _add(pairs):
+    """Stores (post, hashtag name) pairs and counts them towards the trends
+    once the transaction commits. Returns the number stored."""
+    if not pairs:
+        return 0
+    ids = _hashtag_ids(list(dict.fromkeys(name for _, name in pairs)))
+    PostHashtag.objects.bulk_create([PostHashtag(post=post, hashtag_id=ids[name]) for post, name in pairs])
+    names = [name for _, name in pairs]
+    transaction.on_commit(lambda: trends.record(names))
+    return len(pairs)
+
+
+def tag(posts):
+    """Stores the hashtags of newly saved posts and returns how many."""
+    return _add([(post, name) for post in posts for name in extract(post.post)])
+
+
+def retag(post):
+    """Brings the stored hashtags of an edited post in line with its text."""
+    names = extract(post.post)
+    stored = dict(PostHashtag.objects.filter(post=post).values_list('hashtag__name', 'id'))
+    removed = [stored[name] for name in stored.keys() - set(names)]
+    if removed:
+        PostHashtag.objects.filter(id__in=removed).delete()
+    _add([(post, name) for name in names if name not in stored])
+
+
+def posts(name, first=None, after=None):
+    """The rows of a page of the posts tagged `name`, newest first, with
+    their posts and authors, and whether more remain."""
+    rows = PostHashtag.objects.filter(hashtag__name=normalize(name)).select_related('post__created_by')
+    return page(rows, first, after, POST_KEYS)
+
+
+def cursor(post):
+    # the key of a row is the id of its post, so the post alone makes its cursor
+    return encode_cursor(post, ('-id',))
+
+
+class SpaceSaving:
+    """The heavy hitters of a stream in at most `capacity` counters.
+
+    A tracked item's count overestimates how often it occurred by at most its
+    error. A new item takes over the counter of the least counted one when
+    all are in use, inheriting its count as error, so every item that
+    occurred more than total / capacity times is tracked. The smallest
+    counter is found through a heap whose outdated entries are skipped.
+    """
+
+    def __init__(self, capacity, counters=()):
+        self.capacity = capacity
+        # item -> [count, error]
+        self.counters = {}
+        self._heap = []
+        for item, (count, error) in dict(counters).items():
+            self.add(item, count, error)
+
+    def add(self, item, count=1, error=0):
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += count
+            counter[1] += error
+        else:
+            if len(self.counters) >= self.capacity:
+                floor = self._evict()
+                count, error = count + floor, error + floor
+            counter = self.counters[item] = [count, error]
+        heapq.heappush(self._heap, (counter[0], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, item) for item, (count, _) in self.counters.items()]
+            heapq.heapify(self._heap)
+
+    def merge(self, other):
+        for item, (count, error) in other.counters.items():
+            self.add(item, count, error)
+
+    def _evict(self):
+        while True:
+            count, item = heapq.heappop(self._heap)
+            counter = self.counters.get(item)
+            if counter is not None and counter[0] == count:
+                del self.counters[item]
+                return count
+
+
+def _bucket(window, now):
+    return int(now // (settings.HASHTAG_TREND_WINDOWS[window] / settings.HASHTAG_TREND_BUCKETS))
+
+
+class Trends:
+    def __init__(self):
+        # window -> bucket -> sketch of this process's hashtags since the
+        # last checkpoint
+        self._pending = {}
+        # window -> [(hashtag, count)], most used first
+        self._top = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._worker = None
+
+    def reset(self):
+        with self._lock:
+            self._pending, self._top = {}, {}
+
+    def record(self, names):
+        """Counts uses of hashtags, one per name."""
+        now = time.time()
+        with self._lock:
+            for window in settings.HASHTAG_TREND_WINDOWS:
+                buckets = self._pending.setdefault(window, {})
+                bucket = _bucket(window, now)
+                if bucket not in buckets:
+                    buckets[bucket] = SpaceSaving(settings.HASHTAG_TREND_CAPACITY)
+                sketch = buckets[bucket]
+                for name in names:
+                    sketch.add(name)
+
+    def top(self, window, limit):
+        """The `limit` most used hashtags of the window and their counts, as
+        of the last checkpoint."""
+        return self._top.get(window, [])[:limit]
+
+    def start(self):
+        """Starts the worker that checkpoints every
+        HASHTAG_TREND_CHECKPOINT_INTERVAL seconds, the first time at once."""
+        with self._lock:
+            if self._worker is None:
+                self._stopping = False
+                self._worker = threading.Thread(target=self._run, name='trend-checkpoints', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while not self._stopping:
+            close_old_connections()
+            try:
+                self.checkpoint()
+            except Exception:
+                # e.g. the table does not exist before the first migrate;
+                # the counts stay pending until the next interval
+                logger.exception('Could not checkpoint the hashtag trends')
+            self._wakeup.wait(settings.HASHTAG_TREND_CHECKPOINT_INTERVAL)
+            self._wakeup.clear()
+
+    def stop(self):
+        """Stops the worker and checkpoints what is still pending."""
+        worker = self._worker
+        if worker is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        if worker is not threading.current_thread():
+            worker.join(timeout=settings.HASHTAG_TREND_CHECKPOINT_INTERVAL)
+        self._worker = None
+        try:
+            self.checkpoint()
+        except Exception:
+            logger.exception('Could not checkpoint the hashtag trends')
+
+    def checkpoint(self):
+        """Merges the counts of this process into the stored buckets, drops
+        the buckets that left their window and recomputes the top hashtags
+        from what is stored."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        try:
+            rows = self._store(pending, time.time())
+        except Exception:
+            with self._lock:
+                for window, buckets in pending.items():
+                    for bucket, sketch in buckets.items():
+                        mine = self._pending.setdefault(window, {}).setdefault(bucket, sketch)
+                        if mine is not sketch:
+                            mine.merge(sketch)
+            raise
+        totals = {window: Counter() for window in settings.HASHTAG_TREND_WINDOWS}
+        for row in rows:
+            for name, (count, _) in row.counters.items():
+                totals[row.window][name] += count
+        top = {window: counts.most_common(settings.HASHTAG_TREND_SIZE) for window, counts in totals.items()}
+        with self._lock:
+            self._top = top
+
+    def _store(self, pending, now):
+        windows = settings.HASHTAG_TREND_WINDOWS
+        live, expired = Q(), Q()
+        for window in windows:
+            oldest = _bucket(window, now) - settings.HASHTAG_TREND_BUCKETS + 1
+            live |= Q(window=window, bucket__gte=oldest)
+            expired |= Q(window=window, bucket__lt=oldest)
+        with transaction.atomic():
+            # written first, so on SQLite the transaction holds the write lock
+            # before it reads what it is about to update
+            TrendBucket.objects.filter(expired).delete()
+            rows = {(row.window, row.bucket): row for row in TrendBucket.objects.select_for_update().filter(live)}
+            changed, created = [], []
+            for window, buckets in pending.items():
+                for bucket, sketch in buckets.items():
+                    if window not in windows or bucket < _bucket(window, now) - settings.HASHTAG_TREND_BUCKETS + 1:
+                        continue
+                    row = rows.get((window, bucket))
+                    if row is None:
+                        row = rows[window, bucket] = TrendBucket(window=window, bucket=bucket, counters={})
+                        created.append(row)
+                    else:
+                        changed.append(row)
+                    merged = SpaceSaving(settings.HASHTAG_TREND_CAPACITY, row.counters)
+                    merged.merge(sketch)
+                    row.counters = merged.counters
+            if changed:
+                TrendBucket.objects.bulk_update(changed, ['counters'])
+            if created:
+                TrendBucket.objects.bulk_create(created)
+        return list(rows.values())
+
+
+trends = Trends()
+atexit.register(trends.stop)
@@ -0,0 +1,62 @@
+"""Resized variants of post media.
+
+`render` runs in the worker processes of posts/media.py, so this module
+imports no models: a worker only needs Pillow and the storage backend.
+"""
+import io
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Pillow format name and content type of each variant format
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+# EXIF orientations that turn the image a quarter
+_TRANSPOSED = {5, 6, 7, 8}
+
+
+def inspect(image):
+    """The format and displayed width and height of an opened image, read
+    from its header without decoding the pixels."""
+    width, height = image.size
+    if image.getexif().get(ImageOps.ExifTags.Base.Orientation) in _TRANSPOSED:
+        width, height = height, width
+    return image.format, width, height
+
+
+def variant_size(width, height, side):
+    """The size of the variant of a `width` x `height` image (as displayed)
+    whose longest side is `side`. Images are never scaled up."""
+    scale = side / max(width, height)
+    if scale >= 1:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _encode(image, image_format, quality):
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha channel: flatten onto white rather than black
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=quality, optimize=image_format == 'JPEG')
+    return buffer.getvalue()
+
+
+def render(name, width, height, side, extension, quality):
+    """The stored image `name`, displayed at `width` x `height`, scaled down
+    to variant_size and encoded as `extension`, as bytes."""
+    size = variant_size(width, height, side)
+    with default_storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        # lets the JPEG decoder skip what the variant throws away
+        image.draft('RGB', (max(size),) * 2)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        if image.size != size:
+            image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        return _encode(image, FORMATS[extension][0], quality)
@@ -0,0 +1,27 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from app.dataloader import batch_loader
+from .models import Post, Comment, Repost
+
+
+def _group_by_post(queryset, post_ids):
+    # only the newest POST_PREVIEW_SIZE rows of each post, so the list is as
+    # long as its cost says
+    rank = Window(RowNumber(), partition_by=F('post_id'), order_by=(F('created_at').desc(), F('id').desc()))
+    queryset = queryset.filter(post_id__in=post_ids).annotate(post_rank=rank)
+    grouped = defaultdict(list)
+    for item in queryset.filter(post_rank__lte=settings.POST_PREVIEW_SIZE).order_by('-created_at', '-id'):
+        grouped[item.post_id].append(item)
+    return grouped
+
+
+@batch_loader(Post, default=list)
+def comments(post_ids):
+    return _group_by_post(Comment.objects.all(), post_ids)
+
+
+@batch_loader(Post, default=list)
+def reposts(post_ids):
+    return _group_by_post(Repost.objects.all(), post_ids)
@@ -0,0 +1,64 @@
+from datetime import timedelta
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+from posts import media
+from posts.models import Media, Post
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the reference counts of post media and deletes blobs and files no post uses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without changing it')
+        parser.add_argument(
+            '--min-age', type=int, default=60,
+            help='Minutes a blob or file must have existed before it is checked',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        # an upload in progress has stored its blob before its post commits
+        cutoff = timezone.now() - timedelta(minutes=options['min_age'])
+        actual = dict(
+            Post.objects.filter(blob__isnull=False).values_list('blob_id').annotate(total=Count('id')).order_by()
+        )
+        checked = drifted = collected = 0
+        blobs = Media.objects.filter(created_at__lt=cutoff).only('id', 'sha256', 'ref_count')
+        for blob in blobs.iterator():
+            checked += 1
+            expected = actual.get(blob.id, 0)
+            if blob.ref_count != expected:
+                drifted += 1
+                self.stdout.write(f'Media {blob.sha256}: ref_count {blob.ref_count} -> {expected}')
+                if not dry_run:
+                    Media.objects.filter(pk=blob.pk).update(ref_count=expected)
+            if expected == 0:
+                collected += 1
+                if not dry_run:
+                    media.collect(blob.pk)
+
+        # files left behind by uploads whose transaction rolled back
+        named = set(Media.objects.values_list('file', flat=True))
+        swept = 0
+        directories = ['blobs']
+        while directories:
+            directory = directories.pop()
+            if not default_storage.exists(directory):
+                continue
+            subdirectories, files = default_storage.listdir(directory)
+            directories.extend(f'{directory}/{name}' for name in subdirectories)
+            for name in files:
+                path = f'{directory}/{name}'
+                if path not in named and default_storage.get_modified_time(path) < cutoff:
+                    swept += 1
+                    self.stdout.write(f'Unreferenced file {path}')
+                    if not dry_run:
+                        default_storage.delete(path)
+
+        verb = 'found' if dry_run else 'fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {checked} blobs, {verb} drift on {drifted}, '
+            f'{collected} blobs and {swept} files unused'
+        ))
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from posts.models import Post, Like, Comment, Repost
+
+COUNTERS = (
+    ('likes_count', Like),
+    ('comments_count', Comment),
+    ('reposts_count', Repost),
+)
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the like, comment and repost counters on Post and reports any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+        last_id = 0
+        checked = drifted = 0
+
+        while True:
+            with transaction.atomic():
+                posts, stale = self.rebuild_chunk(last_id, chunk_size, dry_run)
+            if not posts:
+                break
+            last_id = posts[-1].id
+            checked += len(posts)
+            drifted += len(stale)
+
+        verb = 'found' if dry_run else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} posts, {verb} drift on {drifted}'))
+
+    def rebuild_chunk(self, last_id, chunk_size, dry_run):
+        # walk the table by primary key so each chunk is an index range scan
+        posts = list(
+            Post.objects.filter(id__gt=last_id).order_by('id')
+            .only('id', *[counter for counter, _ in COUNTERS])[:chunk_size]
+        )
+        ids = [post.id for post in posts]
+        actual = {counter: self.count(model, ids) for counter, model in COUNTERS}
+
+        stale = []
+        for post in posts:
+            changes = []
+            for counter, _ in COUNTERS:
+                expected = actual[counter].get(post.id, 0)
+                stored = getattr(post, counter)
+                if stored != expected:
+                    changes.append(f'{counter} {stored} -> {expected}')
+                    setattr(post, counter, expected)
+            if changes:
+                stale.append(post)
+                self.stdout.write(f'Post {post.id}: ' + ', '.join(changes))
+
+        if stale and not dry_run:
+            Post.objects.bulk_update(stale, [counter for counter, _ in COUNTERS])
+        return posts, stale
+
+    def count(self, model, post_ids):
+        rows = model.objects.filter(post_id__in=post_ids).values('post_id').annotate(total=Count('id')).order_by()
+        return {row['post_id']: row['total'] for row in rows}
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+from posts import search
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recreates the full-text search index of posts from the posts table'
+
+    def handle(self, *args, **options):
+        if not search.supported():
+            raise CommandError('Full-text search needs the SQLite database backend')
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {Post.objects.count()} posts'))
@@ -0,0 +1,18 @@
+from dataclasses import fields
+from django.core.management.base import BaseCommand
+from app.seed import Scale, generate
+
+
+class Command(BaseCommand):
+    help = 'Generates synthetic users, follows, posts, likes, comments, reposts, groups and memberships'
+
+    def add_arguments(self, parser):
+        for field in fields(Scale):
+            parser.add_argument(f"--{field.name.replace('_', '-')}", type=field.type, default=field.default)
+
+    def handle(self, *args, **options):
+        scale = Scale(**{field.name: options[field.name] for field in fields(Scale)})
+        counts = generate(scale, log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded ' + ', '.join(f"{count} {name.replace('_', ' ')}" for name, count in counts.items())
+        ))
@@ -0,0 +1,308 @@
+"""Media attached to posts.
+
+createPost accepts an image as a multipart upload (the GraphQL multipart
+request spec, parsed by graphene-file-upload). Django streams the upload to a
+temporary file once it outgrows FILE_UPLOAD_MAX_MEMORY_SIZE, so a large image
+is never held in memory by the request.
+
+Uploads are stored once per content: `store` hashes the upload in chunks and,
+when a Media row with that SHA-256 exists, takes a reference to it without
+decoding or writing anything. Otherwise the image is checked and handed to
+the storage backend under `blobs/`, named after its hash. Every post holds a
+reference to its blob; `release` drops it, and the blob and its file are
+deleted once the transaction that dropped the last one commits.
+`manage.py collect_media` recounts the references and sweeps files no row
+names.
+
+Resized variants (MEDIA_VARIANTS in every MEDIA_VARIANT_FORMATS) are rendered
+by posts/imaging.py on the first request for them, served by posts/views.py,
+and kept in `variant_cache`, an LRU cache on disk bounded to
+MEDIA_VARIANT_CACHE_SIZE bytes. Rendering happens in a pool of MEDIA_WORKERS
+processes ('pool' processing), which keeps the decoding out of the server's
+GIL, or on the requesting thread ('inline' processing, for tests and
+scripts). At most MEDIA_MAX_PENDING renders wait for the pool; a request that
+would queue more waits for a slot.
+"""
+import atexit
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F, ProtectedError
+from django.urls import reverse
+from graphql import GraphQLError
+from PIL import Image, UnidentifiedImageError
+from . import imaging
+from .models import Media
+
+logger = logging.getLogger(__name__)
+
+# Pillow format -> extension of the stored original
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+
+def _digest(upload):
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _reference(digest):
+    """Takes a reference to the blob of `digest`, or returns None when there
+    is none. The count goes up before the row is read, so a collection that
+    has not deleted the row yet no longer matches it."""
+    if not Media.objects.filter(sha256=digest).update(ref_count=F('ref_count') + 1):
+        return None
+    return Media.objects.get(sha256=digest)
+
+
+def _inspect(upload):
+    try:
+        # reads the header only, not the pixels
+        image_format, width, height = imaging.inspect(Image.open(upload))
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise GraphQLError('Media must be an image')
+    if image_format not in EXTENSIONS:
+        raise GraphQLError(f"Media must be one of {', '.join(sorted(EXTENSIONS))}")
+    if width * height > settings.MEDIA_MAX_PIXELS:
+        raise GraphQLError('Media has too many pixels')
+    return image_format, width, height
+
+
+def store(upload):
+    """The blob of an uploaded image, with a reference taken for the caller.
+    An image stored before is neither checked nor written again."""
+    if upload.size > settings.MEDIA_MAX_UPLOAD_SIZE:
+        raise GraphQLError(f'Media can be at most {settings.MEDIA_MAX_UPLOAD_SIZE // (1024 * 1024)} MB')
+    digest = _digest(upload)
+    blob = _reference(digest)
+    if blob is not None:
+        return blob
+    upload.seek(0)
+    image_format, width, height = _inspect(upload)
+    upload.seek(0)
+    # the client's file name is not used
+    name = default_storage.save(f'blobs/{digest[:2]}/{digest}.{EXTENSIONS[image_format]}', upload)
+    try:
+        with transaction.atomic():
+            return Media.objects.create(
+                sha256=digest, file=name, format=image_format, width=width, height=height,
+                size=upload.size, ref_count=1,
+            )
+    except IntegrityError:
+        # a concurrent upload of the same image stored it first
+        _delete_file(name)
+        return _reference(digest)
+
+
+def attach(post, upload):
+    """Stores an uploaded image as the media of the unsaved `post`."""
+    post.blob = store(upload)
+    post.media.name = post.blob.file.name
+
+
+def release(blob_id):
+    """Drops a post's reference to its blob, which is deleted with its file
+    and cached variants once the transaction commits if it was the last."""
+    Media.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    transaction.on_commit(lambda: collect(blob_id))
+
+
+def collect(blob_id):
+    blob = Media.objects.filter(pk=blob_id, ref_count=0).first()
+    if blob is None:
+        return
+    try:
+        # the count is checked again, an upload may have taken a reference since
+        deleted, _ = Media.objects.filter(pk=blob_id, ref_count=0).delete()
+    except ProtectedError:
+        logger.warning('Blob %s has no references but posts still use it', blob.sha256)
+        return
+    if deleted:
+        _delete_file(blob.file.name)
+        variant_cache.discard(blob.sha256)
+
+
+def _delete_file(name):
+    try:
+        default_storage.delete(name)
+    except OSError:
+        logger.warning('Could not delete %s', name)
+
+
+def variants(blob, format=None):
+    """The variants of a blob as dicts of name, format, content type, size
+    and URL, largest first. Their sizes are known without rendering them."""
+    result = []
+    for name, side in sorted(settings.MEDIA_VARIANTS.items(), key=lambda item: -item[1]):
+        width, height = imaging.variant_size(blob.width, blob.height, side)
+        for extension in settings.MEDIA_VARIANT_FORMATS:
+            if format is not None and extension != format:
+                continue
+            result.append({
+                'name': name,
+                'format': extension,
+                'content_type': imaging.FORMATS[extension][1],
+                'width': width,
+                'height': height,
+                'url': reverse('media-variant', args=[blob.sha256, name, extension]),
+            })
+    return result
+
+
+class VariantPool:
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._executor is None:
+                # the server's threads make forking unsafe, so workers are spawned
+                self._executor = ProcessPoolExecutor(
+                    settings.MEDIA_WORKERS, mp_context=multiprocessing.get_context('spawn')
+                )
+                self._slots = threading.BoundedSemaphore(settings.MEDIA_MAX_PENDING)
+        return self._executor
+
+    def render(self, blob, side, extension):
+        """The variant of `blob` whose longest side is `side`, encoded as
+        `extension`, as bytes."""
+        arguments = blob.file.name, blob.width, blob.height, side, extension, settings.MEDIA_VARIANT_QUALITY
+        if settings.MEDIA_PROCESSING == 'inline':
+            return imaging.render(*arguments)
+        executor = self._start()
+        with self._slots:
+            return executor.submit(imaging.render, *arguments).result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+pool = VariantPool()
+atexit.register(pool.shutdown)
+
+
+class VariantCache:
+    """Rendered variants as files under MEDIA_VARIANT_CACHE_DIR, evicting the
+    least recently used once they take more than MEDIA_VARIANT_CACHE_SIZE
+    bytes. The order of use is kept in memory and rebuilt from the files'
+    modification times, which hits update, when the process first needs it.
+    Each process bounds what it knows about; files written by other
+    processes count once it restarts."""
+
+    def __init__(self):
+        self._root = None
+        # cache key -> size in bytes, least recently used first
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # cache key -> lock held while it is rendered, so a variant that is
+        # asked for many times at once is rendered once
+        self._rendering = {}
+
+    def _index(self):
+        # rebuilt when the directory changes, as tests point it elsewhere
+        root = Path(settings.MEDIA_VARIANT_CACHE_DIR)
+        if root != self._root:
+            files = []
+            if root.is_dir():
+                for path in root.rglob('*'):
+                    if path.is_file() and not path.name.startswith('.'):
+                        stat = path.stat()
+                        files.append((stat.st_mtime, path.relative_to(root).as_posix(), stat.st_size))
+            self._root = root
+            self._entries = OrderedDict((key, size) for _, key, size in sorted(files))
+            self._size = sum(self._entries.values())
+        return self._root
+
+    def _open(self, root, key):
+        """The cached file of `key`, marked as used, or None."""
+        if key not in self._entries:
+            return None
+        try:
+            file = open(root / key, 'rb')
+        except FileNotFoundError:
+            self._size -= self._entries.pop(key)
+            return None
+        self._entries.move_to_end(key)
+        try:
+            os.utime(root / key)
+        except OSError:
+            pass
+        return file
+
+    def get(self, blob, variant, extension):
+        """The cached file of a variant of `blob` opened for reading,
+        rendered first if it is not cached. The file stays readable when it
+        is evicted while it is served."""
+        side = settings.MEDIA_VARIANTS[variant]
+        # the side and quality are part of the key, so changing them renders anew
+        key = f'{blob.sha256[:2]}/{blob.sha256}/{variant}-{side}-q{settings.MEDIA_VARIANT_QUALITY}.{extension}'
+        with self._lock:
+            root = self._index()
+            file = self._open(root, key)
+            if file is not None:
+                return file
+            rendering = self._rendering.setdefault(key, threading.Lock())
+        try:
+            with rendering:
+                with self._lock:
+                    file = self._open(root, key)
+                if file is not None:
+                    return file
+                return self._write(root, key, pool.render(blob, side, extension))
+        finally:
+            with self._lock:
+                self._rendering.pop(key, None)
+
+    def _write(self, root, key, data):
+        path = root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # written aside and renamed, so a reader never sees half a file
+        descriptor, temporary = tempfile.mkstemp(dir=path.parent, prefix='.')
+        with os.fdopen(descriptor, 'wb') as output:
+            output.write(data)
+        os.replace(temporary, path)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._size += len(data)
+            file = open(path, 'rb')
+            self._evict(root)
+        return file
+
+    def _evict(self, root):
+        # the newest entry stays even when it alone is over the bound
+        while self._size > settings.MEDIA_VARIANT_CACHE_SIZE and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                (root / key).unlink()
+            except FileNotFoundError:
+                pass
+
+    def discard(self, digest):
+        """Deletes the cached variants of the blob `digest`."""
+        with self._lock:
+            root = self._index()
+            prefix = f'{digest[:2]}/{digest}/'
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._size -= self._entries.pop(key)
+            shutil.rmtree(root / prefix, ignore_errors=True)
+
+
+variant_cache = VariantCache()
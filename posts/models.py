@@ -1,33 +1,68 @@
 from django.db import models
+from django.db.models import F
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 # Create your models here.
+class Media(models.Model):
+    # an uploaded image, stored once under its SHA-256 however many posts
+    # share it; see posts/media.py
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(max_length=255)
+    format = models.CharField(max_length=10)
+    # as displayed, after the EXIF orientation is applied
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    size = models.PositiveBigIntegerField()
+    # posts that use it; the blob is collected when the last one is deleted
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return self.sha256
+
+
 class Post(models.Model):
     post = models.TextField(null=False)
     media = models.ImageField(upload_to='images', null=True) # image
+    # the blob behind `media`, which names the same file
+    blob = models.ForeignKey(Media, on_delete=models.PROTECT, null=True, related_name='posts')
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    # engagement counters, kept in step by the like/comment/repost mutations
+    # and rebuilt by `manage.py rebuild_post_counters`
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    reposts_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            # timelines pull the newest posts of high-follower authors
+            models.Index(fields=['created_by', 'created_at', 'id']),
+        ]
 
     def __str__(self) -> str:
         return self.post
     
+    def adjust_count(self, counter, delta):
+        # F() keeps concurrent likes from overwriting each other's increments
+        Post.objects.filter(pk=self.pk).update(**{counter: F(counter) + delta})
+    
     def like_count(self):
-        return Like.objects.filter(post=self).count()
+        return self.likes_count
     
     def comment_count(self):
-        return Comment.objects.filter(post=self).count()
+        return self.comments_count
     
     def comments(self):
         return Comment.objects.filter(post=self)
     
     def repost_count(self):
-        return Repost.objects.filter(post=self).count()
+        return self.reposts_count
     
     def reposts(self):
         return Repost.objects.filter(post=self)
@@ -42,7 +77,10 @@ class Like(models.Model):
     updated_at = models.DateTimeField(auto_now_add=True)
 
     def unlike(self):
-        self.delete()
+        """Deletes the like and returns whether it was still there, so that
+        two concurrent unlikes take it off the count once."""
+        deleted, _ = Like.objects.filter(pk=self.pk).delete()
+        return bool(deleted)
     
     
     def __str__(self) -> str:
@@ -50,6 +88,11 @@ class Like(models.Model):
       
     class Meta:
         unique_together = ('liked_by', 'post')
+        indexes = [
+            # a user's likes, newest first
+            models.Index(fields=['liked_by', 'created_at', 'id']),
+            models.Index(fields=['post', 'liked_by']),
+        ]
 
 class Comment(models.Model):
     comment_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
@@ -60,6 +103,10 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['comment_by', 'created_at', 'id']),
+        ]
     
     def __str__(self) -> str:
         return self.comment
@@ -73,6 +120,10 @@ class Repost(models.Model):
 
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['repost_by', 'created_at', 'id']),
+        ]
     
     def __str__(self) -> str:
         return self.comment
@@ -80,13 +131,83 @@ class Repost(models.Model):
 class Notifications(models.Model):
     message = models.TextField()
     message_for = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    # likes, comments, reposts and follows of the same target are coalesced
+    # into one row ("X and 3 others liked your post"), see posts/notifications.py
+    verb = models.CharField(max_length=30, default='')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True)
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    # distinct users behind the row, see NotificationActor
+    actor_count = models.PositiveIntegerField(default=1)
+    # created_at moves forward whenever a coalesced row gets a new action
     created_at = models.DateTimeField(auto_now=True)
     updated_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['message_for', 'verb', 'post']),
+            # a user's notifications, newest first by id, which unlike
+            # created_at does not move when a coalesced row gets a new action
+            models.Index(fields=['message_for', 'id']),
+        ]
     
 
     def __str__(self) -> str:
         return self.message
 
+
+class NotificationActor(models.Model):
+    # the users behind a coalesced notification, so that one user acting
+    # again on the same target is not counted as someone else
+    notification = models.ForeignKey(Notifications, on_delete=models.CASCADE, db_index=False, related_name='+')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['notification', 'actor'], name='unique_notification_actor')]
+
+
+class Hashtag(models.Model):
+    # lowercased, without the '#'
+    name = models.CharField(max_length=100, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f'#{self.name}'
+
+
+class PostHashtag(models.Model):
+    # the hashtags of a post, written by posts/hashtags.py when it is created
+    # or edited; the unique index lists a hashtag's posts newest first
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, db_index=False, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['hashtag', 'post'], name='unique_post_hashtag')]
+
+
+class TrendBucket(models.Model):
+    # the checkpointed Space-Saving sketch of one time bucket of a trend
+    # window, see posts/hashtags.py
+    window = models.CharField(max_length=20)
+    # the bucket's start time divided by its length
+    bucket = models.BigIntegerField()
+    # hashtag -> [count, error]
+    counters = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['window', 'bucket'], name='unique_trend_bucket')]
+
+
+class TimelineEntry(models.Model):
+    # one row per post or repost in a user's home timeline, written when the
+    # post is made so reading the feed never has to join the follow graph
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    repost = models.ForeignKey(Repost, on_delete=models.CASCADE, null=True)
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ('-created_at',)
+        indexes = [models.Index(fields=['owner', 'created_at', 'id'])]
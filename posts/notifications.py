@@ -0,0 +1,218 @@
+"""Write-behind delivery of notifications.
+
+Mutations hand notifications to `notify` instead of saving them. Once the
+mutation's transaction commits they are queued in process and written with
+one bulk_create per batch, either by a background worker thread when the
+queue reaches NOTIFICATION_BATCH_SIZE or every NOTIFICATION_FLUSH_INTERVAL
+seconds ('background' delivery), or straight away on the committing thread
+('commit' delivery, which trades latency for not losing queued notifications
+if the process dies). Whatever is still queued is flushed at shutdown.
+
+Likes, comments, reposts and follows are coalesced: actions with the same
+recipient, verb and post within NOTIFICATION_COALESCE_WINDOW update one row
+("X and 341 others liked your post") instead of adding one each. The users
+behind a row are kept in NotificationActor, so a user who acts again is not
+counted twice. A row keeps its place in the list when it is updated, which is
+ordered by id, so paging never skips or repeats one. Every recipient's unread
+count is kept on the user and reset by markNotificationsRead.
+"""
+import atexit
+import logging
+import threading
+from collections import Counter, namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+from accounts.auth import user_cache
+from .models import NotificationActor, Notifications
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# what the actor did, for the verbs that are coalesced
+COALESCED_VERBS = {
+    'like': 'liked your post',
+    'comment': 'commented on your post',
+    'repost': 'shared your post',
+    'follow': 'followed you!',
+}
+
+# a user's notifications, newest first; see the module docstring
+NOTIFICATION_KEYS = ('-id',)
+
+Event = namedtuple('Event', 'recipient_id verb actor_id actor_name post_id message')
+
+
+def render(verb, actor_name, actor_count):
+    if actor_count == 1:
+        return f'{actor_name} {COALESCED_VERBS[verb]}'
+    others = actor_count - 1
+    return f"{actor_name} and {others} {'other' if others == 1 else 'others'} {COALESCED_VERBS[verb]}"
+
+
+def deliver(events):
+    """Writes a batch of events: coalescable ones update the recipient's open
+    row for the same target or start one, the rest get a row each."""
+    now = timezone.now()
+    groups = {}
+    rows = []
+    for event in events:
+        if event.verb in COALESCED_VERBS:
+            groups.setdefault((event.recipient_id, event.verb, event.post_id), []).append(event)
+        else:
+            rows.append(Notifications(
+                message=event.message, message_for_id=event.recipient_id, verb=event.verb,
+                post_id=event.post_id, actor_id=event.actor_id,
+            ))
+
+    open_rows = {}
+    if groups:
+        targets = Q()
+        for recipient_id, verb, post_id in groups:
+            targets |= Q(message_for_id=recipient_id, verb=verb, post_id=post_id)
+        # updated_at is set once, when the row is first written
+        window_start = now - timedelta(seconds=settings.NOTIFICATION_COALESCE_WINDOW)
+        for row in Notifications.objects.filter(targets, updated_at__gte=window_start).order_by('updated_at'):
+            open_rows[(row.message_for_id, row.verb, row.post_id)] = row
+
+    # the actors already behind the open rows; a row's latest actor counts
+    # even for rows written before actors were recorded
+    known = {(row.id, row.actor_id) for row in open_rows.values()}
+    if open_rows:
+        known.update(NotificationActor.objects.filter(
+            notification__in=open_rows.values(), actor_id__in={event.actor_id for event in events},
+        ).values_list('notification_id', 'actor_id'))
+
+    recipients = {event.recipient_id for event in events}
+    read_at = dict(User.objects.filter(id__in=recipients).values_list('id', 'notifications_read_at'))
+    unread = Counter(row.message_for_id for row in rows)
+    updated = []
+    # (row, actor id) pairs to record once the new rows have ids
+    actors = []
+    for key, grouped in groups.items():
+        row = open_rows.get(key)
+        # the distinct actors, latest last
+        names = {}
+        for event in grouped:
+            names.pop(event.actor_id, None)
+            names[event.actor_id] = event.actor_name
+        new_actors = [actor_id for actor_id in names if (row.id if row else None, actor_id) not in known]
+        if row is None:
+            row = Notifications(message_for_id=key[0], verb=key[1], post_id=key[2], actor_count=0)
+            rows.append(row)
+            unread[key[0]] += 1
+        elif not new_actors:
+            # everyone acting again has been counted already
+            continue
+        else:
+            marker = read_at.get(key[0])
+            if marker is not None and row.created_at <= marker:
+                # the row had been read, the new activity makes it unread again
+                unread[key[0]] += 1
+            updated.append(row)
+        row.actor_count += len(new_actors)
+        actors += [(row, actor_id) for actor_id in new_actors]
+        row.actor_id, actor_name = list(names.items())[-1]
+        row.message = render(row.verb, actor_name, row.actor_count)
+        row.created_at = now
+
+    with transaction.atomic():
+        Notifications.objects.bulk_create(rows)
+        NotificationActor.objects.bulk_create(
+            [NotificationActor(notification_id=row.id, actor_id=actor_id) for row, actor_id in actors if actor_id is not None],
+            ignore_conflicts=True,
+        )
+        if updated:
+            Notifications.objects.bulk_update(updated, ['message', 'actor', 'actor_count', 'created_at'])
+        if unread:
+            User.objects.filter(id__in=unread).update(unread_notification_count=F('unread_notification_count') + Case(
+                *[When(id=user_id, then=count) for user_id, count in unread.items()], default=0,
+            ))
+    if unread:
+        # the cached users of JWT requests carry the old count
+        user_cache.invalidate(*unread)
+
+
+class NotificationDispatcher:
+    def __init__(self):
+        self._queue = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._worker = None
+
+    def notify(self, recipient, verb, actor=None, post=None, message=None):
+        """Queues a notification for `recipient`. Verbs in COALESCED_VERBS
+        render their own message, any other verb needs one."""
+        self.notify_many([(recipient, verb, actor, post, message)])
+
+    def notify_many(self, notifications):
+        """Queues many notifications, each a (recipient, verb, actor, post,
+        message) tuple of `notify` arguments. They are handed over together
+        when the transaction commits, so 'commit' delivery writes them in one
+        batch."""
+        events = [
+            Event(
+                recipient.id, verb, actor.id if actor else None, actor.username if actor else None,
+                post.id if post else None, message,
+            )
+            for recipient, verb, actor, post, message in notifications
+            if recipient is not None
+        ]
+        if not events:
+            return
+        if settings.NOTIFICATION_DELIVERY == 'commit':
+            transaction.on_commit(lambda: self._write(events))
+        else:
+            transaction.on_commit(lambda: self._enqueue(events))
+
+    def _enqueue(self, events):
+        with self._lock:
+            self._queue.extend(events)
+            full = len(self._queue) >= settings.NOTIFICATION_BATCH_SIZE
+            if self._worker is None:
+                self._start()
+        if full:
+            self._wakeup.set()
+
+    def _start(self):
+        self._worker = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(settings.NOTIFICATION_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            batch, self._queue = self._queue, []
+        self._write(batch)
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            deliver(batch)
+        except Exception:
+            logger.exception('Dropped %d notifications', len(batch))
+
+    def drain(self):
+        """Stops the worker and writes everything still queued."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._worker is not None and self._worker is not threading.current_thread():
+            self._worker.join(timeout=settings.NOTIFICATION_FLUSH_INTERVAL * 2)
+        self.flush()
+
+
+dispatcher = NotificationDispatcher()
+notify = dispatcher.notify
+notify_many = dispatcher.notify_many
+atexit.register(dispatcher.drain)
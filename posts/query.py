@@ -1,42 +1,96 @@
 import graphene
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
 from graphql import GraphQLError
-from .schema import PostType, LikeType, CommentType, RepostType
-from .models import Post, Like, Comment, Repost, Notifications
+from graphene_file_upload.scalars import Upload
+from app.pagination import connection_field, paginate, page_size, make_connection, decode_cursor, encode_cursor
+from app.response_cache import invalidate
+from .schema import PostType, LikeType, CommentType, RepostType, PostConnection, CommentConnection, RepostConnection, TimelineEntryConnection, TrendingHashtagType
+from .models import Post, Like, Comment, Repost, TimelineEntry
+from .notifications import notify
+from . import hashtags
+from . import media as post_media
+from . import search as post_search
+from . import timeline
 
 class Query(graphene.ObjectType):
+    # public fields answered from the response cache, with the model each one lists
+    cacheable_fields = {
+        'posts': Post,
+        'search_post': Post,
+        'comments': Comment,
+        'comment': Comment,
+        'reposts': Repost,
+        'repost': Repost,
+    }
+
     # posts
-    posts = graphene.List(PostType)
+    posts = connection_field(PostConnection)
     post = graphene.Field(PostType, id= graphene.Int())
-    search_post = graphene.List(PostType, search=graphene.String())
-    def resolve_posts(self, info, **kwargs):
-        return Post.objects.all()
+    search_post = connection_field(PostConnection, search=graphene.String())
+    def resolve_posts(self, info, first=None, after=None):
+        return paginate(info, Post.objects.select_related('created_by'), PostConnection, first, after)
 
     def resolve_post(self, info, id):
         if info.context.user.is_anonymous:
             raise GraphQLError('You are not authenticated. Log in')
         return Post.objects.get(id=id)
     
-    def resolve_search_post(self, info, search=None):
+    def resolve_search_post(self, info, search=None, first=None, after=None):
         if search:
-            filter = Q(post__icontains=search)
-            return Post.objects.filter(filter)
+            if not post_search.supported():
+                filter = Q(post__icontains=search)
+                return paginate(info, Post.objects.filter(filter).select_related('created_by'), PostConnection, first, after)
+            keys = post_search.SEARCH_KEYS
+            cursor = decode_cursor(after, Post, keys) if after else None
+            posts, has_next_page = post_search.search_posts(search, page_size(first), cursor)
+            return make_connection(info, PostConnection, posts, has_next_page, after, lambda post: encode_cursor(post, keys))
+        
+    # hashtags: the most used ones of a window, and the posts of one
+    trending_hashtags = graphene.List(TrendingHashtagType, window=graphene.String(default_value='hour'), first=graphene.Int())
+    posts_by_hashtag = connection_field(PostConnection, hashtag=graphene.String(required=True))
+
+    def resolve_trending_hashtags(self, info, window='hour', first=None):
+        if window not in settings.HASHTAG_TREND_WINDOWS:
+            raise GraphQLError(f"window must be one of {', '.join(settings.HASHTAG_TREND_WINDOWS)}")
+        if first is not None and first < 1:
+            raise GraphQLError('first must be a positive number')
+        trending = hashtags.trends.top(window, first or settings.HASHTAG_TREND_SIZE)
+        return [{'name': name, 'count': count} for name, count in trending]
+
+    def resolve_posts_by_hashtag(self, info, hashtag, first=None, after=None):
+        rows, has_next_page = hashtags.posts(hashtag, first, after)
+        return make_connection(info, PostConnection, [row.post for row in rows], has_next_page, after, hashtags.cursor)
+
+    # home timeline: posts and reposts by the user and everyone they follow
+    home_timeline = connection_field(TimelineEntryConnection)
+
+    def resolve_home_timeline(self, info, first=None, after=None):
+        if info.context.user.is_anonymous:
+            raise GraphQLError('You are not authenticated. Log in')
+        keys = timeline.TIMELINE_KEYS
+        cursor = decode_cursor(after, TimelineEntry, keys) if after else None
+        entries, has_next_page = timeline.read(info.context.user, page_size(first), cursor)
+        return make_connection(
+            info, TimelineEntryConnection, entries, has_next_page, after, lambda entry: encode_cursor(entry, keys)
+        )
         
     # comments
-    comments = graphene.List(CommentType)
+    comments = connection_field(CommentConnection)
     comment = graphene.Field(CommentType, id= graphene.Int()) 
-    def resolve_comments(self, info, **kwargs):
-        return Comment.objects.all()
+    def resolve_comments(self, info, first=None, after=None):
+        return paginate(info, Comment.objects.all(), CommentConnection, first, after)
     
     def resolve_comment(self, info, id):
         return Comment.objects.get(id=id)
     
     # reposts
-    reposts = graphene.List(RepostType)
+    reposts = connection_field(RepostConnection)
     repost = graphene.Field(RepostType, id= graphene.Int())
 
-    def resolve_reposts(self, info, **kwargs):
-        return Repost.objects.all()
+    def resolve_reposts(self, info, first=None, after=None):
+        return paginate(info, Repost.objects.all(), RepostConnection, first, after)
     
     def resolve_repost(self, info, id):
         return Repost.objects.get(id=id)
@@ -44,18 +98,75 @@ class Query(graphene.ObjectType):
 class CreatePost(graphene.Mutation):
     class Arguments:
         tweet = graphene.String(required=True)
-        
+        # an image sent as a multipart upload, see posts/media.py
+        media = Upload()
     
     ok = graphene.Boolean()
     post = graphene.Field(PostType)
     
-    def mutate(self, info, tweet):
+    def mutate(self, info, tweet, media=None):
         if not info.context.user.is_anonymous:
             new_post = Post(post=tweet, created_by=info.context.user)
-            new_post.save()
+            if media is not None:
+                # stored before the transaction, which would otherwise hold
+                # the write lock while the file is hashed and written
+                post_media.attach(new_post, media)
+            try:
+                with transaction.atomic():
+                    new_post.save()
+                    hashtags.tag([new_post])
+                    timeline.fan_out(new_post)
+                    invalidate(Post)
+            except Exception:
+                if new_post.blob_id is not None:
+                    # the blob and its file go if no other post uses them
+                    post_media.release(new_post.blob_id)
+                raise
             return CreatePost(ok=True, post=new_post)
         raise GraphQLError('You are not authenticated. Log in')
     
+class BulkCreatePostResult(graphene.ObjectType):
+    index = graphene.Int()
+    ok = graphene.Boolean()
+    post = graphene.Field(PostType)
+    message = graphene.String()
+
+
+class BulkCreatePosts(graphene.Mutation):
+    """createPost for a list of tweets, written in one transaction. Empty
+    tweets get a result with ok false, `index` is the tweet's position in
+    the list."""
+
+    class Arguments:
+        tweets = graphene.List(graphene.NonNull(graphene.String), required=True)
+
+    ok = graphene.Boolean()
+    results = graphene.List(BulkCreatePostResult)
+
+    def mutate(self, info, tweets):
+        if info.context.user.is_anonymous:
+            raise GraphQLError('You are not authenticated. Log in')
+        if len(tweets) > settings.BULK_MUTATION_MAX_ITEMS:
+            raise GraphQLError(f'At most {settings.BULK_MUTATION_MAX_ITEMS} posts can be created at once')
+
+        results = {}
+        new_posts = {}
+        for index, tweet in enumerate(tweets):
+            if tweet.strip():
+                new_posts[index] = Post(post=tweet, created_by=info.context.user)
+            else:
+                results[index] = BulkCreatePostResult(index=index, ok=False, message='A post cannot be empty')
+        if new_posts:
+            with transaction.atomic():
+                Post.objects.bulk_create(new_posts.values())
+                hashtags.tag(new_posts.values())
+                timeline.fan_out_many(info.context.user, [(post, None) for post in new_posts.values()])
+                invalidate(Post)
+            for index, post in new_posts.items():
+                results[index] = BulkCreatePostResult(index=index, ok=True, post=post)
+        return BulkCreatePosts(ok=True, results=[results[index] for index in range(len(tweets))])
+
+
 class CreateComment(graphene.Mutation):
     class Arguments:
         comment = graphene.String(required=True)
@@ -73,13 +184,12 @@ class CreateComment(graphene.Mutation):
             raise GraphQLError('This post does not exist')
         
         # Comment On A Post
-        new_comment = Comment(comment=comment, comment_by=info.context.user, post=post)
-        new_comment.save()
-        notification = Notifications(
-                    message = f'{info.context.user.username} commented on your post',
-                    message_for = post.created_by
-                )
-        notification.save()
+        with transaction.atomic():
+            new_comment = Comment(comment=comment, comment_by=info.context.user, post=post)
+            new_comment.save()
+            post.adjust_count('comments_count', 1)
+            invalidate(Comment, post)
+            notify(post.created_by, 'comment', info.context.user, post)
         return CreateComment(ok=True, comment=new_comment)
         
 
@@ -98,13 +208,12 @@ class CreateLike(graphene.Mutation):
         
         if not info.context.user.is_anonymous:
             if not Like.objects.filter(liked_by=info.context.user,post=liked_post).exists():
-                new_like = Like(liked_by=info.context.user, post=liked_post)
-                new_like.save()
-                notification = Notifications(
-                    message = f'{info.context.user.username} liked your post',
-                    message_for = liked_post.created_by
-                )
-                notification.save()
+                with transaction.atomic():
+                    new_like = Like(liked_by=info.context.user, post=liked_post)
+                    new_like.save()
+                    liked_post.adjust_count('likes_count', 1)
+                    invalidate(liked_post)
+                    notify(liked_post.created_by, 'like', info.context.user, liked_post)
                 return CreateLike(ok=True, like=new_like)
             raise GraphQLError('You cannot like a single post twice')
         raise GraphQLError('You are not authenticated')
@@ -125,10 +234,12 @@ class UnLike(graphene.Mutation):
             raise GraphQLError('Such post does not exist')
         
         liked_post = Like.objects.filter(post=post, liked_by=info.context.user).first()
-        if liked_post:
-            liked_post.unlike()
-        else:
-            return GraphQLError('You have not liked such a post')
+        with transaction.atomic():
+            # a concurrent unlike may have deleted it since it was read
+            if liked_post is None or not liked_post.unlike():
+                raise GraphQLError('You have not liked such a post')
+            post.adjust_count('likes_count', -1)
+            invalidate(post)
         return UnLike(ok=True, message='You have unliked the post')
 
 class CreateRepost(graphene.Mutation):
@@ -141,7 +252,7 @@ class CreateRepost(graphene.Mutation):
     message = graphene.String()
     
 
-    def mutate(self, info, post_id, comment):
+    def mutate(self, info, post_id, comment=None):
         if info.context.user.is_anonymous:
             raise GraphQLError('You are not authorised')
         try:
@@ -154,12 +265,13 @@ class CreateRepost(graphene.Mutation):
             post = post,
             comment = comment
         )
-        notification = Notifications(
-                    message = f'{info.context.user.username} shared your post',
-                    message_for = post.created_by
-                )
-        notification.save()
-        repost.save()
+        with transaction.atomic():
+            repost.save()
+            post.adjust_count('reposts_count', 1)
+            timeline.fan_out(post, repost)
+            invalidate(Repost, post)
+            # sent when the repost commits, so a failed one notifies no one
+            notify(post.created_by, 'repost', info.context.user, post)
         return CreateRepost(ok=True, repost=repost, message='You have successfully reposted this post!')
         
     
@@ -175,7 +287,10 @@ class UpdatePost(graphene.Mutation):
         updated_post = Post.objects.get(id=id)
         if updated_post.created_by == info.context.user:
             updated_post.post = post
-            updated_post.save()
+            with transaction.atomic():
+                updated_post.save()
+                hashtags.retag(updated_post)
+            invalidate(updated_post)
             return UpdatePost(ok=True, post=updated_post)
         raise GraphQLError('You are not authorised')
     
@@ -198,6 +313,7 @@ class UpdateComment(graphene.Mutation):
         if updated_comment.comment_by == info.context.user:
             updated_comment.comment = comment
             updated_comment.save()
+            invalidate(updated_comment)
             return UpdateComment(ok=True, comment=updated_comment)
         raise GraphQLError('You are not authorised')
         
@@ -214,8 +330,13 @@ class DeletePost(graphene.Mutation):
             post = Post.objects.get(id=id)
         except Post.DoesNotExist:
             raise GraphQLError('Post does not exist')
-        if post.created_by == info.context.user.id:
-            post.delete()
+        if post.created_by == info.context.user:
+            with transaction.atomic():
+                timeline.remove_post(post)
+                invalidate(post)
+                post.delete()
+                if post.blob_id is not None:
+                    post_media.release(post.blob_id)
             return DeletePost(ok=True, post=post)
         raise GraphQLError('You are not authorised')
     
@@ -232,7 +353,13 @@ class DeleteComment(graphene.Mutation):
         except Comment.DoesNotExist:
             raise GraphQLError('Comment does not exist')
         if comment.comment_by == info.context.user:
-            comment.delete()
+            with transaction.atomic():
+                # only the request that deletes the row takes it off the count
+                deleted, _ = Comment.objects.filter(pk=comment.pk).delete()
+                if not deleted:
+                    raise GraphQLError('Comment does not exist')
+                invalidate(comment, comment.post)
+                comment.post.adjust_count('comments_count', -1)
             return DeleteComment(ok=True, comment=comment)
         raise GraphQLError('You are not authorised')
     
@@ -253,12 +380,20 @@ class DeleteRepost(graphene.Mutation):
             raise GraphQLError('Repost does not exist')
 
         if repost.repost_by == info.context.user:
-            repost.delete()
+            with transaction.atomic():
+                timeline.remove_repost(repost)
+                # only the request that deletes the row takes it off the count
+                deleted, _ = Repost.objects.filter(pk=repost.pk).delete()
+                if not deleted:
+                    raise GraphQLError('Repost does not exist')
+                invalidate(repost, repost.post)
+                repost.post.adjust_count('reposts_count', -1)
             return DeleteRepost(ok=True, message='Repost has been deleted') 
         raise GraphQLError('You are not authorized to delete this')
 
 class Mutation(graphene.ObjectType):
     create_post = CreatePost.Field()
+    bulk_create_posts = BulkCreatePosts.Field()
     update_post = UpdatePost.Field()
     delete_post = DeletePost.Field()
     like_post = CreateLike.Field()
@@ -269,5 +404,3 @@ class Mutation(graphene.ObjectType):
     repost = CreateRepost.Field()
     delete_repost = DeleteRepost.Field()
     
-
-schema = graphene.Schema(query=Query, mutation=Mutation)
@@ -1,6 +1,10 @@
 import graphene
+from django.conf import settings
 from graphene_django import DjangoObjectType
-from .models import Post, Like, Comment, Repost, Notifications
+from app.cost import FieldCost
+from app.dataloader import instance_loader
+from .models import Media, Post, Like, Comment, Repost, Notifications, TimelineEntry
+from . import loaders, media
 
 
 
@@ -9,50 +13,122 @@ class CommentType(DjangoObjectType):
         model = Comment
         fields = ("id", "comment", "created_at", "updated_at", "comment_by", "post")
 
+class CommentConnection(graphene.relay.Connection):
+    class Meta:
+        node = CommentType
+
 
 class LikeType(DjangoObjectType):
     class Meta:
         model = Like
         fields = ("id", "liked_by", "post")
 
+class LikeConnection(graphene.relay.Connection):
+    class Meta:
+        node = LikeType
+
 class RepostType(DjangoObjectType):
     class Meta:
         model = Repost
         fields = ("id", "comment", "post", "repost_by")
 
+class RepostConnection(graphene.relay.Connection):
+    class Meta:
+        node = RepostType
+
 class NotificationType(DjangoObjectType):
+    is_read = graphene.Boolean()
+
+    viewer_fields = ('is_read',)
+
+    def resolve_is_read(self, info):
+        read_at = info.context.user.notifications_read_at
+        return read_at is not None and self.created_at <= read_at
+
     class Meta:
         model = Notifications
-        fields = ("id", "message")
+        fields = ("id", "message", "verb", "post", "actor", "actor_count", "created_at")
+
+class NotificationConnection(graphene.relay.Connection):
+    class Meta:
+        node = NotificationType
+
 
 
+class MediaVariantType(graphene.ObjectType):
+    # resolved from the dicts of posts/media.py `variants`
+    name = graphene.String()
+    format = graphene.String()
+    content_type = graphene.String()
+    width = graphene.Int()
+    height = graphene.Int()
+    url = graphene.String()
+
+
+class TrendingHashtagType(graphene.ObjectType):
+    # resolved from dicts; the count is an estimate that errs high, see posts/hashtags.py
+    name = graphene.String()
+    count = graphene.Int()
+
 
 class PostType(DjangoObjectType):
+    media_url = graphene.String()
+    # resized copies of the media, best for the client to download; they are
+    # rendered when first fetched
+    media_variants = graphene.List(MediaVariantType, format=graphene.String())
     like_count = graphene.Int()
     comment_count = graphene.Int()
     repost_count = graphene.Int()
     comments = graphene.List(CommentType)
     reposts = graphene.List(RepostType)
 
+    # the comments and reposts of a post are not paginated; the loaders return
+    # at most the newest POST_PREVIEW_SIZE of each
+    field_costs = {
+        'comments': FieldCost(2, list_size=settings.POST_PREVIEW_SIZE),
+        'reposts': FieldCost(2, list_size=settings.POST_PREVIEW_SIZE),
+    }
+
+    def resolve_media_url(self, info):
+        return self.media.url if self.media else None
+
+    def resolve_media_variants(self, info, format=None):
+        if self.blob_id is None:
+            return []
+        return media.variants(instance_loader(Media).load(info, self.blob_id), format)
+
     def resolve_like_count(self, info):
-        return self.like_count()
+        return self.likes_count
     
     def resolve_comment_count(self, info):
-        return self.comment_count()
+        return self.comments_count
     
     def resolve_repost_count(self, info):
-        return self.repost_count()
+        return self.reposts_count
     
     def resolve_reposts(self, info):
-        return self.reposts()
+        return loaders.reposts.load(info, self.id)
     
     def resolve_comments(self, info):
-        return self.comments()
+        return loaders.comments.load(info, self.id)
 
     class Meta:
         model = Post
         fields = ("id", "post", "created_at", "updated_at", "like_count", "comment_count", "created_by", "repost_count")
 
 
+class PostConnection(graphene.relay.Connection):
+    class Meta:
+        node = PostType
+
+
+class TimelineEntryType(DjangoObjectType):
+    class Meta:
+        model = TimelineEntry
+        # entries pulled at read time are never saved, so there is no id to expose
+        fields = ("post", "repost", "author", "created_at")
+
 
-    
\ No newline at end of file
+class TimelineEntryConnection(graphene.relay.Connection):
+    class Meta:
+        node = TimelineEntryType
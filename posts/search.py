@@ -0,0 +1,102 @@
+"""Full-text search over posts.
+
+On SQLite the post text is indexed in an FTS5 table that triggers keep in step
+with posts_post, and results are ranked by BM25. Other databases fall back to
+a substring match in recency order.
+"""
+import re
+from django.db import connection
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+
+# best match first; the post id keeps equally ranked results in a stable order
+SEARCH_KEYS = ('search_rank', '-id')
+
+SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        post, content='posts_post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, post) VALUES (new.id, new.post);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, post) VALUES ('delete', old.id, old.post);
+    END""",
+    # only edits of the text itself touch the index, not the counter updates
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF post ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, post) VALUES ('delete', old.id, old.post);
+        INSERT INTO {FTS_TABLE}(rowid, post) VALUES (new.id, new.post);
+    END""",
+]
+
+TOKEN = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def supported(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def install(using=connection):
+    if not supported(using):
+        return
+    with using.cursor() as cursor:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+
+
+def rebuild(using=connection):
+    install(using)
+    with using.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def match_expression(search):
+    """Turns user input into an FTS5 query: "quoted text" is a phrase, a
+    trailing * makes a prefix query and every other word must appear. Each
+    term is quoted so FTS5 operators in the input are matched literally."""
+    terms = []
+    for phrase, word in TOKEN.findall(search):
+        if phrase.strip():
+            terms.append('"{}"'.format(phrase.strip()))
+        elif word:
+            prefix = word.endswith('*')
+            word = word.rstrip('*').replace('"', '')
+            if word:
+                terms.append('"{}"{}'.format(word, '*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def search_posts(search, size, cursor=None):
+    """Returns up to `size` posts matching `search` after `cursor` (a decoded
+    SEARCH_KEYS tuple), each annotated with its `search_rank`, and whether
+    more remain."""
+    expression = match_expression(search)
+    if not expression:
+        return [], False
+
+    where = f'{FTS_TABLE} MATCH %s'
+    params = [expression]
+    if cursor:
+        # bm25() is lower for better matches
+        rank, post_id = cursor
+        where += f' AND (bm25({FTS_TABLE}) > %s OR (bm25({FTS_TABLE}) = %s AND rowid < %s))'
+        params += [rank, rank, post_id]
+    with connection.cursor() as db:
+        db.execute(
+            f'SELECT rowid, bm25({FTS_TABLE}) FROM {FTS_TABLE} WHERE {where} '
+            f'ORDER BY bm25({FTS_TABLE}), rowid DESC LIMIT %s',
+            params + [size + 1],
+        )
+        ranked = db.fetchall()
+
+    posts = Post.objects.select_related('created_by').in_bulk([post_id for post_id, _ in ranked[:size]])
+    results = []
+    for post_id, rank in ranked[:size]:
+        post = posts.get(post_id)
+        if post is not None:
+            post.search_rank = rank
+            results.append(post)
+    return results, len(ranked) > size
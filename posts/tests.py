@@ -0,0 +1,549 @@
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import DatabaseError
+from django.db.models import QuerySet
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from graphql_jwt.shortcuts import get_token
+from PIL import Image
+from accounts.models import Following, User
+from app.graphql_testing import GraphQLTestMixin, seed
+from app.query_budgets import QueryBudgetTestMixin
+from app.query_plans import QueryPlanTestMixin
+from . import hashtags, media
+from .models import Comment, Hashtag, Like, Media, Notifications, Post, PostHashtag, Repost, TimelineEntry
+from .notifications import Event, deliver
+from .query import Mutation, Query
+
+POST_FIELDS = 'id post createdBy { id username } likeCount commentCount repostCount comments { id commentBy { id } } reposts { id }'
+
+
+def own_post(test):
+    return Post.objects.filter(created_by=test.users[0]).first().id
+
+
+def liked_post(test):
+    return test.users[0].like_set.first().post_id
+
+
+def unliked_post(test):
+    return Post.objects.exclude(created_by=test.users[0]).exclude(like__liked_by=test.users[0]).first().id
+
+
+class QueryPlanTests(QueryPlanTestMixin, TestCase):
+    operations = {
+        'posts': f'{{ posts(first: 5) {{ edges {{ node {{ {POST_FIELDS} }} }} pageInfo {{ hasNextPage endCursor }} }} }}',
+        'post': (f'query ($id: Int) {{ post(id: $id) {{ {POST_FIELDS} }} }}', lambda test: {'id': own_post(test)}),
+        'searchPost': f'{{ searchPost(search: "django", first: 5) {{ edges {{ node {{ {POST_FIELDS} }} }} }} }}',
+        'homeTimeline': '{ homeTimeline(first: 10) { edges { node { createdAt author { id } post { id likeCount } repost { id } } } } }',
+        'comments': '{ comments(first: 5) { edges { node { id comment commentBy { id } post { id } } } } }',
+        'comment': (
+            'query ($id: Int) { comment(id: $id) { id comment post { id } } }',
+            lambda test: {'id': Comment.objects.first().id},
+        ),
+        'reposts': '{ reposts(first: 5) { edges { node { id comment repostBy { id } post { id } } } } }',
+        'repost': (
+            'query ($id: Int) { repost(id: $id) { id comment post { id } } }',
+            lambda test: {'id': Repost.objects.first().id},
+        ),
+        'trendingHashtags': '{ trendingHashtags(window: "day", first: 5) { name count } }',
+        'postsByHashtag': (
+            f'{{ postsByHashtag(hashtag: "#Django", first: 5) {{ edges {{ node {{ {POST_FIELDS} }} }} pageInfo {{ hasNextPage endCursor }} }} }}'
+        ),
+        'createPost': 'mutation { createPost(tweet: "a new post about #django and #graphql") { ok post { id } } }',
+        'bulkCreatePosts': 'mutation { bulkCreatePosts(tweets: ["one #django", "", "two #sqlite"]) { ok results { index ok message post { id } } } }',
+        'updatePost': (
+            'mutation ($id: Int!) { updatePost(id: $id, post: "edited for #graphql") { ok post { id } } }',
+            lambda test: {'id': own_post(test)},
+        ),
+        'deletePost': ('mutation ($id: Int!) { deletePost(id: $id) { ok } }', lambda test: {'id': own_post(test)}),
+        'likePost': ('mutation ($id: Int!) { likePost(post: $id) { ok like { id } } }', lambda test: {'id': unliked_post(test)}),
+        'unlikePost': ('mutation ($id: Int!) { unlikePost(postId: $id) { ok } }', lambda test: {'id': liked_post(test)}),
+        'createComment': (
+            'mutation ($id: Int!) { createComment(postId: $id, comment: "nice") { ok comment { id } } }',
+            lambda test: {'id': unliked_post(test)},
+        ),
+        'updateComment': (
+            'mutation ($id: Int!) { updateComment(id: $id, comment: "edited") { ok comment { id } } }',
+            lambda test: {'id': test.users[0].comment_set.first().id},
+        ),
+        'deleteComment': (
+            'mutation ($id: Int!) { deleteComment(id: $id) { ok } }',
+            lambda test: {'id': test.users[0].comment_set.first().id},
+        ),
+        'repost': (
+            'mutation ($id: Int!) { repost(postId: $id, comment: "look") { ok repost { id } } }',
+            lambda test: {'id': unliked_post(test)},
+        ),
+        'deleteRepost': (
+            'mutation ($id: Int!) { deleteRepost(id: $id) { ok } }',
+            lambda test: {'id': test.users[0].repost_set.first().id},
+        ),
+    }
+
+    def test_covers_every_field(self):
+        self.assertCoversFields(Query, Mutation)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    operations = {
+        'Feed': f'query Feed {{ posts(first: 20) {{ edges {{ node {{ {POST_FIELDS} }} }} }} }}',
+        'PostDetail': (
+            '''query PostDetail($id: Int) {
+                post(id: $id) {
+                    id post likeCount createdBy { username followerCount isFollowing }
+                    comments { comment commentBy { username followerCount } }
+                    reposts { comment repostBy { username } }
+                }
+            }''',
+            lambda test: {'id': own_post(test)},
+        ),
+        'Search': f'query Search {{ searchPost(search: "django", first: 20) {{ edges {{ node {{ {POST_FIELDS} }} }} }} }}',
+        'HomeTimeline': '''query HomeTimeline {
+            homeTimeline(first: 20) { edges { node { createdAt author { username } post { id likeCount createdBy { username } } repost { id comment } } } }
+        }''',
+        'Comments': 'query Comments { comments(first: 20) { edges { node { id commentBy { username } post { id createdBy { username } } } } } }',
+        'Reposts': 'query Reposts { reposts(first: 20) { edges { node { id repostBy { username } post { id createdBy { username } } } } } }',
+        'TrendingHashtags': 'query TrendingHashtags { trendingHashtags { name count } }',
+        'PostsByHashtag': f'query PostsByHashtag {{ postsByHashtag(hashtag: "django", first: 20) {{ edges {{ node {{ {POST_FIELDS} }} }} }} }}',
+        'CreatePost': 'mutation CreatePost { createPost(tweet: "a new post") { ok post { id createdBy { username } } } }',
+        'BulkCreatePosts': (
+            '''mutation BulkCreatePosts($tweets: [String!]!) {
+                bulkCreatePosts(tweets: $tweets) { ok results { index ok message post { id createdBy { username } } } }
+            }''',
+            lambda test: {'tweets': [f'bulk post {number} #django #bulk{number}' for number in range(len(test.users))] + ['']},
+        ),
+        'LikePost': (
+            'mutation LikePost($id: Int!) { likePost(post: $id) { ok like { post { likeCount } } } }',
+            lambda test: {'id': unliked_post(test)},
+        ),
+        'CreateComment': (
+            'mutation CreateComment($id: Int!) { createComment(postId: $id, comment: "nice") { ok comment { id } } }',
+            lambda test: {'id': unliked_post(test)},
+        ),
+        'Repost': (
+            'mutation Repost($id: Int!) { repost(postId: $id, comment: "look") { ok repost { id } } }',
+            lambda test: {'id': unliked_post(test)},
+        ),
+        'DeletePost': ('mutation DeletePost($id: Int!) { deletePost(id: $id) { ok } }', lambda test: {'id': own_post(test)}),
+    }
+
+
+class NotificationTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed()
+
+    def like(self, post, *actors):
+        deliver([Event(post.created_by_id, 'like', actor.id, actor.username, post.id, None) for actor in actors])
+
+    def test_actions_on_one_target_are_coalesced_by_distinct_actor(self):
+        post = Post.objects.create(post='new', created_by=self.users[0])
+        self.like(post, self.users[1], self.users[2], self.users[1])
+        row = Notifications.objects.get(post=post)
+        self.assertEqual((row.actor_count, row.actor_id, row.message), (2, self.users[1].id, 'user1 and 1 other liked your post'))
+        # acting again, even as someone other than the latest actor, is not someone new
+        self.like(post, self.users[2])
+        self.like(post, self.users[1])
+        self.assertEqual(Notifications.objects.get(post=post).actor_count, 2)
+        self.like(post, self.users[3])
+        self.assertEqual(Notifications.objects.get(post=post).message, 'user3 and 2 others liked your post')
+
+    def test_unread_counts_count_rows(self):
+        recipient = self.users[0]
+        User.objects.filter(pk=recipient.pk).update(unread_notification_count=0, notifications_read_at=timezone.now())
+        post = Post.objects.create(post='new', created_by=recipient)
+        self.like(post, self.users[1], self.users[2])
+        self.like(post, self.users[3])
+        recipient.refresh_from_db()
+        self.assertEqual(recipient.unread_notification_count, 1)
+        # a read row that gets a new action is unread again
+        User.objects.filter(pk=recipient.pk).update(unread_notification_count=0, notifications_read_at=timezone.now())
+        self.like(post, self.users[4])
+        self.like(post, self.users[4])
+        recipient.refresh_from_db()
+        self.assertEqual(recipient.unread_notification_count, 1)
+
+    def test_coalescing_does_not_move_rows_between_pages(self):
+        recipient = self.users[0]
+        posts = [Post.objects.create(post=f'new {number}', created_by=recipient) for number in range(4)]
+        for post in posts:
+            self.like(post, self.users[1])
+        query = '''query ($after: String) {
+            notifications(first: 2, after: $after) { edges { node { id } } pageInfo { hasNextPage endCursor } }
+        }'''
+        ids, after = [], None
+        while True:
+            result, _ = self.run_operation(query, {'after': after}, recipient)
+            page = result['data']['notifications']
+            ids += [int(edge['node']['id']) for edge in page['edges']]
+            if len(ids) == 2:
+                # new actions on rows of the page just read and of the next one
+                self.like(posts[3], self.users[2])
+                self.like(posts[1], self.users[2])
+            if not page['pageInfo']['hasNextPage']:
+                break
+            after = page['pageInfo']['endCursor']
+        expected = list(Notifications.objects.filter(message_for=recipient).order_by('-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_a_failed_repost_notifies_no_one(self):
+        post = Post.objects.filter(created_by=self.users[0], repost__isnull=True).first()
+        query = 'mutation ($id: Int!) { repost(postId: $id) { ok } }'
+        with mock.patch('posts.timeline.fan_out', side_effect=DatabaseError('lost the connection')):
+            result = self.commit_operation(query, {'id': post.id}, self.users[1])
+        self.assertIn('errors', result)
+        self.assertFalse(Repost.objects.filter(post=post, repost_by=self.users[1]).exists())
+        self.assertFalse(Notifications.objects.filter(post=post, verb='repost').exists())
+        self.assertTrue(self.commit_operation(query, {'id': post.id}, self.users[1])['data']['repost']['ok'])
+        self.assertTrue(Notifications.objects.filter(post=post, verb='repost').exists())
+
+
+class CounterTests(GraphQLTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed()
+
+    def deleted_meanwhile(self, method, model, counter):
+        """Patches QuerySet.`method` so that another request deletes the `model`
+        row it returns, and takes it off the post's `counter`, once it is read."""
+        read = getattr(QuerySet, method)
+
+        def side_effect(queryset, *args, **kwargs):
+            row = read(queryset, *args, **kwargs)
+            if queryset.model is model and row is not None and model.objects.filter(pk=row.pk).exists():
+                model.objects.filter(pk=row.pk).delete()
+                row.post.adjust_count(counter, -1)
+            return row
+
+        return mock.patch.object(QuerySet, method, autospec=True, side_effect=side_effect)
+
+    def assertCounted(self, post, counter, related):
+        post.refresh_from_db()
+        self.assertEqual(getattr(post, counter), related.filter(post=post).count())
+
+    def test_concurrent_unlikes_count_once(self):
+        like = Like.objects.filter(liked_by=self.users[1]).select_related('post').first()
+        with self.deleted_meanwhile('first', Like, 'likes_count'):
+            result = self.commit_operation('mutation ($id: Int!) { unlikePost(postId: $id) { ok } }', {'id': like.post_id}, self.users[1])
+        self.assertEqual(result['errors'][0]['message'], 'You have not liked such a post')
+        self.assertCounted(like.post, 'likes_count', Like.objects)
+
+    def test_concurrent_comment_deletes_count_once(self):
+        comment = Comment.objects.filter(comment_by=self.users[1]).select_related('post').first()
+        with self.deleted_meanwhile('get', Comment, 'comments_count'):
+            result = self.commit_operation('mutation ($id: Int!) { deleteComment(id: $id) { ok } }', {'id': comment.id}, self.users[1])
+        self.assertEqual(result['errors'][0]['message'], 'Comment does not exist')
+        self.assertCounted(comment.post, 'comments_count', Comment.objects)
+
+    def test_concurrent_repost_deletes_count_once(self):
+        repost = Repost.objects.filter(repost_by=self.users[1]).select_related('post').first()
+        with self.deleted_meanwhile('get', Repost, 'reposts_count'):
+            result = self.commit_operation('mutation ($id: Int!) { deleteRepost(id: $id) { ok } }', {'id': repost.id}, self.users[1])
+        self.assertEqual(result['errors'][0]['message'], 'Repost does not exist')
+        self.assertCounted(repost.post, 'reposts_count', Repost.objects)
+
+
+class PreviewTests(GraphQLTestMixin, TestCase):
+    query = 'query { posts(first: 50) { edges { node { id comments { id } reposts { id } } } } }'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed()
+
+    def newest(self, related, size):
+        return {
+            post_id: [str(item.id) for item in related.filter(post_id=post_id).order_by('-created_at', '-id')[:size]]
+            for post_id in Post.objects.values_list('id', flat=True)
+        }
+
+    @override_settings(POST_PREVIEW_SIZE=1)
+    def test_posts_return_their_newest_comments_and_reposts(self):
+        self.assertTrue(any(len(items) > 1 for items in self.newest(Comment.objects, None).values()))
+        result, _ = self.run_operation(self.query, user=self.users[0])
+        nodes = {int(edge['node']['id']): edge['node'] for edge in result['data']['posts']['edges']}
+        comments, reposts = self.newest(Comment.objects, 1), self.newest(Repost.objects, 1)
+        for post_id, node in nodes.items():
+            self.assertEqual([item['id'] for item in node['comments']], comments[post_id])
+            self.assertEqual([item['id'] for item in node['reposts']], reposts[post_id])
+
+
+class BulkCreatePostsTests(GraphQLTestMixin, TestCase):
+    query = '''mutation ($tweets: [String!]!) {
+        bulkCreatePosts(tweets: $tweets) { ok results { index ok message post { post } } }
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed()
+
+    def test_results_follow_the_input_order(self):
+        result = self.commit_operation(self.query, {'tweets': ['first', ' ', 'second', '']}, self.users[1])
+        results = result['data']['bulkCreatePosts']['results']
+        self.assertEqual([(item['index'], item['ok'], item['message']) for item in results], [
+            (0, True, None), (1, False, 'A post cannot be empty'), (2, True, None), (3, False, 'A post cannot be empty'),
+        ])
+        self.assertEqual([results[0]['post']['post'], results[2]['post']['post']], ['first', 'second'])
+        # in the timelines of the author and of their followers
+        posts = Post.objects.filter(created_by=self.users[1], post__in=['first', 'second'])
+        owners = set(TimelineEntry.objects.filter(post__in=posts).values_list('owner_id', flat=True))
+        followers = set(Following.objects.filter(following=self.users[1]).values_list('follower_id', flat=True))
+        self.assertEqual(owners, followers | {self.users[1].id})
+        self.assertEqual(TimelineEntry.objects.filter(post__in=posts).count(), 2 * len(owners))
+
+    @override_settings(BULK_MUTATION_MAX_ITEMS=2)
+    def test_at_most_the_cap_is_accepted(self):
+        result = self.commit_operation(self.query, {'tweets': ['one', 'two', 'three']}, self.users[1])
+        self.assertEqual(result['errors'][0]['message'], 'At most 2 posts can be created at once')
+        self.assertFalse(Post.objects.filter(post__in=['one', 'two', 'three']).exists())
+
+
+def image_upload(size=(2000, 1000), image_format='PNG', name='photo.png'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 80, 40)).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{image_format.lower()}')
+
+
+class MediaTests(GraphQLTestMixin, TestCase):
+    query = '''mutation ($tweet: String!, $media: Upload) {
+        createPost(tweet: $tweet, media: $media) { ok post { id mediaUrl mediaVariants { name format width height url } } }
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed()
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.cache(size=10 * 1024 * 1024)
+
+    def cache(self, size):
+        """Points the variant cache at an empty directory bounded to `size` bytes."""
+        settings = override_settings(
+            MEDIA_ROOT=self.media_root, MEDIA_PROCESSING='inline',
+            MEDIA_VARIANT_CACHE_DIR=Path(tempfile.mkdtemp(dir=self.media_root)), MEDIA_VARIANT_CACHE_SIZE=size,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def send(self, upload):
+        """Sends createPost with `upload` as a multipart request."""
+        operations = {'query': self.query, 'variables': {'tweet': 'a photo', 'media': None}}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/graphql/', {
+                'operations': json.dumps(operations), 'map': json.dumps({'0': ['variables.media']}), '0': upload,
+            }, HTTP_AUTHORIZATION=f'JWT {get_token(self.users[0])}')
+        return response.json()
+
+    def upload(self, upload):
+        """The post createPost makes of `upload`."""
+        result = self.send(upload)
+        self.assertNotIn('errors', result, result)
+        return result['data']['createPost']['post']
+
+    def fetch(self, post, name, extension):
+        """The bytes of a variant of an uploaded post, fetched by its URL."""
+        url, = [
+            variant['url'] for variant in post['mediaVariants'] if (variant['name'], variant['format']) == (name, extension)
+        ]
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        return b''.join(response.streaming_content)
+
+    def delete(self, post):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/graphql/', {'query': 'mutation ($id: Int!) { deletePost(id: $id) { ok } }', 'variables': {'id': int(post['id'])}},
+                content_type='application/json', HTTP_AUTHORIZATION=f'JWT {get_token(self.users[0])}',
+            )
+        self.assertNotIn('errors', response.json())
+
+    def test_repeat_uploads_share_one_blob(self):
+        first, second = self.upload(image_upload()), self.upload(image_upload(name='again.png'))
+        self.assertEqual(first['mediaUrl'], second['mediaUrl'])
+        blob = Media.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertTrue(first['mediaUrl'].startswith('/media/blobs/'))
+        self.assertEqual([path.name for path in (self.media_root / 'blobs').rglob('*.png')], [f'{blob.sha256}.png'])
+
+    def test_variants_are_rendered_when_first_fetched(self):
+        post = self.upload(image_upload())
+        variants = {(variant['name'], variant['format']): variant for variant in post['mediaVariants']}
+        self.assertEqual(set(variants), {(name, extension) for name in ('thumbnail', 'medium') for extension in ('webp', 'jpeg')})
+        self.assertEqual((variants['thumbnail', 'webp']['width'], variants['thumbnail', 'webp']['height']), (320, 160))
+        self.assertEqual(Image.open(io.BytesIO(self.fetch(post, 'medium', 'jpeg'))).size, (1080, 540))
+        thumbnail = self.fetch(post, 'thumbnail', 'webp')
+        self.assertEqual(Image.open(io.BytesIO(thumbnail)).size, (320, 160))
+        with mock.patch.object(media.pool, 'render') as render:
+            self.assertEqual(self.fetch(post, 'thumbnail', 'webp'), thumbnail)
+        render.assert_not_called()
+
+    def test_the_response_serves_variant_urls(self):
+        post_id = int(self.upload(image_upload())['id'])
+        query = 'query ($id: Int) { post(id: $id) { mediaUrl mediaVariants(format: "webp") { name url } } }'
+        result, _ = self.run_operation(query, {'id': post_id}, self.users[0])
+        post = result['data']['post']
+        self.assertEqual([variant['name'] for variant in post['mediaVariants']], ['medium', 'thumbnail'])
+        self.assertTrue(all(variant['url'].endswith('.webp') for variant in post['mediaVariants']))
+        self.assertEqual(self.client.get(post['mediaVariants'][0]['url'].replace('medium', 'huge')).status_code, 404)
+
+    def test_small_images_are_not_scaled_up(self):
+        post = self.upload(image_upload(size=(100, 50), image_format='JPEG', name='small.jpg'))
+        self.assertEqual({(variant['width'], variant['height']) for variant in post['mediaVariants']}, {(100, 50)})
+        self.assertEqual(Image.open(io.BytesIO(self.fetch(post, 'medium', 'webp'))).size, (100, 50))
+
+    def test_the_least_recently_used_variants_are_evicted(self):
+        post = self.upload(image_upload())
+        sizes = {variant: len(self.fetch(post, *variant)) for variant in [('thumbnail', 'webp'), ('medium', 'webp')]}
+        # room for both webp variants but not the jpeg thumbnail as well
+        self.cache(size=sum(sizes.values()))
+        for variant in [('thumbnail', 'webp'), ('thumbnail', 'jpeg'), ('thumbnail', 'webp'), ('medium', 'webp')]:
+            self.fetch(post, *variant)
+        cached = sorted(path.name for path in settings.MEDIA_VARIANT_CACHE_DIR.rglob('*') if path.is_file())
+        self.assertEqual(cached, ['medium-1080-q80.webp', 'thumbnail-320-q80.webp'])
+
+    def test_deleting_the_last_post_collects_the_blob(self):
+        first, second = self.upload(image_upload()), self.upload(image_upload())
+        self.fetch(first, 'thumbnail', 'jpeg')
+        blob = Media.objects.get()
+        self.delete(first)
+        self.assertEqual(Media.objects.get().ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.file.name))
+        self.delete(second)
+        self.assertFalse(Media.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+        self.assertFalse(any(path.is_file() for path in settings.MEDIA_VARIANT_CACHE_DIR.rglob('*')))
+
+    def test_a_failed_post_releases_its_upload(self):
+        with mock.patch('posts.timeline.fan_out', side_effect=DatabaseError('lost the connection')):
+            result = self.send(image_upload())
+        self.assertIn('errors', result)
+        self.assertFalse(Post.objects.filter(post='a photo').exists())
+        self.assertFalse(Media.objects.exists())
+        self.assertFalse(any(path.is_file() for path in (self.media_root / 'blobs').rglob('*')))
+
+    def test_only_images_are_accepted(self):
+        result = self.send(SimpleUploadedFile('notes.txt', b'not an image', content_type='text/plain'))
+        self.assertEqual(result['errors'][0]['message'], 'Media must be an image')
+        self.assertFalse(Post.objects.filter(post='a photo').exists())
+        self.assertFalse(Media.objects.exists())
+
+
+class HashtagTests(GraphQLTestMixin, TestCase):
+    posts_query = '''query ($hashtag: String!, $after: String) {
+        postsByHashtag(hashtag: $hashtag, first: 3, after: $after) { edges { node { id } } pageInfo { hasNextPage endCursor } }
+    }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed()
+
+    def setUp(self):
+        super().setUp()
+        hashtags.trends.reset()
+        self.addCleanup(hashtags.trends.reset)
+
+    def send(self, query, variables=None):
+        """Runs an operation as the viewer and commits it."""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/graphql/', {'query': query, 'variables': variables or {}},
+                content_type='application/json', HTTP_AUTHORIZATION=f'JWT {get_token(self.users[0])}',
+            )
+        result = response.json()
+        self.assertNotIn('errors', result, result)
+        return result['data']
+
+    def tagged(self, name):
+        ids, after = [], None
+        while True:
+            page = self.send(self.posts_query, {'hashtag': name, 'after': after})['postsByHashtag']
+            ids += [int(edge['node']['id']) for edge in page['edges']]
+            if not page['pageInfo']['hasNextPage']:
+                return ids
+            after = page['pageInfo']['endCursor']
+
+    def test_hashtags_are_extracted(self):
+        self.assertEqual(
+            hashtags.extract('#Django and #django, #2023 &#39; mail#me (#GraphQL_tips) #über'),
+            ['django', 'graphql_tips', 'über'],
+        )
+
+    def test_posts_by_hashtag_pages_newest_first(self):
+        expected = list(Post.objects.filter(post__contains='#django').order_by('-id').values_list('id', flat=True))
+        self.assertEqual(self.tagged('#DJANGO'), expected)
+        self.assertEqual(self.tagged('nothing'), [])
+
+    def test_edits_retag_a_post(self):
+        post_id = int(self.send('mutation { createPost(tweet: "#coffee before #deploy") { post { id } } }')['createPost']['post']['id'])
+        self.assertEqual(self.tagged('coffee'), [post_id])
+        self.send(f'mutation {{ updatePost(id: {post_id}, post: "#deploy after #music") {{ ok }} }}')
+        self.assertEqual((self.tagged('coffee'), self.tagged('deploy'), self.tagged('music')), ([], [post_id], [post_id]))
+        self.assertEqual(PostHashtag.objects.filter(post_id=post_id).count(), 2)
+        self.assertEqual(Hashtag.objects.filter(name__in=['coffee', 'deploy', 'music']).count(), 3)
+
+    def test_trending_hashtags_count_new_posts(self):
+        tweets = ['#launch day', '#launch again', 'more #launch and #coffee', '#coffee', '#news']
+        self.send('mutation ($tweets: [String!]!) { bulkCreatePosts(tweets: $tweets) { ok } }', {'tweets': tweets[:3]})
+        for tweet in tweets[3:]:
+            self.send('mutation ($tweet: String!) { createPost(tweet: $tweet) { ok } }', {'tweet': tweet})
+        # done by the worker of a served process
+        hashtags.trends.checkpoint()
+        trending = self.send('{ trendingHashtags(window: "hour", first: 2) { name count } }')['trendingHashtags']
+        self.assertEqual(trending, [{'name': 'launch', 'count': 3}, {'name': 'coffee', 'count': 2}])
+
+    def test_hashtags_leave_the_window(self):
+        self.send('mutation { createPost(tweet: "#launch") { ok } }')
+        later = time.time() + settings.HASHTAG_TREND_WINDOWS['hour'] + 1
+        with mock.patch('posts.hashtags.time.time', return_value=later):
+            hashtags.trends.checkpoint()
+            hour = self.send('{ trendingHashtags(window: "hour") { name } }')['trendingHashtags']
+            day = self.send('{ trendingHashtags(window: "day") { name } }')['trendingHashtags']
+        self.assertEqual((hour, day), ([], [{'name': 'launch'}]))
+
+    def test_trends_are_checkpointed_off_the_request_path(self):
+        trends = hashtags.Trends()
+        checkpointed = threading.Event()
+        threads = []
+
+        def failing_checkpoint():
+            threads.append(threading.current_thread())
+            checkpointed.set()
+            raise DatabaseError('no such table: posts_trendbucket')
+
+        with mock.patch.object(trends, 'checkpoint', side_effect=failing_checkpoint):
+            trends.record(['launch'])
+            self.assertEqual(trends.top('hour', 5), [])
+            self.assertEqual(threads, [])
+            with self.assertLogs('posts.hashtags', 'ERROR'):
+                trends.start()
+                self.assertTrue(checkpointed.wait(5))
+                # the worker waits out the interval before it tries again
+                trends.stop()
+        self.assertEqual(len(threads), 2)
+        self.assertEqual(threads[0].name, 'trend-checkpoints')
+        self.assertIs(threads[1], threading.current_thread())
+
+    def test_space_saving_keeps_the_heavy_hitters(self):
+        sketch = hashtags.SpaceSaving(capacity=4)
+        stream = ['a'] * 30 + ['b'] * 20 + [f'rare{number}' for number in range(40)] + ['a'] * 10
+        for item in stream:
+            sketch.add(item)
+        self.assertLessEqual(len(sketch.counters), 4)
+        # a and b occur more than len(stream) / capacity times
+        for item, true_count in [('a', 40), ('b', 20)]:
+            count, error = sketch.counters[item]
+            self.assertGreaterEqual(count, true_count)
+            self.assertLessEqual(count - error, true_count)
@@ -0,0 +1,175 @@
+"""Home timelines.
+
+Posts by ordinary accounts are pushed into the timeline of every follower when
+they are written. Posts by accounts with more than TIMELINE_PUSH_THRESHOLD
+followers are not: they are pulled when a timeline is read and merged with the
+follower's precomputed entries, so one post never turns into millions of rows.
+"""
+import heapq
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from accounts.graph import follow_graph
+from accounts.models import Following
+from .models import Post, Repost, TimelineEntry
+
+# newest first; an original post sorts below the reposts of it made in the same instant
+TIMELINE_KEYS = ('-created_at', '-post_id', '-repost_id')
+
+
+def is_pulled(author_id):
+    """Whether the posts of an account are pulled at read time."""
+    return follow_graph.follower_count(author_id) > settings.TIMELINE_PUSH_THRESHOLD
+
+
+def _follower_ids(author):
+    # page through the followers by id so huge follow lists are never loaded at once
+    last_id = 0
+    while True:
+        ids = list(
+            Following.objects.filter(following=author, follower_id__gt=last_id)
+            .order_by('follower_id').values_list('follower_id', flat=True)[:settings.TIMELINE_FANOUT_BATCH_SIZE]
+        )
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def fan_out(post, repost=None):
+    """Writes a post (or a repost of it) into the timeline of its author and,
+    unless the author is pulled at read time, of every follower of the author.
+    Returns the number of entries written."""
+    author = repost.repost_by if repost else post.created_by
+    return fan_out_many(author, [(post, repost)])
+
+
+def fan_out_many(author, items):
+    """fan_out for many (post, repost) pairs by the same author: the followers
+    are read once and each batch of them gets the entries of every item."""
+
+    def entries(owner_ids):
+        return [
+            TimelineEntry(
+                owner_id=owner_id, post=post, repost=repost, author=author,
+                created_at=repost.created_at if repost else post.created_at,
+            )
+            for post, repost in items
+            for owner_id in owner_ids
+        ]
+
+    TimelineEntry.objects.bulk_create(entries([author.id]))
+    written = len(items)
+    if is_pulled(author.id):
+        return written
+    for follower_ids in _follower_ids(author):
+        TimelineEntry.objects.bulk_create(entries(follower_ids), batch_size=settings.TIMELINE_FANOUT_BATCH_SIZE)
+        written += len(follower_ids) * len(items)
+    return written
+
+
+def remove_post(post):
+    # a plain filtered delete is a single statement, where the cascade from
+    # Post would first load every entry into memory
+    TimelineEntry.objects.filter(post=post).delete()
+
+
+def remove_repost(repost):
+    TimelineEntry.objects.filter(repost=repost).delete()
+
+
+def backfill(owner, author):
+    """Copies the recent posts and reposts of a newly followed user into the
+    follower's timeline."""
+    backfill_many(owner, [author])
+
+
+def _latest(queryset, author_field, limit):
+    # the newest `limit` rows of each author in one query, rather than one per author
+    rank = Window(RowNumber(), partition_by=F(author_field), order_by=F('created_at').desc())
+    return queryset.annotate(author_rank=rank).filter(author_rank__lte=limit)
+
+
+def backfill_many(owner, authors):
+    """backfill for many newly followed users at once."""
+    authors = {author.id: author for author in authors if not is_pulled(author.id)}
+    if not authors:
+        return
+    limit = settings.TIMELINE_BACKFILL_SIZE
+    posts = _latest(Post.objects.filter(created_by_id__in=authors), 'created_by', limit)
+    reposts = _latest(Repost.objects.filter(repost_by_id__in=authors).select_related('post'), 'repost_by', limit)
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner=owner, post=post, author=authors[post.created_by_id], created_at=post.created_at)
+            for post in posts
+        ]
+        + [
+            TimelineEntry(
+                owner=owner, post=repost.post, repost=repost, author=authors[repost.repost_by_id],
+                created_at=repost.created_at,
+            )
+            for repost in reposts
+        ],
+        batch_size=settings.TIMELINE_FANOUT_BATCH_SIZE,
+    )
+
+
+def prune(owner, author):
+    TimelineEntry.objects.filter(owner=owner, author=author).delete()
+
+
+def sort_key(entry):
+    return (entry.created_at, entry.post_id, entry.repost_id or 0)
+
+
+def _older_than(cursor, post='post_id', repost='repost_id'):
+    created_at, post_id, repost_id = cursor
+    older = Q(created_at__lt=created_at) | Q(**{'created_at': created_at, f'{post}__lt': post_id})
+    if repost_id:
+        same_post = Q(**{'created_at': created_at, post: post_id})
+        if repost is None:
+            older |= same_post
+        else:
+            older |= same_post & (Q(**{f'{repost}__isnull': True}) | Q(**{f'{repost}__lt': repost_id}))
+    return older
+
+
+def read(owner, size, cursor=None):
+    """Returns up to `size` timeline entries older than `cursor` (a decoded
+    TIMELINE_KEYS tuple) and whether more remain.
+
+    The pushed entries and the posts and reposts of followed high-follower
+    accounts are each read as one ordered range and k-way merged.
+    """
+    pushed = TimelineEntry.objects.filter(owner=owner).select_related('post', 'repost', 'author')
+    if cursor:
+        pushed = pushed.filter(_older_than(cursor))
+    streams = [pushed.order_by('-created_at', '-post_id', F('repost_id').desc(nulls_last=True))[:size + 1]]
+
+    pulled = [followed_id for followed_id in follow_graph.following(owner.id) if is_pulled(followed_id)]
+    if pulled:
+        posts = Post.objects.filter(created_by_id__in=pulled).select_related('created_by')
+        reposts = Repost.objects.filter(repost_by_id__in=pulled).select_related('post', 'repost_by')
+        if cursor:
+            posts = posts.filter(_older_than(cursor, post='id', repost=None))
+            reposts = reposts.filter(_older_than(cursor, repost='id'))
+        streams.append(
+            TimelineEntry(owner=owner, post=post, author=post.created_by, created_at=post.created_at)
+            for post in posts.order_by('-created_at', '-id')[:size + 1]
+        )
+        streams.append(
+            TimelineEntry(owner=owner, post=repost.post, repost=repost, author=repost.repost_by, created_at=repost.created_at)
+            for repost in reposts.order_by('-created_at', '-post_id', '-id')[:size + 1]
+        )
+
+    entries = []
+    seen = set()
+    # a post can be both pushed and pulled if its author crossed the threshold
+    for entry in heapq.merge(*streams, key=sort_key, reverse=True):
+        if (entry.post_id, entry.repost_id) in seen:
+            continue
+        seen.add((entry.post_id, entry.repost_id))
+        entries.append(entry)
+        if len(entries) > size:
+            break
+    return entries[:size], len(entries) > size
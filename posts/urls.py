@@ -1,9 +0,0 @@
-from graphene_django.views import GraphQLView
-from django.views.decorators.csrf import csrf_exempt
-from django.urls import path
-from .query import schema
-
-
-urlpatterns = [
-  path("", csrf_exempt(GraphQLView.as_view(graphiql=True, schema=schema))),
-]
\ No newline at end of file
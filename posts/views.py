@@ -1,3 +1,20 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import FileResponse, Http404
+from django.views.decorators.http import require_safe
+from . import imaging
+from .media import variant_cache
+from .models import Media
 
-# Create your views here.
+
+@require_safe
+def media_variant_view(request, digest, variant, extension):
+    """A variant of a stored image, rendered on the first request for it.
+    The URL names the content, so it can be cached for good."""
+    if variant not in settings.MEDIA_VARIANTS or extension not in settings.MEDIA_VARIANT_FORMATS:
+        raise Http404('No such variant')
+    blob = Media.objects.filter(sha256=digest).first()
+    if blob is None:
+        raise Http404('No such media')
+    response = FileResponse(variant_cache.get(blob, variant, extension), content_type=imaging.FORMATS[extension][1])
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response